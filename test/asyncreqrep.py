@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+from tiipbusclient.asyncclient import AsyncClient
+from tiipbusclient.client import ThreadedClient, Callback
+
+
+class AsyncReqRepTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.c = await AsyncClient('async0', 26000, 'ff01::1').start()
+
+    async def asyncTearDown(self):
+        self.c.close()
+
+    async def test_request_threaded_client(self):
+        replyer = ThreadedClient('replyer0', 26000, 'ff01::1')
+        try:
+            replyer.registerBusInterface("echo", Callback(lambda msg: "Reply " + msg))
+            reply = await self.c.request("replyer0", "echo", "Hello", 5)
+            clientId, channel, mid, message = reply.split(',', 3)
+            self.assertEqual(message, "Reply Hello", "reply message did not match")
+        finally:
+            replyer.close()
+
+    async def test_coroutine_interface(self):
+        requester = ThreadedClient('requester0', 26000, 'ff01::1')
+        try:
+            async def echo(senderId, signal, mid, message):
+                await asyncio.sleep(0.01)
+                return senderId + ":" + message
+
+            self.c.registerBusInterface("echo", echo)
+            loop = asyncio.get_running_loop()
+            reply = await loop.run_in_executor(None, requester.request, "async0", "echo", "Hello", 5)
+            clientId, channel, mid, message = reply.split(',', 3)
+            self.assertEqual(message, "requester0:Hello", "reply message did not match")
+        finally:
+            requester.close()
+
+    async def test_many_outstanding_requests(self):
+        other = await AsyncClient('async1', 26000, 'ff01::1').start()
+        try:
+            other.registerBusInterface("double", lambda senderId, signal, mid, message: message * 2)
+            replies = await asyncio.gather(*[self.c.request("async1", "double", str(i), 5) for i in range(100)])
+            self.assertEqual([reply.split(',', 3)[3] for reply in replies], [str(i) * 2 for i in range(100)])
+        finally:
+            other.close()
@@ -0,0 +1,242 @@
+"""
+    Benchmarks of the multicast clients on the interface-local group ff01::1
+
+    Run from the repository root with: PYTHONPATH=. python test/benchmark.py [--quick] [--output results.json]
+    The results are written as JSON so runs of different releases can be compared.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from threading import Thread, Event, Lock
+from tiipbusclient.client import Client, ThreadedClient, DetailedCallback, Callback
+from tiipbusclient.dispatcher import Dispatcher
+from tiipbusclient.multicasting import ClientConstants
+
+PORT = 26000
+ADDR = 'ff01::1'
+
+
+def percentiles(samples):
+    """
+    :param samples: a list of durations in seconds
+    :return: a dict of count, mean and the 50, 90, 99 and 100 percentiles in microseconds
+    """
+    if not samples:
+        return dict(count=0)
+    samples = sorted(samples)
+
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6, 1)
+    return dict(count=len(samples), mean=round(sum(samples) / len(samples) * 1e6, 1), p50=at(0.5), p90=at(0.9),
+                p99=at(0.99), max=at(1.0))
+
+
+def startClient(clientId, **kwargs):
+    client = Client(clientId, PORT, ADDR, **kwargs)
+    Thread(target=client.run, daemon=True).start()
+    return client
+
+
+class Receiver(object):
+    """
+    Counts received publications and the time from sending, which the publisher puts first in each message
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.latencies = []
+        self.lock = Lock()
+        self.done = Event()
+
+    def __call__(self, senderId, signal, mid, message):
+        now = time.perf_counter()
+        sent = float(message[:message.index('|')])
+        with self.lock:
+            self.received += 1
+            self.latencies.append(now - sent)
+            if self.received >= self.expected:
+                self.done.set()
+
+
+def stamped(size):
+    stamp = '%.9f|' % time.perf_counter()
+    return stamp + 'x' * max(0, size - len(stamp))
+
+
+def benchPublish(sizes, count, timeout):
+    """
+    For each size, publish count messages back to back and measure throughput and loss, then publish one message
+    at a time, waiting for each to arrive, to measure the latency without queueing
+    """
+    results = []
+    publisher = startClient('bench-pub')
+    subscriber = startClient('bench-sub')
+    try:
+        for size in sizes:
+            n = max(10, count * 1024 // max(size, 1024))
+            receiver = Receiver(n)
+            subscriber.subscribe('bench/size', DetailedCallback(receiver))
+            start = time.perf_counter()
+            for _ in range(n):
+                publisher.publish(stamped(size), 'bench/size')
+            sendTime = time.perf_counter() - start
+            receiver.done.wait(timeout)
+            elapsed = time.perf_counter() - start
+            burst = dict(size=size, sent=n, received=receiver.received, sendTime=round(sendTime, 6),
+                         messagesPerSecond=round(receiver.received / elapsed, 1),
+                         megabytesPerSecond=round(receiver.received * size / elapsed / 1e6, 3),
+                         latency=percentiles(receiver.latencies))
+            subscriber.unsubscribe('bench/size')
+
+            latencies = []
+            for _ in range(min(n, 200)):
+                receiver = Receiver(1)
+                subscriber.subscribe('bench/size', DetailedCallback(receiver))
+                publisher.publish(stamped(size), 'bench/size')
+                if receiver.done.wait(1):
+                    latencies.extend(receiver.latencies)
+                subscriber.unsubscribe('bench/size')
+            results.append(dict(burst, fragments=-(-size // ClientConstants.DATAGRAMSIZE),
+                                unloadedLatency=percentiles(latencies)))
+    finally:
+        publisher.close()
+        subscriber.close()
+    return results
+
+
+def benchRequest(concurrencies, count, timeout):
+    """
+    Round trip time of requests to one replier from a number of threads sending requests at the same time
+    """
+    results = []
+    dispatcher = Dispatcher(workers=4)
+    replier = ThreadedClient('bench-rep', PORT, ADDR, dispatcher=dispatcher)
+    requester = startClient('bench-req')
+    try:
+        replier.registerBusInterface('echo', lambda client, senderId, signal, mid, message:
+                                     client.reply(message, senderId, signal, mid))
+        for concurrency in concurrencies:
+            latencies = []
+            lock = Lock()
+            timeouts = [0]
+
+            def run():
+                for _ in range(count // concurrency):
+                    start = time.perf_counter()
+                    reply = requester.request('bench-rep', 'echo', 'ping', timeout)
+                    with lock:
+                        if reply:
+                            latencies.append(time.perf_counter() - start)
+                        else:
+                            timeouts[0] += 1
+            threads = [Thread(target=run, daemon=True) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            results.append(dict(concurrency=concurrency, requests=len(latencies), timeouts=timeouts[0],
+                                requestsPerSecond=round(len(latencies) / elapsed, 1), rtt=percentiles(latencies)))
+    finally:
+        requester.close()
+        replier.close()
+        dispatcher.close()
+    return results
+
+
+def benchSubscribers(subscriberCounts, patternCounts, count, timeout):
+    """
+    Delivery rate with a growing number of subscribing clients, and with a growing number of subscription patterns
+    per client where one pattern matches
+    """
+    results = []
+    publisher = startClient('bench-fanout')
+    try:
+        for subscribers in subscriberCounts:
+            for patterns in patternCounts:
+                clients = [startClient('bench-fan%d' % i) for i in range(subscribers)]
+                receivers = [Receiver(count) for _ in clients]
+                for client, receiver in zip(clients, receivers):
+                    for i in range(patterns - 1):
+                        client.subscribe('other/%d/.*' % i, Callback(lambda message: None))
+                    client.subscribe('bench/fan.*', DetailedCallback(receiver))
+                start = time.perf_counter()
+                for _ in range(count):
+                    publisher.publish(stamped(100), 'bench/fanout')
+                for receiver in receivers:
+                    receiver.done.wait(timeout)
+                elapsed = time.perf_counter() - start
+                delivered = sum(receiver.received for receiver in receivers)
+                results.append(dict(subscribers=subscribers, patterns=patterns, sent=count, delivered=delivered,
+                                    deliveriesPerSecond=round(delivered / elapsed, 1),
+                                    latency=percentiles([l for r in receivers for l in r.latencies])))
+                for client in clients:
+                    client.close()
+    finally:
+        publisher.close()
+    return results
+
+
+def benchTiip(count, timeout):
+    """
+    Round trip time of the same request through TiipClient and through the raw Client
+    """
+    try:
+        from pytiip.tiip import TIIPMessage
+        from tiipbusclient.tiipclient import TiipClient
+    except ImportError:
+        return dict(skipped='pytiip is not installed')
+    replier = TiipClient('bench-tiip-rep')
+    replier.registerBusInterface('echo', lambda request: TIIPMessage(type='rep', ok=True, pl=request.pl,
+                                                                      sig=request.sig, mid=request.mid),
+                                 threaded=False)
+    requester = TiipClient('bench-tiip-req')
+    try:
+        tiip = []
+        for _ in range(count):
+            start = time.perf_counter()
+            if requester.request(TIIPMessage(targ=['bench-tiip-rep'], sig='echo', pl=['ping']), timeout):
+                tiip.append(time.perf_counter() - start)
+        raw = []
+        message = str(TIIPMessage(targ=['bench-tiip-rep'], sig='echo', pl=['ping'], src=['bench-tiip-req']))
+        for _ in range(count):
+            start = time.perf_counter()
+            if requester.c.request('bench-tiip-rep', 'echo', message, timeout):
+                raw.append(time.perf_counter() - start)
+        return dict(tiipClient=percentiles(tiip), client=percentiles(raw))
+    finally:
+        requester.close()
+        replier.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the multicast clients on ' + ADDR)
+    parser.add_argument('--quick', action='store_true', help='fewer messages, for a smoke test')
+    parser.add_argument('--output', help='file to write the JSON results to, standard output if not given')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds to wait for messages in each run')
+    args = parser.parse_args(argv)
+    count = 200 if args.quick else 5000
+    sizes = [64, 1024, 8192, ClientConstants.MAXSIZE * 2]
+    results = dict(
+        time=time.time(),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        quick=args.quick,
+        publish=benchPublish(sizes, count, args.timeout),
+        request=benchRequest([1, 4, 16], count // 5, args.timeout),
+        subscribers=benchSubscribers([1, 4] if args.quick else [1, 2, 4, 8], [1, 100], count // 2, args.timeout),
+        tiip=benchTiip(count // 10, args.timeout))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
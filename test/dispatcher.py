@@ -0,0 +1,144 @@
+import time
+import unittest
+from threading import Event, Lock
+from tiipbusclient.client import ThreadedClient
+from tiipbusclient.dispatcher import Dispatcher, DeliveryQueue
+
+
+class DispatcherTestCase(unittest.TestCase):
+
+    def test_ordered_per_key(self):
+        dispatcher = Dispatcher(workers=4)
+        results = dict()
+        lock = Lock()
+
+        def work(key, value):
+            time.sleep(0.0001)
+            with lock:
+                results.setdefault(key, []).append(value)
+
+        for i in range(200):
+            for key in ('a', 'b', 'c'):
+                dispatcher.submit(key, work, key, i)
+        dispatcher.close()
+        for key in ('a', 'b', 'c'):
+            self.assertEqual(results[key], list(range(200)), 'calls for ' + key + ' out of order')
+
+    def test_parallel_keys(self):
+        dispatcher = Dispatcher(workers=2)
+        release = Event()
+        done = Event()
+        keys = ['a', 'b']
+        while hash(keys[0]) % 2 == hash(keys[1]) % 2:
+            keys[1] += 'b'
+        dispatcher.submit(keys[0], release.wait, 5)
+        dispatcher.submit(keys[1], done.set)
+        self.assertTrue(done.wait(5), 'a blocked key stopped another key')
+        release.set()
+        dispatcher.close()
+
+    def __fill(self, overflow):
+        dispatcher = Dispatcher(workers=1, maxQueue=2, overflow=overflow)
+        release = Event()
+        results = []
+        drops = []
+        dispatcher.submit('k', release.wait, 5)
+        while dispatcher.depth():
+            time.sleep(0.001)
+        for i in range(4):
+            dispatcher.submit('k', results.append, i, onDrop=lambda i=i: drops.append(i))
+        release.set()
+        dispatcher.close()
+        return dispatcher, results, drops
+
+    def test_drop_newest(self):
+        dispatcher, results, drops = self.__fill(Dispatcher.DROP_NEWEST)
+        self.assertEqual(results, [0, 1])
+        self.assertEqual(drops, [2, 3])
+        self.assertEqual(dispatcher.dropped(), 2)
+
+    def test_drop_oldest(self):
+        dispatcher, results, drops = self.__fill(Dispatcher.DROP_OLDEST)
+        self.assertEqual(results, [2, 3])
+        self.assertEqual(drops, [0, 1])
+        self.assertEqual(dispatcher.dropped(), 2)
+
+    def test_threaded_client(self):
+        dispatcher = Dispatcher(workers=2)
+        sub = ThreadedClient('dispatched0', 26000, 'ff01::1', dispatcher=dispatcher)
+        pub = ThreadedClient('dispatchpub0', 26000, 'ff01::1')
+        try:
+            received = []
+            done = Event()
+
+            # noinspection PyUnusedLocal
+            def subCallback(client, senderId, signal, mid, message):
+                received.append(message)
+                if len(received) == 50:
+                    done.set()
+
+            sub.subscribe("ordered", subCallback)
+            for i in range(50):
+                pub.publish(str(i), "ordered")
+            self.assertTrue(done.wait(5), 'not all publications received')
+            self.assertEqual(received, [str(i) for i in range(50)])
+        finally:
+            pub.close()
+            sub.close()
+            dispatcher.close()
+
+    def test_delivery_queue(self):
+        queue = DeliveryQueue(3)
+        for i in range(3):
+            queue.put('a', i)
+        queue.put('b', 0)
+        queue.put('c', 0)
+        queue.put('d', 0)
+        self.assertEqual((len(queue), queue.conflated, queue.dropped), (3, 2, 1))
+        self.assertEqual([queue.get() for _ in range(3)], [0, 0, 0])
+        queue = DeliveryQueue(2, Dispatcher.DROP_NEWEST)
+        for i in range(3):
+            queue.put('a', i)
+        self.assertEqual([queue.get(), queue.get(), queue.dropped], [0, 1, 1])
+        queue.close()
+        self.assertIsNone(queue.get())
+        self.assertRaises(ValueError, DeliveryQueue, 2, Dispatcher.BLOCK)
+
+    def test_slow_subscriber(self):
+        sub = ThreadedClient('queuedsub0', 26000, 'ff01::1')
+        pub = ThreadedClient('queuedpub0', 26000, 'ff01::1')
+        try:
+            release = Event()
+            slow = []
+            fast = []
+            done = Event()
+
+            # noinspection PyUnusedLocal
+            def slowCallback(client, senderId, topic, mid, message):
+                release.wait(5)
+                slow.append((topic, message))
+
+            # noinspection PyUnusedLocal
+            def fastCallback(message):
+                fast.append(message)
+                if len(fast) == 60:
+                    done.set()
+
+            subscription = sub.subscribe('status/', slowCallback, maxQueue=16)
+            sub.subscribe('status/.*', fastCallback, threaded=False, detailed=False)
+            for i in range(20):
+                for topic in ('status/a', 'status/b', 'status/c'):
+                    pub.publish(str(i), topic)
+            self.assertTrue(done.wait(5), 'the fast subscription was held up')
+            release.set()
+            deadline = time.time() + 5
+            while subscription.depth() and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            self.assertEqual(subscription.dropped(), 0)
+            self.assertGreater(subscription.conflated(), 0)
+            self.assertEqual(len(slow) + subscription.conflated(), 60)
+            self.assertEqual(sorted(slow[-3:]), [('status/a', '19'), ('status/b', '19'), ('status/c', '19')])
+        finally:
+            pub.close()
+            sub.close()
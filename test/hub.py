@@ -0,0 +1,49 @@
+import unittest
+from queue import Queue
+from tiipbusclient import multicasting
+from tiipbusclient.client import ThreadedClient, Callback, DetailedCallback
+from tiipbusclient.hub import ClientHub
+
+
+class HubTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = ClientHub()
+        self.outside = ThreadedClient('outside', 26000, 'ff01::1')
+
+    def tearDown(self):
+        self.outside.close()
+        self.hub.close()
+
+    def test_request_reply(self):
+        first = self.hub.client('hub1')
+        second = self.hub.client('hub2')
+        first.registerBusInterface('name', Callback(lambda msg: 'hub1'))
+        second.registerBusInterface('name', Callback(lambda msg: 'hub2'))
+        self.assertEqual(self.outside.request('hub2', 'name', '', 10).split(',', 3)[3], 'hub2')
+        self.assertEqual(first.request('hub2', 'name', 'x' * 5000, 10).split(',', 3)[3], 'hub2')
+        replies = sorted(r.split(',', 3)[3] for r in self.outside.requestAll(['hub1', 'hub2'], 'name', '', 10))
+        self.assertEqual(replies, ['hub1', 'hub2'])
+
+    def test_publish(self):
+        received = Queue()
+        subscribers = [self.hub.client('sub' + str(i)) for i in range(3)]
+        for subscriber in subscribers:
+            subscriber.subscribe('news', DetailedCallback(
+                lambda senderId, topic, mid, message, name=subscriber.clientId: received.put((name, senderId, message))))
+        self.hub.client('quiet')
+        self.outside.publish('hello', 'news')
+        subscribers[0].publish('from inside', 'news')
+        messages = sorted(received.get(True, 10) for _ in range(5))
+        self.assertEqual(messages, [('sub0', 'outside', 'hello'), ('sub1', 'outside', 'hello'),
+                                    ('sub1', 'sub0', 'from inside'), ('sub2', 'outside', 'hello'),
+                                    ('sub2', 'sub0', 'from inside')])
+
+    def test_close_client(self):
+        client = self.hub.client('closing')
+        self.assertRaises(Exception, self.hub.client, 'closing')
+        client.close()
+        self.assertNotIn('closing', self.hub.clients)
+        self.hub.client('closing')
+        self.assertFalse(self.hub.closing)
+        self.assertIs(self.hub.socket, client.socket)
@@ -0,0 +1,74 @@
+import time
+import unittest
+from queue import Queue, Empty
+from tiipbusclient.client import Client, ThreadedClient, DetailedCallback
+from tiipbusclient.lastvalue import LastValueCache
+
+
+class LastValueTestCase(unittest.TestCase):
+
+    @staticmethod
+    def __stored(cache, count):
+        deadline = time.time() + 5
+        while len(cache.values) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_snapshot_subscription(self):
+        cache = LastValueCache()
+        publisher = ThreadedClient('lvcpub', 26000, 'ff01::1')
+        subscriber = ThreadedClient('lvcsub', 26000, 'ff01::1')
+        try:
+            publisher.publish('old', 'price/a')
+            publisher.publish('new', 'price/a')
+            mid = publisher.publish('only', 'price/b')
+            publisher.publish('other', 'volume/a')
+            self.__stored(cache, 3)
+            self.assertEqual(cache.values['price/a'][2], b'new')
+
+            received = Queue()
+            subscriber.subscribe('price/.*', DetailedCallback(lambda *args: received.put(args)), snapshot=True)
+            self.assertEqual([received.get(True, 5) for _ in range(2)],
+                             [('lvcpub', 'price/a', cache.values['price/a'][1], 'new'),
+                              ('lvcpub', 'price/b', mid, 'only')])
+            publisher.publish('live', 'price/a')
+            self.assertEqual(received.get(True, 5)[3], 'live')
+            self.assertEqual(cache.snapshots, 1)
+        finally:
+            subscriber.close()
+            publisher.close()
+            cache.close()
+
+    def test_paging_and_eviction(self):
+        cache = LastValueCache('lvc-small', maxTopics=20, maxReply=100)
+        publisher = ThreadedClient('lvcpub', 26000, 'ff01::1')
+        try:
+            for i in range(30):
+                publisher.publish('value %d' % i, 'level/%02d' % i)
+            deadline = time.time() + 5
+            while cache.evicted < 10 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(cache.values), 20)
+            values = publisher.snapshot('level/.*', 'lvc-small', 5)
+            self.assertEqual([topic for _, topic, _, _ in values], ['level/%02d' % i for i in range(10, 30)])
+            self.assertEqual(values[-1][3], 'value 29')
+            self.assertGreater(cache.snapshots, 2)  # Paged
+            self.assertEqual(publisher.snapshot('nothing/.*', 'lvc-small', 5), [])
+        finally:
+            publisher.close()
+            cache.close()
+
+    def test_no_cache(self):
+        publisher = ThreadedClient('lvcpub', 26000, 'ff01::1')
+        subscriber = ThreadedClient('lvcsub', 26000, 'ff01::1')
+        timeout = Client.SnapshotTimeout
+        Client.SnapshotTimeout = 0.5
+        try:
+            self.assertRaises(Empty, subscriber.snapshot, 'price/.*', 'lvc-missing', 0.5)
+            received = Queue()
+            subscriber.subscribe('price/.*', DetailedCallback(lambda *args: received.put(args)), 'lvc-missing')
+            publisher.publish('live', 'price/a')
+            self.assertEqual(received.get(True, 5)[3], 'live')
+        finally:
+            Client.SnapshotTimeout = timeout
+            subscriber.close()
+            publisher.close()
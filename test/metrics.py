@@ -0,0 +1,61 @@
+import unittest
+from threading import Event
+from tiipbusclient.client import ThreadedClient, Callback
+from tiipbusclient.metrics import Metrics, Histogram
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        for value in (0.5e-6, 3e-6, 3e-6, 1e-3, 100):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['max'], 100)
+        self.assertEqual(snapshot['p50'], 4e-6)
+        self.assertEqual(snapshot['p99'], 100)
+        self.assertEqual(sum(n for _, n in snapshot['buckets']), 5)
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.count('a')
+        metrics.count('a', 2)
+        metrics.observe('h', 0.01)
+        metrics.gauge('g', lambda: 7)
+        metrics.gauge('broken', lambda: 1 / 0)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'a': 3})
+        self.assertEqual(snapshot['gauges'], {'g': 7, 'broken': None})
+        self.assertEqual(snapshot['histograms']['h']['count'], 1)
+
+    def test_callback_names(self):
+        metrics = Metrics(maxCallbacks=2)
+        self.assertEqual([metrics.callbackName(topic) for topic in ('a', 'b', 'c', 'a', 'd')],
+                         ['callback/a', 'callback/b', 'callback/other', 'callback/a', 'callback/other'])
+
+    def test_exporter(self):
+        metrics = Metrics()
+        exported = Event()
+        metrics.addExporter(lambda snapshot: exported.set(), 0.01)
+        self.assertTrue(exported.wait(5))
+        metrics.close()
+
+    def test_client_metrics(self):
+        metrics = Metrics()
+        requester = ThreadedClient('metrics_req', 26000, 'ff01::1', metrics=metrics)
+        replyer = ThreadedClient('metrics_rep', 26000, 'ff01::1', metrics=Metrics())
+        try:
+            replyer.registerBusInterface("echo", Callback(lambda msg: msg))
+            self.assertIsNotNone(requester.request(replyer.clientId, "echo", "x" * 5000, 10))
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot['counters']['requests'], 1)
+            self.assertGreaterEqual(snapshot['counters']['datagramsSent'], 5)
+            self.assertGreaterEqual(snapshot['counters']['fragmentsReceived'], 5)
+            self.assertEqual(snapshot['histograms']['requestTime']['count'], 1)
+            self.assertEqual(snapshot['gauges']['reassemblyPending'], 0)
+            self.assertEqual(replyer.metrics.snapshot()['histograms']['callback/echo']['count'], 1)
+        finally:
+            requester.close()
+            replyer.close()
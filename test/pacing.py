@@ -0,0 +1,54 @@
+import select
+import socket
+import sys
+import time
+import unittest
+from tiipbusclient import multicasting
+from tiipbusclient.client import Client
+from tiipbusclient.pacing import TokenBucket, Pacer
+
+
+class PacingTestCase(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(10000, 2000)
+        self.assertEqual(bucket.delay(1500), 0.0)
+        self.assertAlmostEqual(bucket.delay(1500), 0.1, delta=0.01)  # 1000 bytes in debt
+        self.assertAlmostEqual(bucket.delay(1000), 0.2, delta=0.01)  # Queued behind the previous datagram
+
+    def test_pacer(self):
+        pacer = Pacer(channels={'pub/slow': (20000, 1000)})
+        start = time.monotonic()
+        for _ in range(5):
+            pacer.pace('pub/fast', 1000)
+        self.assertEqual(pacer.paced, 0)
+        for _ in range(5):
+            pacer.pace('pub/slow', 1000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        self.assertEqual(pacer.paced, 4)
+
+    def test_paced_send(self):
+        client = Client('paced', 26000, 'ff01::1', pacer=Pacer(200000, 2000))
+        try:
+            start = time.monotonic()
+            multicasting.send('x' * 20000, 'pub/paced', client)
+            self.assertGreaterEqual(time.monotonic() - start, 0.08)
+        finally:
+            client.close()
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'SO_RXQ_OVFL is Linux only')
+    def test_kernel_drops(self):
+        receiver = Client('receiver', 26000, 'ff01::1', receiveBuffer=4096)
+        sender = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        try:
+            self.assertTrue(receiver.dropCounting)
+            for i in range(200):
+                sender.sendto(b'sender,pub/flood,' + bytes(str(i), 'UTF-8') + b',' + b'x' * 1000, ('ff01::1', 26000))
+            while select.select([receiver.socket], [], [], 0.1)[0]:
+                multicasting.recvMessage(receiver)
+            sender.sendto(b'sender,pub/flood,last,x', ('ff01::1', 26000))
+            multicasting.recvMessage(receiver)  # The count is attached to the datagrams queued after the drops
+            self.assertGreater(receiver.kernelDrops, 0)
+        finally:
+            sender.close()
+            receiver.close()
@@ -0,0 +1,64 @@
+import time
+import unittest
+from queue import Empty
+from tiipbusclient.client import ThreadedClient
+from tiipbusclient.presence import Directory, Unreachable, presenceBody
+from tiipbusclient.transport import InProcessTransport
+
+
+class PresenceTestCase(unittest.TestCase):
+
+    def test_directory(self):
+        directory = Directory(misses=3, warmup=0)
+        t = time.monotonic()
+        directory.update('busy', presenceBody(1, 5, ['echo', 'time']), now=t)
+        directory.update('idle', presenceBody(2, 0, ['echo']), now=t)
+        self.assertEqual(directory.servers('echo', now=t + 1), ['idle', 'busy'])
+        self.assertEqual(directory.alive('busy', now=t + 1), (frozenset(['echo', 'time']), 5))
+        self.assertIsNone(directory.unreachable('busy', 'time', now=t + 1))
+        self.assertEqual(directory.unreachable('busy', 'sleep', now=t + 1), "does not serve sleep")
+        self.assertEqual(directory.unreachable('ghost', 'echo', now=t + 1), "is not on the bus")
+        self.assertEqual(directory.unreachable('busy', 'echo', now=t + 4), "stopped announcing itself")
+        self.assertEqual(directory.clients(now=t + 4), ['idle'])
+        directory.update('idle', presenceBody(0, 0, ()), now=t + 5)
+        self.assertEqual((directory.clients(now=t + 5), directory.departed), ([], 1))
+        directory.update('other', presenceBody(1, 0, ()), now=t + 4 + Directory.FORGET)
+        self.assertEqual(directory.unreachable('busy', 'echo', now=t + 4 + Directory.FORGET), "is not on the bus")
+
+    def test_warmup(self):
+        directory = Directory(warmup=60)
+        self.assertFalse(directory.ready())
+        self.assertIsNone(directory.unreachable('ghost', 'echo'))
+
+    def test_fail_fast(self):
+        server = ThreadedClient('server', 26004, 'ff01::1', transport=InProcessTransport)
+        requester = ThreadedClient('requester', 26004, 'ff01::1', transport=InProcessTransport)
+        try:
+            server.enablePresence(0.05)
+            requester.enablePresence(0.05)
+            server.registerBusInterface('echo', lambda client, senderId, signal, mid, message:
+                                        client.reply(message, senderId, signal, mid))
+            deadline = time.time() + 5
+            while (requester.servers('echo') != ['server'] or not requester.directory.ready()) and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(requester.servers('echo'), ['server'])
+            self.assertTrue(requester.request('server', 'echo', 'hello', 5).endswith(',hello'))
+            start = time.monotonic()
+            with self.assertRaises(Unreachable):
+                requester.request('ghost', 'echo', 'hello', 5)
+            with self.assertRaises(Empty):  # Also handled as a timeout
+                requester.request('server', 'sleep', 'hello', 5)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(len(list(requester.requestAll(['server', 'ghost'], 'echo', 'hi', 5))), 1)
+            self.assertLess(time.monotonic() - start, 1)
+
+            server.close()
+            deadline = time.time() + 5
+            while requester.servers('echo') and time.time() < deadline:
+                time.sleep(0.01)
+            with self.assertRaises(Unreachable):
+                requester.request('server', 'echo', 'hello', 5)
+        finally:
+            requester.close()
+            server.close()
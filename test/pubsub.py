@@ -1,5 +1,6 @@
 import unittest
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
+from tiipbusclient import multicasting
 from tiipbusclient.client import ThreadedClient
 
 
@@ -57,15 +58,69 @@ class PubSubTestCase(unittest.TestCase):
                     if pub_t.is_alive():
                         print("failed to terminate pub thread")
 
+    def __collect(self, pattern, count):
+        received = []
+        done = Event()
 
+        # noinspection PyUnusedLocal
+        def subCallback(senderId, topic, mid, message):
+            received.append((topic, message))
+            if len(received) == count:
+                done.set()
 
+        self.c.subscribe(pattern, subCallback, threaded=False)
+        return received, done
 
+    def test_publish_many(self):
+        pub = None
+        try:
+            pub, _ = self.__getClient('pub')
+            received, done = self.__collect("many/.*", 300)
+            messages = [("m" + str(i), "many/" + str(i % 3)) for i in range(297)] + [("x" * 3000, "many/large")]
+            mids = pub.publishMany(messages + [(bytearray(b"array"), "many/b"), (memoryview(b"view"), "many/v")])
+            self.assertEqual(len(set(mids)), 300)
+            self.assertTrue(done.wait(5), 'not all publications received')
+            self.assertEqual(received, [(channel, message) for message, channel in messages] +
+                             [("many/b", "array"), ("many/v", "view")])
+        finally:
+            if pub:
+                pub.close()
 
+    def test_publish_linger(self):
+        pub = None
+        try:
+            pub, _ = self.__getClient('pub')
+            pub.enableBatching(linger=0.05)
+            received, done = self.__collect("linger", 20)
+            for i in range(19):
+                pub.publish(str(i), "linger")
+            pub.publish(bytearray(b"19"), "linger")
+            self.assertTrue(done.wait(5), 'not all publications received')
+            self.assertEqual(received, [("linger", str(i)) for i in range(20)])
+        finally:
+            if pub:
+                pub.close()
 
+    def test_lazy_payloads(self):
+        pub = None
+        sub = ThreadedClient('lazy' + str(self.clientCount), 26000, 'ff01::1', lazyPayloads=True)
+        try:
+            pub, _ = self.__getClient('pub')
+            received = []
+            done = Event()
 
-
-
-
-
-
-
+            # noinspection PyUnusedLocal
+            def subCallback(senderId, topic, mid, message):
+                received.append(message)
+                done.set()
+
+            sub.subscribe("lazy", subCallback, threaded=False)
+            pub.publish("x" * 3000, "lazy")
+            self.assertTrue(done.wait(5), 'publication not received')
+            self.assertIsInstance(received[0], multicasting.Payload)
+            self.assertEqual(bytes(received[0]), b"x" * 3000)
+            self.assertEqual(str(received[0]), "x" * 3000)
+        finally:
+            sub.close()
+            if pub:
+                pub.close()
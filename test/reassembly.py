@@ -0,0 +1,270 @@
+import random
+import time
+import unittest
+from tiipbusclient import multicasting
+from tiipbusclient.multicasting import ClientConstants
+from tiipbusclient.reassembly import Reassembler
+from tiipbusclient.compression import Compression
+from tiipbusclient.retransmit import RetransmitBuffer
+from tiipbusclient.client import ThreadedClient, DetailedCallback
+from tiipbusclient.transport import InProcessTransport
+
+
+class FakeSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append(bytes(data))
+
+
+class FakeScatterSocket(FakeSocket):
+
+    def sendmsg(self, buffers, ancdata, flags, address):
+        self.sent.append(b''.join(buffers))
+
+
+class FakeClient:
+
+    def __init__(self, clientId):
+        self.clientId = clientId
+        self.ADDR = 'ff01::1'
+        self.PORT = 26000
+        self.socket = FakeSocket()
+        self.reassembler = Reassembler(10, 1024 * 1024, ClientConstants.MAXFRAGMENTS)
+
+
+class ReassemblyTestCase(unittest.TestCase):
+
+    def test_out_of_order(self):
+        sender = FakeClient('sender')
+        receiver = FakeClient('receiver')
+        message = ''.join(chr(ord('A') + i % 25) for i in range(10000))
+        mid = multicasting.send(message, 'pub/topic', sender)
+        datagrams = sender.socket.sent
+        self.assertGreater(len(datagrams), 2)
+        for datagram in datagrams:
+            self.assertLessEqual(len(datagram), ClientConstants.DATAGRAMSIZE)
+        random.shuffle(datagrams)
+        frames = [multicasting.handleDatagram(receiver, datagram) for datagram in datagrams]
+        self.assertEqual(frames[:-1], [None] * (len(datagrams) - 1))
+        self.assertEqual(frames[-1], 'sender,pub/topic,' + mid + ',' + message)
+        self.assertEqual(len(receiver.reassembler), 0)
+        self.assertEqual(receiver.reassembler.size, 0)
+
+    def test_fragments_hidden_from_old_peers(self):
+        sender = FakeClient('sender')
+        multicasting.send('x' * 5000, 'pub/topic', sender)
+        multicasting.send('small', 'pub/topic', sender)
+        channels = [datagram.split(b',')[1] for datagram in sender.socket.sent]
+        self.assertEqual(channels, [b'frg/pub/topic'] * (len(channels) - 1) + [b'pub/topic'])
+        self.assertEqual(multicasting.peekHeader(sender.socket.sent[0], len(sender.socket.sent[0]))[:2],
+                         ('sender', 'pub/topic'))
+
+    def test_scatter_gather_send(self):
+        receiver = FakeClient('receiver')
+        for message in (bytearray(b'x' * 5000), memoryview(b'y' * 5000), b'small'):
+            sender = FakeClient('sender')
+            sender.socket = FakeScatterSocket()
+            mid = multicasting.send(message, 'pub/topic', sender)
+            frames = [multicasting.handleDatagram(receiver, datagram) for datagram in sender.socket.sent]
+            self.assertEqual(frames[-1], 'sender,pub/topic,' + mid + ',' + bytes(message).decode())
+
+    def test_interleaved_messages(self):
+        first = FakeClient('first')
+        second = FakeClient('second')
+        receiver = FakeClient('receiver')
+        multicasting.send('1' * 5000, 'pub/one', first)
+        multicasting.send('2' * 5000, 'pub/two', second)
+        frames = []
+        for a, b in zip(first.socket.sent, second.socket.sent):
+            frames.append(multicasting.handleDatagram(receiver, a))
+            frames.append(multicasting.handleDatagram(receiver, b))
+        frames = [frame.split(',', 3) for frame in frames if frame]
+        self.assertEqual([(f[0], f[1], f[3]) for f in frames], [('first', 'pub/one', '1' * 5000),
+                                                                ('second', 'pub/two', '2' * 5000)])
+
+    def test_duplicate_fragment(self):
+        reassembler = Reassembler(10, 1024, 10)
+        self.assertIsNone(reassembler.add('c', 'm', 'pub/x', 0, 2, b'ab'))
+        self.assertIsNone(reassembler.add('c', 'm', 'pub/x', 0, 2, b'ab'))
+        self.assertEqual(reassembler.add('c', 'm', 'pub/x', 1, 2, b'cd'), b'abcd')
+
+    def test_expire(self):
+        reassembler = Reassembler(10, 1024, 10)
+        reassembler.add('c', 'm1', 'pub/x', 0, 2, b'ab', now=100)
+        reassembler.add('c', 'm2', 'pub/x', 0, 2, b'ab', now=105)
+        self.assertEqual(reassembler.expire(now=111), 1)
+        self.assertNotIn(('c', 'm1'), reassembler)
+        self.assertIn(('c', 'm2'), reassembler)
+        self.assertEqual(reassembler.size, 2)
+
+    def test_max_bytes(self):
+        reassembler = Reassembler(10, 10, 10)
+        reassembler.add('c', 'm1', 'pub/x', 0, 2, b'123456')
+        reassembler.add('c', 'm2', 'pub/x', 0, 2, b'123456')
+        self.assertNotIn(('c', 'm1'), reassembler)
+        self.assertIn(('c', 'm2'), reassembler)
+        self.assertEqual(reassembler.dropped, 1)
+
+    def test_legacy_fragments(self):
+        receiver = FakeClient('receiver')
+        header = b'old,pub/x,0123,'
+        first = header + b'A' * (ClientConstants.MAXSIZE - len(header))
+        self.assertIsNone(multicasting.handleDatagram(receiver, first))
+        frame = multicasting.handleDatagram(receiver, header + b'B')
+        self.assertEqual(frame, 'old,pub/x,0123,' + 'A' * (ClientConstants.MAXSIZE - len(header)) + 'B')
+
+    def test_skip_self(self):
+        client = FakeClient('me')
+        multicasting.send('hello', 'pub/x', client)
+        self.assertIsNone(multicasting.handleDatagram(client, client.socket.sent[0]))
+
+    def test_binary_frames(self):
+        sender = FakeClient('send,er')
+        sender.frameFormat = multicasting.BINARY_FRAMES
+        receiver = FakeClient('receiver')
+        for message in ('small', 'x' * 5000):
+            sender.socket.sent = []
+            mid = multicasting.send(message, 'pub/topic', sender)
+            self.assertEqual(sender.socket.sent[0][0], multicasting.BINARY_MAGIC)
+            datagrams = list(reversed(sender.socket.sent))
+            frames = [multicasting.parseDatagram(receiver, datagram, len(datagram)) for datagram in datagrams]
+            clientId, channel, receivedMid, body = frames[-1]
+            self.assertEqual((clientId, channel, receivedMid, bytes(body)), ('send,er', 'pub/topic', mid, message.encode()))
+
+    def test_binary_falls_back_to_text(self):
+        sender = FakeClient('sender')
+        sender.frameFormat = multicasting.BINARY_FRAMES
+        multicasting.send('reply', 'rep/other/sig', sender, 'not-a-uuid')
+        self.assertEqual(multicasting.handleDatagram(FakeClient('other'), sender.socket.sent[0]),
+                         'sender,rep/other/sig,not-a-uuid,reply')
+
+    def test_binary_skip_self(self):
+        client = FakeClient('me')
+        client.frameFormat = multicasting.BINARY_FRAMES
+        multicasting.send('hello', 'pub/x', client)
+        self.assertIsNone(multicasting.handleDatagram(client, client.socket.sent[0]))
+
+    def test_compressed_frames(self):
+        receiver = FakeClient('receiver')
+        message = '{"pl": ["repetitive payload"]}' * 500
+        for frameFormat in (multicasting.TEXT_FRAMES, multicasting.BINARY_FRAMES):
+            sender = FakeClient('sender')
+            sender.frameFormat = frameFormat
+            sender.compression = Compression(threshold=100)
+            sender.compression.setChannel('pub/raw', None)
+            mid = multicasting.send(message, 'pub/topic', sender)
+            self.assertEqual(len(sender.socket.sent), 1, 'compressed message should fit one datagram')
+            self.assertEqual(multicasting.handleDatagram(receiver, sender.socket.sent[0]),
+                             'sender,pub/topic,' + mid + ',' + message)
+            self.assertLess(sender.compression.ratio(), 0.1)
+            multicasting.send(message, 'pub/raw', sender)
+            self.assertGreater(len(sender.socket.sent), 2, 'compression should be off for pub/raw')
+
+    def test_compressed_fragments(self):
+        receiver = FakeClient('receiver')
+        sender = FakeClient('sender')
+        sender.compression = Compression(threshold=100)
+        message = bytes(random.getrandbits(8) for _ in range(3000)) + b'a' * 3000
+        mid = multicasting.send(message, 'pub/topic', sender)
+        self.assertGreater(len(sender.socket.sent), 1)
+        frames = [multicasting.parseDatagram(receiver, d, len(d)) for d in reversed(sender.socket.sent)]
+        self.assertEqual(bytes(frames[-1][3]), message)
+        self.assertEqual(frames[-1][2], mid)
+
+    def test_nack_retransmission(self):
+        sender = FakeClient('sender')
+        sender.retransmit = RetransmitBuffer(['pub/.*'])
+        receiver = FakeClient('receiver')
+        message = ''.join(chr(ord('A') + i % 25) for i in range(10000))
+        mid = multicasting.send(message, 'pub/topic', sender)
+        datagrams = sender.socket.sent
+        sender.socket.sent = []
+        for i, datagram in enumerate(datagrams):
+            if i not in (1, 3):
+                self.assertIsNone(multicasting.handleDatagram(receiver, datagram))
+        multicasting.sendNacks(receiver)
+        self.assertEqual(receiver.socket.sent, [], 'NACK sent before NACK_DELAY')
+        time.sleep(ClientConstants.NACK_DELAY * 2)
+        multicasting.sendNacks(receiver)
+        self.assertEqual(len(receiver.socket.sent), 1)
+        nack = receiver.socket.sent[0]
+        clientId, channel, nackMid, body = multicasting.parseDatagram(sender, nack, len(nack))
+        self.assertEqual((clientId, channel, nackMid, bytes(body)), ('receiver', 'nak/sender', mid, b'1,3'))
+        self.assertEqual(multicasting.handleNack(sender, nackMid, body), 2)
+        frames = [multicasting.handleDatagram(receiver, datagram) for datagram in sender.socket.sent]
+        self.assertEqual(frames[-1], 'sender,pub/topic,' + mid + ',' + message)
+
+    def test_nack_with_two_receivers(self):
+        dropped = []
+
+        class LossyTransport(InProcessTransport):
+            def deliver(self, datagram, address):
+                if not dropped and datagram.split(b',', 3)[2].endswith(b':1:5:r'):
+                    dropped.append(datagram)  # Lose the second fragment once
+                    return
+                InProcessTransport.deliver(self, datagram, address)
+
+        sender = ThreadedClient('nacksender', 26005, 'ff01::1', transport=InProcessTransport,
+                                retransmit=RetransmitBuffer())
+        lossy = ThreadedClient('lossy', 26005, 'ff01::1', transport=LossyTransport)
+        other = ThreadedClient('other', 26005, 'ff01::1', transport=InProcessTransport)
+        try:
+            received = {'lossy': [], 'other': []}
+            lossy.subscribe('big', DetailedCallback(lambda *args: received['lossy'].append(args)))
+            other.subscribe('big', DetailedCallback(lambda *args: received['other'].append(args)))
+            sender.publish('x' * 5000, 'big')
+            deadline = time.time() + 5
+            while not (received['lossy'] and received['other']) and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(ClientConstants.NACK_DELAY * 2 ** ClientConstants.NACK_RETRIES)  # Time for further NACKs
+            self.assertEqual(len(dropped), 1)
+            self.assertEqual((len(received['lossy']), len(received['other'])), (1, 1))
+            self.assertEqual(sender.retransmit.resent, 1)
+            self.assertEqual(other.reassembler.late, 1)
+            self.assertEqual(len(other.reassembler), 0)
+        finally:
+            other.close()
+            lossy.close()
+            sender.close()
+
+    def test_no_nack_without_retransmit(self):
+        sender = FakeClient('sender')
+        sender.retransmit = RetransmitBuffer(['pub/other'])
+        receiver = FakeClient('receiver')
+        multicasting.send('x' * 10000, 'pub/topic', sender)
+        multicasting.handleDatagram(receiver, sender.socket.sent[0])
+        self.assertEqual(receiver.reassembler.stale(0, 4, 100, now=time.time() + 1), [])
+        self.assertEqual(len(sender.retransmit.fragments), 0)
+
+    def test_filtered_before_reassembly(self):
+        sender = FakeClient('sender')
+        receiver = FakeClient('receiver')
+        receiver.accepts = lambda channel: channel == 'pub/wanted'
+        for frameFormat in (multicasting.TEXT_FRAMES, multicasting.BINARY_FRAMES):
+            sender.frameFormat = frameFormat
+            sender.socket.sent = []
+            multicasting.send('x' * 10000, 'pub/other', sender)
+            multicasting.send('small', 'req/someone/name', sender)
+            for datagram in sender.socket.sent:
+                self.assertIsNone(multicasting.parseDatagram(receiver, datagram, len(datagram)))
+            self.assertEqual(len(receiver.reassembler), 0)
+            sender.socket.sent = []
+            multicasting.send('y' * 10000, 'pub/wanted', sender)
+            frames = [multicasting.parseDatagram(receiver, d, len(d)) for d in sender.socket.sent]
+            self.assertEqual(bytes(frames[-1][3]), b'y' * 10000)
+
+    def test_payload(self):
+        data = bytearray('café'.encode('UTF-8'))
+        payload = multicasting.Payload(memoryview(data))
+        data[0:1] = b'X'  # A reused receive buffer
+        self.assertEqual(bytes(payload), 'café'.encode('UTF-8'))
+        self.assertEqual(len(payload), 5)
+        self.assertEqual(str(payload), 'café')
+        self.assertEqual(payload, 'café')
+        self.assertEqual(multicasting.decode(payload), 'café')
+        self.assertIs(multicasting.Payload.of(payload), payload)
+        view = memoryview(b'abc')
+        self.assertIs(multicasting.Payload(view).data, view)
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+import unittest
+from queue import Queue
+from tiipbusclient.client import ThreadedClient, DetailedCallback
+from tiipbusclient.recording import Recorder, Recording
+from tiipbusclient.transport import InProcessTransport
+
+
+class RecordingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bus.rec')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def __settle(recorder):
+        """
+        :return: the number of recorded datagrams once no more have arrived for a while
+        """
+        recorded = -1
+        while recorder.recorded != recorded:
+            recorded = recorder.recorded
+            time.sleep(0.05)
+        return recorded
+
+    def test_record_and_replay(self):
+        recorder = Recorder(self.path)
+        recorder.listen(26002, 'ff01::1', InProcessTransport)
+        publisher = ThreadedClient('recorded', 26002, 'ff01::1', transport=InProcessTransport)
+        try:
+            large = ''.join(chr(ord('A') + i % 25) for i in range(10000))
+            publisher.publish('first', 'status/a')
+            mid = publisher.publish(large, 'status/large')
+            recorded = self.__settle(recorder)
+            between = time.time()
+            time.sleep(0.05)
+            publisher.publish('last', 'status/b')
+            deadline = time.time() + 5
+            while recorder.recorded == recorded and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            publisher.close()
+            recorder.close()
+        recording = Recording(self.path)
+        try:
+            self.assertGreater(len(recording), 3)  # The large message is fragmented
+            self.assertEqual(len(list(recording.find(mid=mid))), len(recording) - 2)
+            self.assertEqual(len(list(recording.find(channel='pub/status/a'))), 1)
+            self.assertEqual([bytes(datagram).split(b',')[1] for _, datagram in recording.find(start=between)],
+                             [b'pub/status/b'])
+
+            replayed = ThreadedClient('replayer', 26003, 'ff01::1', transport=InProcessTransport)
+            receiver = ThreadedClient('receiver', 26003, 'ff01::1', transport=InProcessTransport)
+            try:
+                received = Queue()
+                receiver.subscribe('status/.*', DetailedCallback(lambda *args: received.put(args)))
+                start = time.monotonic()
+                self.assertEqual(recording.replay(replayed, speed=2), len(recording))
+                self.assertGreaterEqual(time.monotonic() - start, 0.02)
+                messages = [received.get(True, 5) for _ in range(3)]
+                self.assertEqual([(senderId, topic, message) for senderId, topic, _, message in messages],
+                                 [('recorded', 'status/a', 'first'), ('recorded', 'status/large', large),
+                                  ('recorded', 'status/b', 'last')])
+                self.assertEqual(messages[1][2], mid)
+            finally:
+                receiver.close()
+                replayed.close()
+        finally:
+            recording.close()
+
+    def test_attached(self):
+        recorder = Recorder(self.path)
+        client = ThreadedClient('attached', 26002, 'ff01::1', transport=InProcessTransport)
+        recorder.attach(client)
+        try:
+            client.publish('own', 'status/a')
+            deadline = time.time() + 5
+            while not recorder.recorded and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            client.close()
+            recorder.close()
+        recording = Recording(self.path)
+        try:
+            self.assertEqual(len(recording), 1)
+            self.assertEqual(bytes(recording.datagram(0)[1]).split(b',', 3)[3], b'own')
+        finally:
+            recording.close()
@@ -0,0 +1,58 @@
+import unittest
+from tiipbusclient.replycache import ReplyCache
+
+
+class ReplyCacheTestCase(unittest.TestCase):
+
+    def test_pending_then_cached(self):
+        cache = ReplyCache()
+        self.assertIsNone(cache.begin('c', 'sig', 'm', now=1))
+        self.assertIs(cache.begin('c', 'sig', 'm', now=2), ReplyCache.PENDING)
+        cache.store('c', 'sig', 'm', 'reply')
+        self.assertEqual(cache.begin('c', 'sig', 'm', now=3), b'reply')
+        self.assertIsNone(cache.begin('other', 'sig', 'm', now=3))
+        self.assertEqual((cache.hits, cache.duplicates), (1, 1))
+
+    def test_ttl(self):
+        cache = ReplyCache(ttl=10)
+        cache.begin('c', 'sig', 'm1', now=100)
+        cache.store('c', 'sig', 'm1', 'reply')
+        cache.begin('c', 'sig', 'm2', now=105)
+        self.assertIsNone(cache.begin('c', 'sig', 'm1', now=111))
+        self.assertIs(cache.begin('c', 'sig', 'm2', now=111), ReplyCache.PENDING)
+        self.assertEqual(cache.size, 0)
+
+    def test_bounds(self):
+        cache = ReplyCache(maxEntries=2, maxBytes=10)
+        for mid in ('m1', 'm2', 'm3'):
+            cache.begin('c', 'sig', mid, now=1)
+        self.assertEqual(len(cache), 2)
+        cache.store('c', 'sig', 'm2', '12345678')
+        cache.store('c', 'sig', 'm3', '12345678')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.begin('c', 'sig', 'm3', now=2), b'12345678')
+
+    def test_discard(self):
+        cache = ReplyCache()
+        cache.begin('c', 'sig', 'm', now=1)
+        cache.discard('c', 'sig', 'm')
+        self.assertIsNone(cache.begin('c', 'sig', 'm', now=2))
+
+    def test_abandon(self):
+        cache = ReplyCache()
+        cache.begin('c', 'sig', 'm1', now=1)
+        cache.begin('c', 'sig', 'm2', now=1)
+        cache.store('c', 'sig', 'm2', 'reply')
+        cache.abandon('c', 'sig', 'm1')
+        cache.abandon('c', 'sig', 'm2')
+        self.assertIsNone(cache.begin('c', 'sig', 'm1', now=2))
+        self.assertEqual(cache.begin('c', 'sig', 'm2', now=2), b'reply')
+
+    def test_running(self):
+        cache = ReplyCache(ttl=60, running=5)
+        cache.begin('c', 'sig', 'm', now=100)
+        self.assertIs(cache.begin('c', 'sig', 'm', now=104), ReplyCache.PENDING)
+        self.assertIsNone(cache.begin('c', 'sig', 'm', now=106))
+        self.assertIs(cache.begin('c', 'sig', 'm', now=110), ReplyCache.PENDING)
+        self.assertEqual((cache.duplicates, cache.restarted), (2, 1))
@@ -1,7 +1,13 @@
+import time
 import unittest
-from threading import Thread, Lock
+import uuid
+from queue import Queue
+from threading import Thread, Lock, Event
 from tiipbusclient.client import ThreadedClient
-from tiipbusclient.client import Callback
+from tiipbusclient.client import Callback, ThreadedDetailedCallback, DispatchedDetailedCallback
+from tiipbusclient.dispatcher import Dispatcher
+from tiipbusclient import multicasting
+from tiipbusclient.replycache import ReplyCache
 
 
 class ReqRepTestCase(unittest.TestCase):
@@ -64,15 +70,143 @@ class ReqRepTestCase(unittest.TestCase):
                     if req_t.is_alive():
                         print("failed to terminate pub thread")
 
+    def test_request_batched_large(self):
+        replyer = ThreadedClient('batched' + str(self.clientCount), 26000, 'ff01::1', batchReceive=True)
+        try:
+            message = "".join(chr(ord('A') + i % 25) for i in range(100000))
+            replyer.registerBusInterface("echo", Callback(lambda msg: msg[::-1]))
+            reply = self.c.request(replyer.clientId, "echo", message, 10)
+            clientId, channel, mid, body = reply.split(',', 3)
+            self.assertEqual(body, message[::-1], "reply message did not match")
+        finally:
+            replyer.close()
 
+    def test_request_binary_frames(self):
+        replyer = ThreadedClient('binary' + str(self.clientCount), 26000, 'ff01::1',
+                                 frameFormat=multicasting.BINARY_FRAMES)
+        try:
+            replyer.registerBusInterface("echo", Callback(lambda msg: msg + msg))
+            reply = self.c.request(replyer.clientId, "echo", "Hello" * 1000, 10)
+            clientId, channel, mid, body = reply.split(',', 3)
+            self.assertEqual(body, "Hello" * 2000, "reply message did not match")
+        finally:
+            replyer.close()
 
+    def test_request_all(self):
+        replyers = [ThreadedClient('all' + str(i) + '_' + str(self.clientCount), 26000, 'ff01::1') for i in range(3)]
+        try:
+            for replyer in replyers:
+                replyer.registerBusInterface("whoami", Callback(lambda msg, name=replyer.clientId: name))
+            ids = [replyer.clientId for replyer in replyers]
+            replies = [reply.split(',', 3) for reply in self.c.requestAll(ids, "whoami", "", 10)]
+            self.assertEqual(sorted(body for _, _, _, body in replies), sorted(ids))
+            self.assertEqual(len(set(mid for _, _, mid, _ in replies)), 1, "replies should share the request mid")
+
+            replies = list(self.c.requestAll(multicasting.ALL_RECEIVERS, "whoami", "", 10, count=2))
+            self.assertEqual(len(replies), 2)
+
+            replies = list(self.c.requestAll(ids, "whoami", "", 10, until=lambda frame: True))
+            self.assertEqual(len(replies), 1)
+            self.assertEqual(len(self.c.requestQueues), 0)
+
+            replies = list(self.c.requestAll(ids[:1] + ['missing'], "whoami", "", 0.5))
+            self.assertEqual([reply.split(',', 3)[3] for reply in replies], ids[:1])
+
+            pending = self.c.requestAll(ids, "whoami", "", 10)
+            self.assertEqual(len(self.c.requestQueues), 1)
+            pending.close()
+            self.assertEqual(len(self.c.requestQueues), 0)
+            self.c.requestAll(ids, "whoami", "", 10)  # Not iterated
+            self.assertEqual(len(self.c.requestQueues), 0)
+        finally:
+            for replyer in replyers:
+                replyer.close()
 
+    def test_reply_cache(self):
+        replyer = ThreadedClient('cached' + str(self.clientCount), 26000, 'ff01::1')
+        try:
+            calls = []
+            replyer.registerBusInterface("count", Callback(lambda msg: calls.append(msg) or str(len(calls))),
+                                         replyCache=ReplyCache())
+            mid = uuid.uuid4().hex
+            self.c.requestQueues[mid] = Queue()
+            try:
+                for _ in range(3):
+                    multicasting.send("Hello", 'req/' + replyer.clientId + '/count', self.c, mid)
+                replies = [self.c.requestQueues[mid].get(True, 10) for _ in range(3)]
+            finally:
+                self.c.requestQueues.pop(mid)
+            self.assertEqual([reply.split(',', 3)[3] for reply in replies], ['1', '1', '1'])
+            self.assertEqual(len(calls), 1)
+        finally:
+            replyer.close()
 
+    def test_reply_cache_failed_handler(self):
+        replyer = ThreadedClient('failing' + str(self.clientCount), 26000, 'ff01::1')
+        try:
+            calls = []
+
+            def handle(client, senderId, signal, mid, message):
+                calls.append(message)
+                if len(calls) == 1:
+                    raise Exception("first call fails")
+                if len(calls) == 2:
+                    return  # Forgets to reply
+                client.reply(str(len(calls)), senderId, signal, mid)
+
+            replyer.registerBusInterface("flaky", ThreadedDetailedCallback(handle), replyCache=ReplyCache())
+            mid = uuid.uuid4().hex
+            self.c.requestQueues[mid] = Queue()
+            try:
+                for _ in range(3):
+                    multicasting.send("Hello", 'req/' + replyer.clientId + '/flaky', self.c, mid)
+                    time.sleep(0.5)
+                reply = self.c.requestQueues[mid].get(True, 10)
+            finally:
+                self.c.requestQueues.pop(mid)
+            self.assertEqual(reply.split(',', 3)[3], '3')
+            self.assertEqual(len(calls), 3)
+        finally:
+            replyer.close()
 
-
-
-
-
-
-
-
+    def test_reply_cache_evicted_request(self):
+        dispatcher = Dispatcher(workers=1, maxQueue=1, overflow=Dispatcher.DROP_OLDEST)
+        replyer = ThreadedClient('evicting' + str(self.clientCount), 26000, 'ff01::1')
+        try:
+            release = Event()
+            calls = []
+
+            def handle(client, senderId, signal, mid, message):
+                calls.append(message)
+                if message == 'block':
+                    release.wait(5)
+                client.reply(message, senderId, signal, mid)
+
+            replyer.registerBusInterface("slow", DispatchedDetailedCallback(handle, dispatcher),
+                                         replyCache=ReplyCache())
+            mids = dict((message, uuid.uuid4().hex) for message in ('block', 'evicted', 'next'))
+            for mid in mids.values():
+                self.c.requestQueues[mid] = Queue()
+            try:
+                multicasting.send('block', 'req/' + replyer.clientId + '/slow', self.c, mids['block'])
+                deadline = time.time() + 5
+                while not calls and time.time() < deadline:
+                    time.sleep(0.01)
+                for message in ('evicted', 'next'):
+                    multicasting.send(message, 'req/' + replyer.clientId + '/slow', self.c, mids[message])
+                deadline = time.time() + 5
+                while not dispatcher.dropped() and time.time() < deadline:
+                    time.sleep(0.01)
+                release.set()
+                for message in ('block', 'next'):
+                    self.assertEqual(self.c.requestQueues[mids[message]].get(True, 10).split(',', 3)[3], message)
+                multicasting.send('evicted', 'req/' + replyer.clientId + '/slow', self.c, mids['evicted'])
+                reply = self.c.requestQueues[mids['evicted']].get(True, 5)
+            finally:
+                for mid in mids.values():
+                    self.c.requestQueues.pop(mid)
+            self.assertEqual(reply.split(',', 3)[3], 'evicted')
+            self.assertEqual(calls, ['block', 'next', 'evicted'])
+        finally:
+            replyer.close()
+            dispatcher.close()
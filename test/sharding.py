@@ -0,0 +1,88 @@
+import unittest
+from queue import Queue, Empty
+from tiipbusclient.client import ThreadedClient, Callback, DetailedCallback
+from tiipbusclient.sharding import Sharding
+
+GROUPS = ['ff01::1:1', 'ff01::1:2', 'ff01::1:3']
+
+
+class ShardingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sharding = Sharding(GROUPS)
+
+    def test_group_for(self):
+        sharding = self.sharding
+        self.assertEqual(sharding.groupFor('pub/sensors/1'), sharding.groupOf('sensors'))
+        self.assertEqual(sharding.groupFor('shm/sensors'), sharding.groupOf('sensors'))
+        self.assertEqual(sharding.groupFor('req/server/name'), sharding.groupOf('server'))
+        self.assertEqual(sharding.groupFor('rep/client/name'), sharding.groupOf('client'))
+        self.assertEqual(sharding.groupFor('nak/client'), sharding.groupOf('client'))
+        self.assertIsNone(sharding.groupFor('req/*/name'))
+        self.assertIsNone(sharding.groupFor('req/a|b/name'))
+        self.assertIsNone(sharding.groupFor('bat/1'))
+
+    def test_groups_for_pattern(self):
+        sharding = self.sharding
+        self.assertEqual(sharding.groupsForPattern('sensors/'), [sharding.groupOf('sensors')])
+        self.assertEqual(sharding.groupsForPattern('sensors$'), [sharding.groupOf('sensors')])
+        self.assertEqual(sharding.groupsForPattern('sensors'), GROUPS)  # Also matches 'sensorsX'
+        self.assertEqual(sharding.groupsForPattern('.*'), GROUPS)
+        self.assertEqual(sharding.groupsForPattern('(a|b)/'), GROUPS)
+        self.assertEqual(sharding.groupsForPattern('a/|b'), GROUPS)
+        self.assertEqual(sharding.groupsForPattern('a$|b/'), GROUPS)
+        self.assertEqual(sharding.groupsForPattern('a/?'), GROUPS)  # Also matches 'ab'
+        self.assertEqual(sharding.groupsForPattern('a/(x|y)'), [sharding.groupOf('a')])
+        self.assertEqual(sharding.groupsForPattern('a/[|]'), [sharding.groupOf('a')])
+        self.assertEqual(sharding.groupsForPattern('a/\\|'), [sharding.groupOf('a')])
+
+    def test_sharded_clients(self):
+        sharding = self.sharding
+        topics = dict()
+        for i in range(100):
+            topics.setdefault(sharding.groupOf('t' + str(i)), 't' + str(i))
+        del topics[sharding.groupOf('shardserver')]  # Joined for requests anyway
+        wanted, other = topics.values()
+        server = ThreadedClient('shardserver', 26000, 'ff01::1', sharding=sharding)
+        client = ThreadedClient('shardclient', 26000, 'ff01::1', sharding=sharding)
+        try:
+            server.registerBusInterface('name', Callback(lambda msg: 'server'))
+            self.assertEqual(client.request('shardserver', 'name', '', 10).split(',', 3)[3], 'server')
+            self.assertEqual(client.request('shardserver', 'name', 'x' * 5000, 10).split(',', 3)[3], 'server')
+            replies = list(client.requestAll('*', 'name', '', 10, count=1))
+            self.assertEqual(replies[0].split(',', 3)[3], 'server')
+
+            received = Queue()
+            server.subscribe(wanted + '/', DetailedCallback(
+                lambda senderId, topic, mid, message: received.put((topic, message))))
+            server.subscribe(other + '/', DetailedCallback(
+                lambda senderId, topic, mid, message: received.put((topic, message))))
+            server.unsubscribe(other + '/')
+            client.publish('skipped', other + '/1')
+            client.publish('hello', wanted + '/1')
+            self.assertEqual(received.get(True, 10), (wanted + '/1', 'hello'))
+            self.assertRaises(Empty, received.get, True, 0.2)
+            self.assertNotIn(sharding.groupOf(other), server.memberships.counts)
+        finally:
+            client.close()
+            server.close()
+
+    def test_alternation_pattern(self):
+        sharding = self.sharding
+        topics = dict()
+        for i in range(100):
+            topics.setdefault(sharding.groupOf('t' + str(i)), 't' + str(i))
+        del topics[sharding.groupOf('shardalt')]  # Joined for requests anyway
+        first, second = topics.values()
+        server = ThreadedClient('shardalt', 26000, 'ff01::1', sharding=sharding)
+        client = ThreadedClient('shardaltclient', 26000, 'ff01::1', sharding=sharding)
+        try:
+            received = Queue()
+            server.subscribe(first + '/|' + second + '/', DetailedCallback(
+                lambda senderId, topic, mid, message: received.put(topic)))
+            client.publish('one', first + '/1')
+            client.publish('two', second + '/1')
+            self.assertEqual(sorted(received.get(True, 10) for _ in range(2)), sorted([first + '/1', second + '/1']))
+        finally:
+            client.close()
+            server.close()
@@ -0,0 +1,69 @@
+import time
+import unittest
+from queue import Queue
+from tiipbusclient.client import ThreadedClient, DetailedCallback
+from tiipbusclient.multicasting import ClientConstants
+from tiipbusclient.sharedmemory import SharedRing, SharedMemoryPublisher, isInterfaceLocal
+
+
+class SharedMemoryTestCase(unittest.TestCase):
+
+    def test_ring(self):
+        writer = SharedRing(size=100)
+        reader = SharedRing(writer.name)
+        try:
+            first = writer.write(b'a' * 40)
+            second = writer.write(b'b' * 40)
+            self.assertEqual(reader.read(first, 40), 'a' * 40)
+            third = writer.write(b'c' * 40)
+            self.assertEqual(third, 100, 'payloads should not wrap around the end')
+            self.assertEqual(reader.read(third, 40), 'c' * 40)
+            self.assertIsNone(reader.read(first, 40), 'overwritten')
+            self.assertEqual(reader.read(second, 40), 'b' * 40, 'not yet overwritten')
+            self.assertIsNone(writer.write(b'x' * 101))
+        finally:
+            reader.close()
+            writer.close()
+
+    def test_interface_local(self):
+        self.assertTrue(isInterfaceLocal('ff01::1'))
+        self.assertTrue(isInterfaceLocal('FF11::1234'))
+        self.assertFalse(isInterfaceLocal('ff02::1'))
+        self.assertFalse(isInterfaceLocal('ff0e::1'))
+
+    def test_publish(self):
+        publisher = ThreadedClient('shmpub', 26000, 'ff01::1')
+        subscriber = ThreadedClient('shmsub', 26000, 'ff01::1')
+        try:
+            publisher.enableSharedMemory(['sensor/.*'])
+            received = Queue()
+            subscriber.subscribe('sensor/.*', DetailedCallback(lambda *args: received.put(args)))
+            message = ''.join(chr(ord('A') + i % 25) for i in range(ClientConstants.MAXSIZE * 3))
+            for i in range(5):
+                publisher.publish(str(i) + message, 'sensor/cam')
+            for i in range(5):
+                senderId, topic, mid, body = received.get(True, 10)
+                self.assertEqual((senderId, topic, body), ('shmpub', 'sensor/cam', str(i) + message))
+            self.assertEqual(list(publisher.sharedMemory.rings), ['sensor/cam'])
+        finally:
+            publisher.close()
+            subscriber.close()
+
+    def test_max_rings(self):
+        client = ThreadedClient('shmrings', 26000, 'ff01::1')
+        publisher = SharedMemoryPublisher(client, ringSize=1024, maxRings=2, idle=0.2)
+        try:
+            self.assertIsNotNone(publisher.publish('1', 'a'))
+            self.assertIsNotNone(publisher.publish('2', 'b'))
+            removed = publisher.rings['a'].name
+            self.assertIsNone(publisher.publish('3', 'c'), 'no ring is idle yet')
+            self.assertEqual(publisher.overflowed, 1)
+            time.sleep(0.3)
+            self.assertIsNotNone(publisher.publish('4', 'b'))
+            self.assertIsNotNone(publisher.publish('5', 'c'))
+            self.assertEqual(list(publisher.rings), ['b', 'c'])
+            self.assertEqual(publisher.removed, 1)
+            self.assertRaises(FileNotFoundError, SharedRing, removed)
+        finally:
+            publisher.close()
+            client.close()
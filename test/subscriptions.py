@@ -0,0 +1,38 @@
+import re
+import unittest
+from tiipbusclient.subscriptions import SubscriptionTable
+
+
+class SubscriptionsTestCase(unittest.TestCase):
+
+    patterns = ['pelle', 'mo.*', 'moj.*', 'sensor/1$', 'sensor/[0-9]+/temp', '(?i)CASE', r'(a)\1', '.*', 'x|y']
+    topics = ['pelle', 'pellefant', 'mojje', 'mo', 'm', 'sensor/1', 'sensor/12', 'sensor/12/temp', 'case',
+              'aa', 'ab', 'y', '', 'sensor/1\n']
+
+    def test_same_as_re_match(self):
+        table = SubscriptionTable()
+        for pattern in self.patterns:
+            table.add(pattern, pattern)
+        for topic in self.topics:
+            expected = tuple(p for p in self.patterns if re.match(p, topic))
+            self.assertEqual(table.match(topic), expected, 'wrong match for ' + repr(topic))
+            self.assertEqual(table.match(topic), expected, 'wrong cached match for ' + repr(topic))
+
+    def test_cache_invalidated(self):
+        table = SubscriptionTable()
+        table.add('mo.*', 'first')
+        self.assertEqual(table.match('mojje'), ('first',))
+        table.add('moj', 'second')
+        self.assertEqual(table.match('mojje'), ('first', 'second'))
+        table.add('mo.*', 'replaced')
+        self.assertEqual(table.match('mojje'), ('replaced', 'second'))
+        table.remove('mo.*')
+        self.assertEqual(table.match('mojje'), ('second',))
+        self.assertRaises(KeyError, table.remove, 'mo.*')
+
+    def test_cache_bounded(self):
+        table = SubscriptionTable(cacheSize=10)
+        table.add('t.*', 'callback')
+        for i in range(100):
+            table.match('t' + str(i))
+        self.assertEqual(len(table.index.cache), 10)
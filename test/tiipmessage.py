@@ -0,0 +1,69 @@
+import unittest
+from queue import Queue
+from pytiip.tiip import TIIPMessage
+from tiipbusclient.client import Callback, DetailedCallback
+from tiipbusclient.multicasting import Payload
+from tiipbusclient.tiipclient import TiipClient, CachedTiipMessage, SharedTiipMessage, _frameFor
+
+
+class TiipMessageTestCase(unittest.TestCase):
+
+    def test_shared_message(self):
+        body = str(TIIPMessage(type='pub', ch='status', src=['origin'], pl=[{'value': 1}]))
+        payload = Payload(body)
+        first = SharedTiipMessage(_frameFor(payload, 'mid1'))
+        second = SharedTiipMessage(_frameFor(payload, 'mid1'))
+        first.ch = 'changed'  # Before the frame is parsed
+        self.assertIsInstance(first, TIIPMessage)
+        self.assertEqual((first.ch, first.mid, first.pl), ('changed', 'mid1', [{'value': 1}]))
+        self.assertEqual((second.ch, second.mid), ('status', 'mid1'))
+        self.assertIs(first.pl, second.pl)  # Parsed once
+        self.assertEqual(TIIPMessage(str(second)).ch, 'status')
+        first.src.append('forwarder')
+        self.assertEqual(second.src, ['origin'])
+        self.assertIsNot(SharedTiipMessage(_frameFor(Payload(body), 'mid1')).pl, first.pl)
+        self.assertIsNot(SharedTiipMessage(_frameFor(body, 'mid1')).pl, first.pl)
+
+    def test_cached_message(self):
+        message = CachedTiipMessage(type='pub', ch='status', pl=[1])
+        text = str(message)
+        self.assertIs(str(message), text)
+        message.ch = 'other'
+        self.assertEqual(TIIPMessage(str(message)).ch, 'other')
+        message.pl.append(2)
+        message.changed()
+        self.assertEqual(TIIPMessage(str(message)).pl, [1, 2])
+
+    def test_subscriptions_share_parse(self):
+        sub = TiipClient('tiipsub')
+        pub = TiipClient('tiippub')
+        try:
+            received = Queue()
+            sub.subscribe('tiip', received.put)
+            sub.subscribe('ti', received.put)
+            message = CachedTiipMessage(ch='tiip', pl=['hello'])
+            pub.publish(message)
+            first, second = received.get(True, 10), received.get(True, 10)
+            self.assertEqual(first.pl, ['hello'])
+            self.assertIs(first.pl, second.pl)
+            self.assertIsNot(first, second)
+        finally:
+            pub.close()
+            sub.close()
+
+    def test_plain_callbacks_get_str(self):
+        sub = TiipClient('tiipplain')
+        pub = TiipClient('tiipplainpub')
+        try:
+            received = Queue()
+            sub.subscribe('plain', DetailedCallback(lambda senderId, topic, mid, message: received.put(message)))
+            sub.registerBusInterface('upper', Callback(lambda message: message.upper()))
+            pub.publish(TIIPMessage(ch='plain', pl=['hello']))
+            message = received.get(True, 10)
+            self.assertIsInstance(message, str)
+            self.assertEqual(TIIPMessage(message).pl, ['hello'])
+            reply = pub.c.request('tiipplain', 'upper', 'text', 10)
+            self.assertEqual(reply.split(',', 3)[3], 'TEXT')
+        finally:
+            pub.close()
+            sub.close()
@@ -0,0 +1,70 @@
+import tempfile
+import unittest
+from queue import Queue
+from tiipbusclient.client import ThreadedClient, Callback, DetailedCallback
+from tiipbusclient.sharding import Sharding
+from tiipbusclient.transport import InProcessTransport, UnixTransport
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def __exchange(self, transport, batchReceive=False):
+        replier = ThreadedClient('replier', 26001, 'ff01::1', transport=transport, batchReceive=batchReceive)
+        requester = ThreadedClient('requester', 26001, 'ff01::1', transport=transport)
+        try:
+            replier.registerBusInterface('echo', Callback(lambda msg: msg[::-1]))
+            message = ''.join(chr(ord('A') + i % 25) for i in range(20000))
+            reply = requester.request('replier', 'echo', message, 10)
+            self.assertEqual(reply.split(',', 3)[3], message[::-1])
+
+            received = Queue()
+            requester.subscribe('topic/.*', DetailedCallback(lambda *args: received.put(args)))
+            for i in range(100):
+                replier.publish(str(i), 'topic/' + str(i % 3))
+            publications = [received.get(True, 10) for _ in range(100)]
+            self.assertEqual([message for _, _, _, message in publications], [str(i) for i in range(100)])
+            self.assertEqual(publications[4][:2], ('replier', 'topic/1'))
+        finally:
+            requester.close()
+            replier.close()
+
+    def test_in_process(self):
+        self.__exchange(InProcessTransport)
+        self.assertNotIn((26001, 'ff01::1'), InProcessTransport.groups)
+
+    def test_in_process_batch_receive(self):
+        self.__exchange(InProcessTransport, batchReceive=True)
+
+    def test_in_process_groups(self):
+        first = InProcessTransport(1, 'a')
+        second = InProcessTransport(2, 'a')
+        try:
+            first.sendto(b'hello', None)
+            self.assertEqual(first.recvfrom(100)[0], b'hello')
+            self.assertRaises(BlockingIOError, second.recvfrom, 100, 1)
+        finally:
+            first.close()
+            second.close()
+
+    def test_in_process_bound(self):
+        sender = InProcessTransport(1, 'bound')
+        receiver = InProcessTransport(1, 'bound', maxBytes=250)
+        try:
+            for i in range(5):
+                sender.sendto(bytes([i]) * 100, None)
+            self.assertEqual(receiver.dropped, 3)
+            self.assertEqual([receiver.recvfrom(100)[0][0] for _ in range(2)], [0, 1])
+            sender.sendto(b'x' * 100, None)
+            self.assertEqual(receiver.recvfrom(100)[0], b'x' * 100)
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_sharding_needs_socket(self):
+        self.assertRaises(ValueError, ThreadedClient, 'sharded', 26001, 'ff01::1', transport=InProcessTransport,
+                          sharding=Sharding(['ff01::1:1']))
+        self.assertNotIn((26001, 'ff01::1'), InProcessTransport.groups)
+
+    def test_unix(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.__exchange(lambda port, addr: UnixTransport(port, addr, directory))
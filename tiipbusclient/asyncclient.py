@@ -0,0 +1,334 @@
+"""
+    Client for communication over UDP Multicast running on an asyncio event loop
+"""
+import asyncio
+import logging
+import time
+import uuid
+from tiipbusclient import multicasting
+from tiipbusclient.client import Callback, openMulticastSocket
+from tiipbusclient.multicasting import ClientConstants
+from tiipbusclient.reassembly import Reassembler
+from tiipbusclient.replycache import ReplyCache
+from tiipbusclient.metrics import measured
+from tiipbusclient.sharedmemory import SharedMemoryReader
+from tiipbusclient.subscriptions import SubscriptionTable
+
+__status__ = 'Development'
+
+
+class _BusProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        frame = multicasting.parseDatagram(self.client, data, len(data))
+        if frame:
+            self.client._dispatch(*frame)
+        elif len(self.client.reassembler) and ClientConstants.NACK_DELAY:
+            self.client._maintainWithin(ClientConstants.NACK_DELAY)
+
+    def error_received(self, exc):
+        pass  # UDP errors are not fatal, lost messages are handled with timeouts
+
+
+class AsyncClient:
+    """
+    A client for sending stringbased messages over UDP multicast in a request, reply, publish, subscribe manner using
+    a single asyncio event loop. It uses the same frames as Client and can talk to Client, ThreadedClient and
+    TiipClient peers.
+
+    Callbacks are either Callback objects, which are run inline on the event loop, or functions taking
+    (senderId, signal, mid, message). A function may be a coroutine function, in which case it runs as a task.
+    The return value of a bus interface function is sent as the reply.
+    """
+    DefaultTimeout = 30
+
+    def __init__(self, clientId, port=26000, address='ff01::1', frameFormat=multicasting.TEXT_FRAMES,
+                 compression=None, retransmit=None, metrics=None, lazyPayloads=False):
+        """
+        :param frameFormat: multicasting.TEXT_FRAMES or multicasting.BINARY_FRAMES for sent frames, both are received.
+                Only send binary frames once every peer on the group knows them, see multicasting.BINARY_HEADER
+        :param compression: a Compression to compress sent payloads with, compressed payloads are always received
+        :param retransmit: a RetransmitBuffer to keep sent fragments in for resending when a receiver misses them
+        :param metrics: a Metrics to count traffic and time requests and callbacks in
+        :param lazyPayloads: pass the messages of publications and requests to callbacks as multicasting.Payload
+                objects, which are only decoded when used as str, instead of as str
+        """
+        self.PORT = port
+        self.ADDR = address
+        self.clientId = clientId
+        self.closing = False
+        self.frameFormat = frameFormat
+        self.compression = compression
+        self.retransmit = retransmit
+        self.lazyPayloads = lazyPayloads
+        self.socket = None  # The datagram transport, which has the same sendto as a socket
+        self.reassembler = Reassembler(ClientConstants.SF_TIMEOUT, ClientConstants.REASSEMBLY_MAXBYTES,
+                                       ClientConstants.MAXFRAGMENTS)
+        self.__registeredBusInterfaces = dict()
+        self.__replyCaches = dict()
+        self.subscriptions = SubscriptionTable()
+        self.requestFutures = dict()
+        self.sharedMemoryReader = SharedMemoryReader()
+        self.__expireHandle = None
+        self.metrics = metrics
+        if metrics is not None:
+            reassembler = self.reassembler
+            metrics.gauge('reassemblyPending', reassembler.__len__)
+            metrics.gauge('reassemblyBytes', lambda: reassembler.size)
+            metrics.gauge('reassemblyExpired', lambda: reassembler.expired)
+            metrics.gauge('reassemblyDropped', lambda: reassembler.dropped)
+            metrics.gauge('reassemblyLate', lambda: reassembler.late)
+
+    async def start(self):
+        """
+        Open the socket and start receiving on the running event loop
+        :return: self
+        """
+        loop = asyncio.get_running_loop()
+        sock = openMulticastSocket(self.PORT, self.ADDR)
+        sock.setblocking(False)
+        self.socket, _ = await loop.create_datagram_endpoint(lambda: _BusProtocol(self), sock=sock)
+        self._maintainWithin(ClientConstants.SF_TIMEOUT)
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, excType, exc, tb):
+        self.close()
+
+    def _maintainWithin(self, delay):
+        """
+        Make sure expired and stalled incomplete messages are handled within delay seconds
+        """
+        loop = asyncio.get_running_loop()
+        if self.__expireHandle and self.__expireHandle.when() <= loop.time() + delay:
+            return
+        if self.__expireHandle:
+            self.__expireHandle.cancel()
+        self.__expireHandle = loop.call_later(delay, self.__maintain)
+
+    def __maintain(self):
+        self.__expireHandle = None
+        multicasting.maintain(self)
+        if len(self.reassembler) and ClientConstants.NACK_DELAY:
+            self._maintainWithin(ClientConstants.NACK_DELAY)
+        else:
+            self._maintainWithin(ClientConstants.SF_TIMEOUT)
+
+    def publish(self, message, channel):
+        """
+        Send a publication on the given channel
+        :param message: the message to be published
+        :param channel: the channel/topic to public the message on
+        :return: the mid of the sent message
+        """
+        return multicasting.send(message, 'pub/' + channel, self)
+
+    async def request(self, receiverId, signal, message, timeout=None, retry=None):
+        """
+        Send request and wait until reply received or timeout has expired
+        :param receiverId: the id of a client to receive the request
+        :param signal: the interface name of the receiving client
+        :param message: the message to the receiving client
+        :param timeout: how long to wait for reply if None AsyncClient.DefaultTimeout is used
+        :param retry: true for one retry on timeout or integer for that many retries on timeout
+        :return: the frame for the reply, or None if no reply received before timeout
+        """
+        timeout = timeout if timeout else AsyncClient.DefaultTimeout
+        mid = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.requestFutures[mid] = future
+        doretry = int(retry) if retry else 0
+        channel = 'req/' + receiverId + '/' + signal
+        metrics = self.metrics
+        start = time.perf_counter()
+        try:
+            while True:
+                multicasting.send(message, channel, self, mid)
+                try:
+                    frame = await asyncio.wait_for(asyncio.shield(future), timeout)
+                    if metrics is not None:
+                        metrics.count('requests')
+                        metrics.observe('requestTime', time.perf_counter() - start)
+                    return frame
+                except asyncio.TimeoutError:
+                    if metrics is not None:
+                        metrics.count('requestTimeouts')
+                    if doretry > 0:
+                        doretry -= 1
+                        if metrics is not None:
+                            metrics.count('requestRetries')
+                    else:
+                        return None
+        finally:
+            self.requestFutures.pop(mid)
+
+    def reply(self, reply, senderId, signal, mid):
+        """
+        Send a reply to a request
+        :param reply: the message to send as a reply
+        :param senderId: the id of the client to receive the reply
+        :param signal: the signal of the request which is replying
+        :param mid: the message id to reply to
+        """
+        cache = self.__replyCaches.get(signal)
+        if cache is not None:
+            cache.store(senderId, signal, mid, reply)
+        multicasting.send(reply, 'rep/' + senderId + '/' + signal, self, mid)
+
+    def registerBusInterface(self, signal, callback, replyCache=None):
+        """
+        register an API to handle with a callback
+        :param signal: the API name to handle
+        :param callback: the Callback object or (coroutine) function to run when the API is called
+        :param replyCache: a ReplyCache to answer retried requests from without running the callback again
+        """
+        self.__registeredBusInterfaces[signal] = callback
+        if replyCache is not None:
+            self.__replyCaches[signal] = replyCache
+        else:
+            self.__replyCaches.pop(signal, None)
+
+    def unregisterBusInterface(self, signal):
+        """
+        Unregister an API
+        :param signal: the API name to remove all callbacks for
+        """
+        self.__registeredBusInterfaces.pop(signal)
+        self.__replyCaches.pop(signal, None)
+
+    def replyCache(self, signal):
+        """
+        :return: the ReplyCache registered for signal, or None
+        """
+        return self.__replyCaches.get(signal)
+
+    def subscribe(self, pattern, callback):
+        """
+        subscribe to messages with the following pattern
+        :param pattern: The pattern to match
+        :param callback: the Callback object or (coroutine) function to run when a publication is received
+        """
+        self.subscriptions.add(pattern, callback)
+
+    def unsubscribe(self, pattern):
+        """
+        remove subscription to pattern
+        :param pattern: The pattern to match
+        """
+        self.subscriptions.remove(pattern)
+
+    def accepts(self, channel):
+        """
+        :return: False if a received frame on channel is of no use to this client, checked before its body is
+                reassembled or decoded
+        """
+        return multicasting.accepts(channel, self.clientId, self.__registeredBusInterfaces, self.subscriptions)
+
+    def _dispatch(self, clientId, channel, mid, message):
+        if channel.startswith('req/'):
+            signal = multicasting.requestSignal(channel, self.clientId)
+            if signal in self.__registeredBusInterfaces and self.__firstRequest(clientId, signal, mid):
+                try:
+                    self.__call(self.__registeredBusInterfaces[signal], clientId, signal, mid, self.__body(message),
+                                True)
+                except Exception:
+                    self.__abandon(clientId, signal, mid)
+                    raise
+        elif channel.startswith('pub/'):
+            topic = channel.split('/', 1)[1]
+            if self.metrics is None:
+                callbacks = self.subscriptions.match(topic)
+            else:
+                start = time.perf_counter()
+                callbacks = self.subscriptions.match(topic)
+                self.metrics.observe('subscriptionMatch', time.perf_counter() - start)
+            if callbacks:
+                message = self.__body(message)
+                for callback in callbacks:
+                    self.__call(callback, clientId, topic, mid, message, False)
+        elif channel.startswith(multicasting.SHM_CHANNEL):
+            topic = channel[len(multicasting.SHM_CHANNEL):]
+            callbacks = self.subscriptions.match(topic)
+            if callbacks:
+                message = self.sharedMemoryReader.read(message)
+                if message is not None:
+                    for callback in callbacks:
+                        self.__call(callback, clientId, topic, mid, message, False)
+        elif channel.startswith('rep/' + self.clientId + '/'):
+            future = self.requestFutures.get(mid)
+            if future and not future.done():
+                future.set_result(clientId + ',' + channel + ',' + mid + ',' + multicasting.decode(message))
+        elif channel == multicasting.NACK_CHANNEL + self.clientId:
+            multicasting.handleNack(self, mid, message)
+        elif channel == multicasting.BATCH_CHANNEL:
+            for recordChannel, recordMid, body in multicasting.unpackBatch(message):
+                self._dispatch(clientId, recordChannel, recordMid, body)
+
+    def __body(self, message):
+        return multicasting.Payload.of(message) if self.lazyPayloads else multicasting.decode(message)
+
+    def __firstRequest(self, senderId, signal, mid):
+        """
+        :return: True if the callback should run for this request, False if it is already running or the cached
+                reply has been sent
+        """
+        cache = self.__replyCaches.get(signal)
+        if cache is None:
+            return True
+        cached = cache.begin(senderId, signal, mid)
+        if cached is None:
+            return True
+        if cached is not ReplyCache.PENDING:
+            multicasting.send(cached, 'rep/' + senderId + '/' + signal, self, mid)
+        return False
+
+    def __call(self, callback, senderId, signal, mid, message, replies):
+        if isinstance(callback, Callback):
+            callback.call(self, senderId, signal, mid, message)
+            if replies and not callback.deferred:
+                self.__abandon(senderId, signal, mid)
+            return
+        result = measured(self, signal, callback)(senderId, signal, mid, message)
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            task.add_done_callback(lambda t: self.__taskDone(t, senderId, signal, mid, replies))
+        elif replies and result:
+            self.reply(result, senderId, signal, mid)
+        elif replies:
+            self.__abandon(senderId, signal, mid)
+
+    def __taskDone(self, task, senderId, signal, mid, replies):
+        if task.cancelled():
+            pass
+        elif task.exception():
+            logging.getLogger('multicast-async').error("callback for " + signal + " failed: " + repr(task.exception()))
+        elif replies and task.result() and not self.closing:
+            self.reply(task.result(), senderId, signal, mid)
+        if replies:
+            self.__abandon(senderId, signal, mid)
+
+    def __abandon(self, senderId, signal, mid):
+        """
+        Forget a request that got no reply from its callback, so that a retry runs the callback again
+        """
+        cache = self.__replyCaches.get(signal)
+        if cache is not None:
+            cache.abandon(senderId, signal, mid)
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        if self.__expireHandle:
+            self.__expireHandle.cancel()
+        self.sharedMemoryReader.close()
+        if self.socket:
+            self.socket.close()
+        for future in self.requestFutures.values():
+            if not future.done():
+                future.cancel()
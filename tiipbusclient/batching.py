@@ -0,0 +1,92 @@
+"""
+    Coalescing of small publications into shared datagrams
+"""
+import time
+import uuid
+from threading import Thread, Condition
+from tiipbusclient import multicasting
+from tiipbusclient.multicasting import ClientConstants
+
+__status__ = 'Development'
+
+
+class Batcher(object):
+    """
+    Collects messages for a client and sends them packed together when a datagram is full or when the oldest
+    waiting message has waited for linger seconds, whichever comes first.
+    """
+
+    def __init__(self, client, linger=0.002):
+        """
+        Construct a batcher and start its flushing thread
+        :param client: the client to send with
+        :param linger: the longest time in seconds a message waits for more messages to share its datagram
+        """
+        self.client = client
+        self.linger = linger
+        self.records = []
+        self.size = 0
+        self.deadline = None
+        self.closed = False
+        self.condition = Condition()
+        self.thread = Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def add(self, message, channel, mid=None):
+        """
+        Queue a message for sending
+        :param message: the message as str or a bytes-like object
+        :param channel: the full channel, e.g. 'pub/<topic>'
+        :param mid: the mid of the message, a new mid is created if None
+        :return: the mid of the message
+        """
+        mid = mid or uuid.uuid4().hex
+        body = multicasting.encode(message)
+        with self.condition:
+            if self.closed:
+                raise Exception("Batcher is closed")
+            self.records.append((channel, mid, body))
+            self.size += len(channel) + len(mid) + len(body) + 8
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.linger
+                self.condition.notify()
+            if self.size >= ClientConstants.DATAGRAMSIZE:
+                self.__flushLocked()
+        return mid
+
+    def flush(self):
+        """
+        Send all waiting messages now
+        """
+        with self.condition:
+            self.__flushLocked()
+
+    def close(self):
+        """
+        Send all waiting messages and stop the flushing thread
+        """
+        with self.condition:
+            self.__flushLocked()
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def __flushLocked(self):
+        records = self.records
+        self.records = []
+        self.size = 0
+        self.deadline = None
+        if records and not self.client.closing:
+            multicasting.sendRecords(records, self.client)
+
+    def __run(self):
+        with self.condition:
+            while not self.closed:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                else:
+                    self.__flushLocked()
@@ -1,14 +1,25 @@
 """
     Client for communication over UDP Multicast
 """
+import logging
 import socket
 import uuid
 import os
+import sys
 import time
 from tiipbusclient import multicasting
-import re
+from tiipbusclient.multicasting import ClientConstants
+from tiipbusclient.reassembly import Reassembler
+from tiipbusclient.dispatcher import Dispatcher, DeliveryQueue
+from tiipbusclient.subscriptions import SubscriptionTable
+from tiipbusclient.batching import Batcher
+from tiipbusclient.replycache import ReplyCache
+from tiipbusclient.metrics import measured
+from tiipbusclient.sharedmemory import SharedMemoryPublisher, SharedMemoryReader, isInterfaceLocal
+from tiipbusclient.sharding import Memberships
+from tiipbusclient.presence import Directory, Presence, Unreachable
 import struct
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 #from pyloggedthread.loggedthread import ErrorLoggedThread as Thread
 from threading import Thread
 from threading import Lock
@@ -22,10 +33,73 @@ else:
 __status__ = 'Development'
 
 
+def openMulticastSocket(port, addr):
+    """
+    Open a UDP socket bound to port that has joined the multicast group addr, with a receive buffer of
+    ClientConstants.RECEIVE_BUFFER bytes or as large as the kernel allows
+    :param port: the port to bind
+    :param addr: the IPv6 multicast address to join
+    :return: the socket
+    """
+    addrInfo = socket.getaddrinfo(addr, None)[0]
+    sock = socket.socket(addrInfo[0], socket.SOCK_DGRAM)
+    sock.setsockopt(IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if ClientConstants.RECEIVE_BUFFER:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ClientConstants.RECEIVE_BUFFER)
+    sock.bind(('', port))
+
+    #Join Multicast grp.
+    group = socket.inet_pton(addrInfo[0], addrInfo[4][0])
+    mreq = group + struct.pack('@I', 0)
+    sock.setsockopt(IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+    return sock
+
+
+def setSocketBuffers(sock, receiveBuffer=None, sendBuffer=None):
+    """
+    Ask the kernel for socket buffers of the given sizes, which it may cap (net.core.rmem_max and net.core.wmem_max
+    on Linux)
+    :param receiveBuffer: the SO_RCVBUF size in bytes, None to keep the default
+    :param sendBuffer: the SO_SNDBUF size in bytes, None to keep the default
+    """
+    for option, size, name in ((socket.SO_RCVBUF, receiveBuffer, 'receive'), (socket.SO_SNDBUF, sendBuffer, 'send')):
+        if not size:
+            continue
+        if not hasattr(sock, 'setsockopt'):
+            logging.getLogger('multicast-client').warning("the transport has no " + name + " buffer to size")
+            continue
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+        actual = sock.getsockopt(socket.SOL_SOCKET, option)
+        if sys.platform.startswith('linux'):
+            actual //= 2  # Linux doubles the size to make room for its bookkeeping
+        if actual < size:
+            logging.getLogger('multicast-client').warning("the %s buffer was capped to %d bytes" % (name, actual))
+
+
+def finishing(client, senderId, signal, mid, target):
+    """
+    Wrap a target that runs after Callback.call has returned, so that a request it fails, or does not reply to, is
+    forgotten by the ReplyCache of the signal and a retry runs it again
+    :return: the wrapped target, or target itself if the signal has no ReplyCache
+    """
+    cache = client.replyCache(signal)
+    if cache is None:
+        return target
+
+    def run(*args):
+        try:
+            return target(*args)
+        finally:
+            cache.abandon(senderId, signal, mid)
+    return run
+
+
 class Callback:
     """
         A callback object, for use with the multicast client
     """
+    deferred = False  # True if call returns before the target has run, which then tells the client through finishing
 
     def __init__(self, target):
         """
@@ -44,10 +118,16 @@ class Callback:
         :param message: The actual message to send as an argument to the target function
         :return: None (but the clients reply function is invoked with the return value of the target function)
         """
-        reply = self.target(message)
+        reply = measured(client, signal, self.target)(message)
         if reply:
             client.reply(reply, senderId, signal, mid)
 
+    def close(self):
+        """
+        Release what the callback holds, called when its subscription is removed or replaced
+        """
+        pass
+
 
 class DetailedCallback(Callback):
     """
@@ -71,7 +151,7 @@ class DetailedCallback(Callback):
         :param message: The actual message to send as an argument to the target function
         :return: None (but the clients reply function is invoked with the return value of the target function)
         """
-        reply = self.target(senderId, signal, mid, message)
+        reply = measured(client, signal, self.target)(senderId, signal, mid, message)
         if reply:
             client.reply(reply, senderId, signal, mid)
 
@@ -80,6 +160,7 @@ class ThreadedCallback(Callback):
     """
         A callback object, for use with the multicast client, that spawns a thread to run the target function
     """
+    deferred = True
 
     def __init__(self, target):
         """
@@ -98,13 +179,15 @@ class ThreadedCallback(Callback):
         :param message: The actual message to send as an argument to the target function
         :return: None (the reply needs to be handled in the target function)
         """
-        Thread(target=self.target, args=message, daemon=True).start()
+        Thread(target=finishing(client, senderId, signal, mid, measured(client, signal, self.target)), args=message,
+               daemon=True).start()
 
 
 class ThreadedDetailedCallback(Callback):
     """
         A callback object, for use with the multicast client, that spawns a thread to run the target function and use the longer argument format
     """
+    deferred = True
 
     def __init__(self, target):
         """
@@ -123,7 +206,254 @@ class ThreadedDetailedCallback(Callback):
         :param message: The actual message to send as an argument to the target function
         :return: None (the reply needs to be handled in the target function)
         """
-        Thread(target=self.target, args=(client, senderId, signal, mid, message), daemon=True).start()
+        Thread(target=finishing(client, senderId, signal, mid, measured(client, signal, self.target)),
+               args=(client, senderId, signal, mid, message), daemon=True).start()
+
+
+class DispatchedCallback(Callback):
+    """
+        A callback object, for use with the multicast client, that runs the target function on a Dispatcher
+    """
+    deferred = True
+
+    def __init__(self, target, dispatcher, orderBy=Dispatcher.BY_TOPIC):
+        """
+        Construct a callback object, for use with the multicast client, that uses the target function
+        :param target: The function to execute when running the Callback. The function should take a message as argument
+        :param dispatcher: The Dispatcher to run the target function on
+        :param orderBy: Dispatcher.BY_TOPIC to run calls for the same topic or signal in order, Dispatcher.BY_SENDER to run calls from the same sender in order
+        """
+        Callback.__init__(self, target)
+        self.dispatcher = dispatcher
+        self.orderBy = orderBy
+
+    def key(self, senderId, signal):
+        return senderId if self.orderBy == Dispatcher.BY_SENDER else signal
+
+    def call(self, client, senderId, signal, mid, message):
+        """
+        The call function that queues the target function on the dispatcher.
+        :param client: The multicast client that controls this Callback object.
+        :param senderId: The id of the multicast client .
+        :param signal: The signal of the reply message.
+        :param mid: The message id of the request to respond to.
+        :param message: The actual message to send as an argument to the target function
+        :return: None (the reply needs to be handled in the target function)
+        """
+        self.submit(client, senderId, signal, mid, message)
+
+    def submit(self, client, senderId, signal, mid, *args):
+        """
+        Queue the target function on the dispatcher with args, forgetting the request if the call is dropped, at once
+        or later to make room for newer calls
+        """
+        target = finishing(client, senderId, signal, mid, measured(client, signal, self.target))
+        cache = client.replyCache(signal)
+        onDrop = (lambda: cache.abandon(senderId, signal, mid)) if cache is not None else None
+        self.dispatcher.submit(self.key(senderId, signal), target, *args, onDrop=onDrop)
+
+
+class DispatchedDetailedCallback(DispatchedCallback):
+    """
+        A callback object, for use with the multicast client, that runs the target function on a Dispatcher and use the longer argument format
+    """
+
+    def call(self, client, senderId, signal, mid, message):
+        """
+        The call function that queues the target function on the dispatcher.
+        :param client: The multicast client that controls this Callback object.
+        :param senderId: The id of the multicast client .
+        :param signal: The signal of the reply message.
+        :param mid: The message id of the request to respond to.
+        :param message: The actual message to send as an argument to the target function
+        :return: None (the reply needs to be handled in the target function)
+        """
+        self.submit(client, senderId, signal, mid, client, senderId, signal, mid, message)
+
+
+class QueuedCallback(Callback):
+    """
+        A callback object, for use with the multicast client, that queues publications in a bounded DeliveryQueue and
+        runs the target function on a thread of its own, so a slow target only delays its own subscription
+    """
+
+    def __init__(self, target, queue=None, detailed=True):
+        """
+        Construct a callback object, for use with the multicast client, that uses the target function
+        :param target: The function to execute when running the Callback. The function should take a client,
+                senderId, topic, mid and message as arguments if detailed, otherwise a message
+        :param queue: the DeliveryQueue to wait in, if None a conflating queue of 1024 messages
+        :param detailed: should the target function use the long arg form?
+        """
+        Callback.__init__(self, target)
+        self.queue = queue if queue is not None else DeliveryQueue()
+        self.detailed = detailed
+        self.thread = Thread(target=self.__work, daemon=True)
+        self.thread.start()
+
+    def call(self, client, senderId, signal, mid, message):
+        """
+        The call function that queues the message for the target function.
+        :param client: The multicast client that controls this Callback object.
+        :param senderId: The id of the multicast client .
+        :param signal: The topic of the publication.
+        :param mid: The message id of the publication.
+        :param message: The actual message to send as an argument to the target function
+        :return: None
+        """
+        self.queue.put(signal, (client, senderId, signal, mid, message))
+
+    def deliver(self, client, senderId, signal, mid, message):
+        """
+        Run the target function for a message taken from the queue
+        """
+        if self.detailed:
+            measured(client, signal, self.target)(client, senderId, signal, mid, message)
+        else:
+            measured(client, signal, self.target)(message)
+
+    def depth(self):
+        """
+        :return: the number of waiting messages
+        """
+        return len(self.queue)
+
+    def dropped(self):
+        """
+        :return: the number of messages discarded because the queue was full
+        """
+        return self.queue.dropped
+
+    def conflated(self):
+        """
+        :return: the number of messages replaced by a newer message on the same topic
+        """
+        return self.queue.conflated
+
+    def close(self):
+        self.queue.close()
+
+    def __work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.deliver(*item)
+            except Exception as e:
+                logging.getLogger('multicast-client').exception("callback failed: " + repr(e))
+
+
+def _unwrapped(callback):
+    """
+    :return: the Callback object a wrapper such as _SnapshotGate passes the calls to, callback if it is not a wrapper
+    """
+    while hasattr(callback, 'callback'):
+        callback = callback.callback
+    return callback
+
+
+class _SnapshotGate(Callback):
+    """
+        Holds back the publications for a new subscription until the snapshot it starts from has been delivered
+    """
+
+    def __init__(self, callback):
+        """
+        :param callback: the Callback object of the subscription
+        """
+        Callback.__init__(self, callback.call)
+        self.callback = callback
+        self.held = []
+        self.lock = Lock()
+        self.open = False
+
+    def call(self, client, senderId, signal, mid, message):
+        if not self.open:
+            with self.lock:
+                if not self.open:
+                    self.held.append((client, senderId, signal, mid, message))
+                    return
+        self.callback.call(client, senderId, signal, mid, message)
+
+    def release(self, client, values):
+        """
+        Deliver the snapshot values, except those already held back, then the held back publications, and let
+        further publications through
+        :param values: a list of (senderId, topic, mid, message)
+        """
+        with self.lock:
+            held = set(args[3] for args in self.held)
+        for senderId, topic, mid, message in values:
+            if mid not in held:
+                self.callback.call(client, senderId, topic, mid, message)
+        while True:
+            with self.lock:
+                pending, self.held = self.held, []
+                if not pending:
+                    self.open = True
+                    return
+            for args in pending:
+                self.callback.call(*args)
+
+    def close(self):
+        self.callback.close()
+
+
+class Replies(object):
+    """
+    An iterator of the reply frames to a request sent by Client.requestAll. The reply queue of the request is removed
+    when the iterator is exhausted, closed or garbage collected, so a caller that does not need all replies should
+    close it or drop it.
+    """
+
+    def __init__(self, requestQueues, mid, deadline, count, until):
+        """
+        :param requestQueues: the requestQueues of the client, holding the reply queue of the request under mid
+        :param deadline: the time.monotonic() time to stop collecting at
+        :param count: see Client.requestAll
+        :param until: see Client.requestAll
+        """
+        self.requestQueues = requestQueues
+        self.mid = mid
+        self.queue = requestQueues[mid]
+        self.deadline = deadline
+        self.count = count
+        self.until = until
+        self.replied = set()
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.done and (self.count is None or len(self.replied) < self.count):
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                frame = self.queue.get(True, remaining)
+            except Empty:
+                break
+            senderId = frame.split(',', 1)[0]
+            if senderId in self.replied:
+                continue
+            self.replied.add(senderId)
+            if self.until and self.until(frame):
+                self.close()
+            return frame
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """
+        Stop collecting replies
+        """
+        self.done = True
+        self.requestQueues.pop(self.mid, None)
+
+    def __del__(self):
+        self.close()
 
 
 class Client:
@@ -131,31 +461,92 @@ class Client:
     A client for sending stringbased messages over UDP multicast in a request, reply, publish, subscribe manner.
     """
     DefaultTimeout = 30
+    SnapshotTimeout = 5
 
-    def __init__(self, clientId, port, addr):
+    def __init__(self, clientId, port, addr, batchReceive=False, frameFormat=multicasting.TEXT_FRAMES,
+                 compression=None, retransmit=None, metrics=None, transport=openMulticastSocket, hub=None,
+                 sharding=None, lazyPayloads=False, receiveBuffer=None, sendBuffer=None, pacer=None):
+        """
+        :param batchReceive: receive all waiting datagrams per wakeup into reusable buffers and only decode the
+                message bodies that are used
+        :param frameFormat: multicasting.TEXT_FRAMES or multicasting.BINARY_FRAMES for sent frames, both are received.
+                Only send binary frames once every peer on the group knows them, see multicasting.BINARY_HEADER
+        :param compression: a Compression to compress sent payloads with, compressed payloads are always received
+        :param retransmit: a RetransmitBuffer to keep sent fragments in for resending when a receiver misses them
+        :param metrics: a Metrics to count traffic and time requests and callbacks in
+        :param transport: a function taking port and addr that opens the socket to send and receive with, e.g.
+                transport.InProcessTransport to only reach clients in this process
+        :param hub: a ClientHub to send with and receive from instead of opening a socket, in which case run is not
+                used and port, addr, batchReceive, transport and the buffer sizes are those of the hub
+        :param sharding: a sharding.Sharding to spread channels over several multicast groups, addr is then the base
+                group for requests to several clients, all clients on the bus must use the same groups
+        :param lazyPayloads: pass the messages of publications and requests to callbacks as multicasting.Payload
+                objects, which are only decoded when used as str, instead of as str
+        :param receiveBuffer: the size in bytes of the kernel receive buffer of the socket, None for the default
+        :param sendBuffer: the size in bytes of the kernel send buffer of the socket, None for the default
+        :param pacer: a pacing.Pacer to limit the rate of sent datagrams with
+        """
         self.PORT = port  # 26000
         self.ADDR = addr  # 'ff01::1' #IPV6 Multicast Address
         self.clientId = clientId
         self.closing = False
+        self.batchReceive = batchReceive
+        self.frameFormat = frameFormat
+        self.compression = compression
+        self.retransmit = retransmit
+        self.lazyPayloads = lazyPayloads
+        self.pacer = pacer
+        self.batcher = None
+        self.sharedMemory = None
+        self.sharedMemoryReader = SharedMemoryReader()
+        self.presence = None
+        self.directory = None
+        self.failFast = False
 
-        addrInfo = socket.getaddrinfo(self.ADDR, None)[0]
-        self.socket = socket.socket(addrInfo[0], socket.SOCK_DGRAM)
-        self.socket.setsockopt(IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(('', self.PORT))
-
-        #Join Multicast grp.
-        group = socket.inet_pton(addrInfo[0], addrInfo[4][0])
-        mreq = group + struct.pack('@I', 0)
-        self.socket.setsockopt(IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+        self.hub = hub
+        self.socket = hub.socket if hub else transport(self.PORT, self.ADDR)
+        self.kernelDrops = 0  # Datagrams the kernel dropped because the receive buffer was full
+        self.dropCounting = False
+        if not hub:
+            setSocketBuffers(self.socket, receiveBuffer, sendBuffer)
+            self.dropCounting = multicasting.enableDropCounting(self.socket)
+        self.sharding = sharding
+        self.memberships = None
+        if sharding:
+            if hub:
+                raise Exception("Sharding can not be used with a hub")
+            if not hasattr(self.socket, 'setsockopt'):
+                self.socket.close()
+                raise ValueError("Sharding needs a multicast socket to join groups with, not a " +
+                                 type(self.socket).__name__)
+            self.memberships = Memberships(self.socket)
+            self.memberships.join(sharding.groupOf(clientId.split('/', 1)[0]))
 
         self.__registeredBusInterfaces = dict()
-        self.subPatterns = dict()
-        self.subPatternLock = Lock()
+        self.__replyCaches = dict()
+        self.subscriptions = SubscriptionTable()
         self.requestQueues = dict()
         self.inboxLock = Lock()
-        self.inbox = []
-        if not os.name == 'nt':
+        self.reassembler = Reassembler(ClientConstants.SF_TIMEOUT, ClientConstants.REASSEMBLY_MAXBYTES,
+                                       ClientConstants.MAXFRAGMENTS)
+        self.bufferPool = multicasting.BufferPool(ClientConstants.BATCHSIZE, ClientConstants.MAXSIZE) if batchReceive else None
+        self.metrics = metrics
+        if metrics is not None:
+            reassembler = self.reassembler
+            metrics.gauge('reassemblyPending', reassembler.__len__)
+            metrics.gauge('reassemblyBytes', lambda: reassembler.size)
+            metrics.gauge('reassemblyExpired', lambda: reassembler.expired)
+            metrics.gauge('reassemblyDropped', lambda: reassembler.dropped)
+            metrics.gauge('reassemblyLate', lambda: reassembler.late)
+            if self.dropCounting:
+                metrics.gauge('kernelDrops', lambda: self.kernelDrops)
+            if pacer:
+                metrics.gauge('pacedDatagrams', lambda: pacer.paced)
+                metrics.gauge('pacingWait', lambda: pacer.waited)
+        if hub:
+            self.sigKill = self.isKilled = None
+            hub.add(self)
+        elif not os.name == 'nt':
             r, w = os.pipe()
             self.sigKill = os.fdopen(w, 'w')
             self.isKilled = os.fdopen(r, 'r')
@@ -167,8 +558,86 @@ class Client:
         :param channel: the channel/topic to public the message on
         :return: the mid of the sent message
         """
+        if self.sharedMemory:
+            mid = self.sharedMemory.publish(message, channel)
+            if mid:
+                return mid
+        if self.batcher:
+            return self.batcher.add(message, 'pub/' + channel)
         return multicasting.send(message, 'pub/' + channel, self)
 
+    def publishMany(self, messages):
+        """
+        Send several publications packed in as few datagrams as possible
+        :param messages: an iterable of (message, channel) pairs
+        :return: a list of the mids of the sent messages
+        """
+        if self.batcher:
+            return [self.batcher.add(message, 'pub/' + channel) for message, channel in messages]
+        records = [('pub/' + channel, uuid.uuid4().hex, multicasting.encode(message)) for message, channel in messages]
+        multicasting.sendRecords(records, self)
+        return [mid for _, mid, _ in records]
+
+    def enableBatching(self, linger=0.002):
+        """
+        Pack publications from publish and publishMany together, waiting at most linger seconds for a datagram to
+        fill up. Peers that do not know batched frames will not receive these publications.
+        :param linger: the longest time in seconds a publication is held back
+        """
+        if not self.batcher:
+            self.batcher = Batcher(self, linger)
+
+    def enableSharedMemory(self, channels=('.*',), ringSize=4 * 1024 * 1024, maxRings=16):
+        """
+        Write publications on the given channels to shared memory and only send a notification where to read them.
+        Only used on interface-local groups (ffx1::), where all receivers are on this host, publications on other
+        groups are sent normally. Peers that do not know shared memory notifications will not receive these
+        publications.
+        :param channels: regular expressions matched against the topic for the publications to put in shared memory
+        :param ringSize: the size in bytes of the ring of each topic, larger messages are published normally
+        :param maxRings: the largest number of rings, see SharedMemoryPublisher
+        """
+        if not isInterfaceLocal(self.ADDR):
+            logging.getLogger('multicast-send').warning("shared memory is not used on " + self.ADDR +
+                                                        ", which reaches other hosts")
+        elif not self.sharedMemory:
+            self.sharedMemory = SharedMemoryPublisher(self, channels, ringSize, maxRings)
+
+    def enablePresence(self, interval=2.0, load=None, misses=3, announce=True, failFast=True):
+        """
+        Keep a presence.Directory of the clients on the bus from their announcements, and announce this client with
+        its registered signals every interval seconds. All clients on the bus should announce themselves with the
+        same interval, a client that does not is taken for gone by failing fast requests.
+        :param interval: the seconds between announcements
+        :param load: a function returning the load hint to announce, see presence.Presence
+        :param misses: the number of announcements in a row a client may miss before it is taken for gone
+        :param announce: False to only keep the directory without announcing this client
+        :param failFast: raise presence.Unreachable from request at once when the receiver is not alive or does not
+                serve the signal, instead of waiting for the timeout, once every client has had time to announce
+        """
+        if self.directory is None:
+            self.directory = Directory(misses, interval * misses)
+            if self.metrics is not None:
+                directory = self.directory
+                self.metrics.gauge('directoryClients', lambda: len(directory.clients()))
+        self.failFast = failFast
+        if announce and not self.presence:
+            self.presence = Presence(self, interval, load)
+
+    def signals(self):
+        """
+        :return: the signals registered with registerBusInterface
+        """
+        return list(self.__registeredBusInterfaces)
+
+    def servers(self, signal):
+        """
+        :return: the ids of the clients on the bus that serve signal, least loaded first, see enablePresence
+        """
+        if self.directory is None:
+            raise Exception("Presence is not enabled")
+        return self.directory.servers(signal)
+
     def request(self, receiverId, signal, message, timeout=None, retry=None):
         """
         Send request and block until reply received or timeout has expired
@@ -179,7 +648,14 @@ class Client:
         :param retry: true for one retry on timeout or integer for that many retries on timeout
         :return: the frame for the message.
         :raises: Empty: If no reply received before timeout
+        :raises: presence.Unreachable: If presence is enabled and receiverId is not alive or does not serve signal
         """
+        if self.failFast:
+            reason = self.directory.unreachable(receiverId, signal)
+            if reason:
+                if self.metrics is not None:
+                    self.metrics.count('requestsUnreachable')
+                raise Unreachable(receiverId + " " + reason)
         timeout = timeout if timeout else Client.DefaultTimeout
         mid = uuid.uuid4().hex
         self.requestQueues[mid] = Queue(1)
@@ -189,14 +665,61 @@ class Client:
         finally:
             self.requestQueues.pop(mid)
 
+    def requestAll(self, receiverIds, signal, message, timeout=None, count=None, until=None):
+        """
+        Send one request to several clients and collect their replies as they arrive
+        :param receiverIds: a list of the ids of the clients to receive the request, or multicasting.ALL_RECEIVERS
+                for every client that has the signal registered
+        :param signal: the interface name of the receiving clients
+        :param message: the message to the receiving clients
+        :param timeout: the longest time in seconds to collect replies, if None Client.DefaultTimeout is used
+        :param count: stop after this many replies, if None stop when every client in receiverIds has replied, or
+                with failFast presence when every alive client of receiverIds or serving signal has replied
+        :param until: a function taking a reply frame that returns True to stop after that reply
+        :return: a Replies iterator of the reply frames, at most one per replying client, in arrival order. Replies
+                are only collected until the iterator is exhausted, closed or dropped.
+        """
+        ready = self.failFast and self.directory.ready()
+        if receiverIds == multicasting.ALL_RECEIVERS:
+            target = receiverIds
+            if count is None and ready:
+                count = len(self.directory.servers(signal))
+        else:
+            receiverIds = list(receiverIds)
+            target = multicasting.RECEIVER_SEPARATOR.join(receiverIds)
+            if count is None:
+                if ready:
+                    count = sum(1 for receiverId in receiverIds if not self.directory.unreachable(receiverId, signal))
+                else:
+                    count = len(receiverIds)
+        mid = uuid.uuid4().hex
+        self.requestQueues[mid] = Queue()
+        try:
+            multicasting.send(message, 'req/' + target + '/' + signal, self, mid)
+        except Exception:
+            self.requestQueues.pop(mid)
+            raise
+        return Replies(self.requestQueues, mid, time.monotonic() + (timeout if timeout else Client.DefaultTimeout),
+                       count, until)
+
     def __dorequest(self, channel, message, mid, timeout, retry):
+        metrics = self.metrics
+        start = time.perf_counter()
         while True:
             multicasting.send(message, channel, self, mid)
             try:
-                return self.requestQueues[mid].get(True, timeout)
+                frame = self.requestQueues[mid].get(True, timeout)
+                if metrics is not None:
+                    metrics.count('requests')
+                    metrics.observe('requestTime', time.perf_counter() - start)
+                return frame
             except Empty:
+                if metrics is not None:
+                    metrics.count('requestTimeouts')
                 if retry > 0:
                     retry -= 1
+                    if metrics is not None:
+                        metrics.count('requestRetries')
                 else:
                     break
 
@@ -208,15 +731,25 @@ class Client:
         :param signal: the signal of the request which is replying
         :param mid: the message id to reply to
         """
+        cache = self.__replyCaches.get(signal)
+        if cache is not None:
+            cache.store(senderId, signal, mid, reply)
         multicasting.send(reply, 'rep/' + senderId + '/' + signal, self, mid)
 
-    def registerBusInterface(self, signal, callback):
+    def registerBusInterface(self, signal, callback, replyCache=None):
         """
         register an API to handle with a callback
         :param signal: the API name to handle
         :param callback: the function to run when the API is called
+        :param replyCache: a ReplyCache to answer retried requests from without running the callback again
         """
         self.__registeredBusInterfaces[signal] = callback
+        if replyCache is not None:
+            self.__replyCaches[signal] = replyCache
+        else:
+            self.__replyCaches.pop(signal, None)
+        if self.presence:
+            self.presence.announce()
 
     def unregisterBusInterface(self, signal):
         """
@@ -224,29 +757,74 @@ class Client:
         :param signal: the API name to remove all callbacks for
         """
         self.__registeredBusInterfaces.pop(signal)
+        self.__replyCaches.pop(signal, None)
+        if self.presence:
+            self.presence.announce()
+
+    def replyCache(self, signal):
+        """
+        :return: the ReplyCache registered for signal, or None
+        """
+        return self.__replyCaches.get(signal)
 
-    def subscribe(self, pattern, callback):
+    def subscribe(self, pattern, callback, snapshot=False):
         """
         subscribe to messages with the following pattern
         :param pattern: The pattern to match
         :param callback: the Callback object to run when a publication is received
+        :param snapshot: True to first run the callback for the latest publication of each matching topic kept by the
+                lastvalue.LastValueCache with the id multicasting.LAST_VALUE_CACHE, or the id of another cache.
+                Publications received meanwhile are held back until the snapshot has been delivered.
         """
-        try:
-            self.subPatternLock.acquire()
-            self.subPatterns[pattern] = re.compile(pattern), callback
-        finally:
-            self.subPatternLock.release()
+        subscribed = pattern in self.subscriptions
+        gate = _SnapshotGate(callback) if snapshot else None
+        replaced = self.subscriptions.add(pattern, gate or callback)
+        if replaced is not None and _unwrapped(replaced) is not _unwrapped(callback):
+            replaced.close()
+        if self.sharding and not subscribed:
+            for group in self.sharding.groupsForPattern(pattern):
+                self.memberships.join(group)
+        if gate:
+            values = []
+            try:
+                values = self.snapshot(pattern, multicasting.LAST_VALUE_CACHE if snapshot is True else snapshot,
+                                       Client.SnapshotTimeout)
+            except Empty:
+                logging.getLogger('multicast-client').warning("no snapshot for " + pattern + ", the cache did not reply")
+            finally:
+                gate.release(self, values)  # Also on failure, the gate would hold back the publications forever
+
+    def snapshot(self, pattern, cacheId=multicasting.LAST_VALUE_CACHE, timeout=None):
+        """
+        Ask a lastvalue.LastValueCache for the latest publication of each topic matching pattern
+        :param cacheId: the client id of the cache
+        :param timeout: how long to wait for each reply, see request
+        :return: a list of (senderId, topic, mid, message) sorted by topic
+        :raises: Empty: If the cache does not reply before timeout, presence.Unreachable if the directory knows it is
+                not on the bus
+        """
+        values = []
+        after = ''
+        while True:
+            frame = self.request(cacheId, multicasting.SNAPSHOT_SIGNAL, pattern + '\n' + after, timeout)
+            if frame is None:
+                raise Empty(cacheId + " did not reply to the snapshot request")
+            after, _, records = frame.split(',', 3)[3].partition('\n')
+            for topic, sender, body in multicasting.unpackBatch(records):
+                senderId, _, mid = sender.rpartition('/')
+                values.append((senderId, topic, mid, str(body, 'UTF-8')))
+            if not after:
+                return values
 
     def unsubscribe(self, pattern):
         """
         remove subscription to pattern
         :param pattern: The pattern to match
         """
-        try:
-            self.subPatternLock.acquire()
-            self.subPatterns.pop(pattern)
-        finally:
-            self.subPatternLock.release()
+        if self.sharding and pattern in self.subscriptions:
+            for group in self.sharding.groupsForPattern(pattern):
+                self.memberships.leave(group)
+        self.subscriptions.remove(pattern).close()
 
     def lock(self):
         self.inboxLock.acquire()
@@ -256,37 +834,107 @@ class Client:
 
 
     def run(self):
+        if self.hub:
+            return  # The hub receives for this client
         while not self.closing:
-            frame = multicasting.recv(self)
-            if not frame:
+            if self.batchReceive:
+                for clientId, channel, mid, message in multicasting.recvBatch(self):
+                    self._dispatch(clientId, channel, mid, message)
                 continue
-            clientId, channel, mid, message = frame.split(',', 3)
-            if clientId == self.clientId:
-                continue
-            if channel.startswith('req/' + self.clientId + '/'):
-                signal = channel.split('/', 2)[2]
-                if signal in self.__registeredBusInterfaces:
-                    self._handleRequest(clientId, signal, mid, message)
-            if channel.startswith('pub/'):
-                topic = channel.split('/', 1)[1]
+            frame = multicasting.recvMessage(self)
+            if frame:
+                self._dispatch(*frame)
+
+    def accepts(self, channel):
+        """
+        :return: False if a received frame on channel is of no use to this client, checked before its body is
+                reassembled or decoded
+        """
+        return multicasting.accepts(channel, self.clientId, self.__registeredBusInterfaces, self.subscriptions,
+                                    self.directory is not None)
+
+    def _dispatch(self, clientId, channel, mid, message):
+        """
+        Run the callbacks for a received frame
+        :param message: the message body as str, Payload or a bytes-like object that is only decoded if it is used
+        """
+        if channel.startswith('req/'):
+            signal = multicasting.requestSignal(channel, self.clientId)
+            if signal in self.__registeredBusInterfaces:
+                self._handleRequest(clientId, signal, mid, self.__body(message))
+        elif channel.startswith('pub/'):
+            topic = channel.split('/', 1)[1]
+            if self.metrics is None:
+                callbacks = self.subscriptions.match(topic)
+            else:
+                start = time.perf_counter()
+                callbacks = self.subscriptions.match(topic)
+                self.metrics.observe('subscriptionMatch', time.perf_counter() - start)
+            if callbacks:
+                message = self.__body(message)
+                for callback in callbacks:
+                    callback.call(self, clientId, topic, mid, message)
+        elif channel.startswith(multicasting.SHM_CHANNEL):
+            topic = channel[len(multicasting.SHM_CHANNEL):]
+            callbacks = self.subscriptions.match(topic)
+            if callbacks:
+                message = self.sharedMemoryReader.read(message)
+                if message is not None:
+                    for callback in callbacks:
+                        callback.call(self, clientId, topic, mid, message)
+        elif channel.startswith('rep/' + self.clientId + '/'):
+            queue = self.requestQueues.get(mid)
+            if queue is not None:
                 try:
-                    self.subPatternLock.acquire()
-                    for pattern, callback in self.subPatterns.values():
-                        if pattern.match(topic):
-                            callback.call(self, clientId, topic, mid, message)
-                finally:
-                    self.subPatternLock.release()
-            if channel.startswith('rep/' + self.clientId + '/'):
-                if mid in self.requestQueues:
-                    self.requestQueues[mid].put_nowait(frame)
+                    queue.put_nowait(clientId + ',' + channel + ',' + mid + ',' + multicasting.decode(message))
+                except Full:
+                    pass  # A late reply to a retried request, the first reply is already waiting
+        elif channel == multicasting.NACK_CHANNEL + self.clientId:
+            multicasting.handleNack(self, mid, message)
+        elif channel == multicasting.BATCH_CHANNEL:
+            for recordChannel, recordMid, body in multicasting.unpackBatch(message):
+                self._dispatch(clientId, recordChannel, recordMid, body)
+        elif channel == multicasting.PRESENCE_CHANNEL and self.directory is not None:
+            self.directory.update(clientId, multicasting.decode(message))
+
+    def __body(self, message):
+        return multicasting.Payload.of(message) if self.lazyPayloads else multicasting.decode(message)
 
     def _handleRequest(self, senderId, signal, mid, message):
-        self.__registeredBusInterfaces[signal].call(self, senderId, signal, mid, message)
+        cache = self.__replyCaches.get(signal)
+        if cache is not None:
+            cached = cache.begin(senderId, signal, mid)
+            if cached is ReplyCache.PENDING:
+                return
+            if cached is not None:
+                multicasting.send(cached, 'rep/' + senderId + '/' + signal, self, mid)
+                return
+        callback = self.__registeredBusInterfaces[signal]
+        try:
+            callback.call(self, senderId, signal, mid, message)
+        except Exception:
+            if cache is not None:
+                cache.discard(senderId, signal, mid)
+            raise
+        if cache is not None and not getattr(callback, 'deferred', False):
+            cache.abandon(senderId, signal, mid)
 
     def close(self):
         if self.closing:
             return
+        if self.batcher:
+            self.batcher.close()
+        if self.presence:
+            self.presence.close()
         self.closing = True
+        for callback in self.subscriptions.callbacks():
+            callback.close()
+        if self.sharedMemory:
+            self.sharedMemory.close()
+        self.sharedMemoryReader.close()
+        if self.hub:
+            self.hub.remove(self)
+            return
         if self.socket:
             self.socket.close()
         if not os.name == 'nt':
@@ -301,50 +949,94 @@ class Client:
 
 class ThreadedClient(Client):
 
-    def __init__(self, clientId, port=26000, address='ff01::1'):
-        Client.__init__(self, clientId, port, address)
-        t = Thread(target=self.run, daemon=True)
-        t.start()
+    def __init__(self, clientId, port=26000, address='ff01::1', dispatcher=None, batchReceive=False,
+                 frameFormat=multicasting.TEXT_FRAMES, compression=None, retransmit=None, metrics=None,
+                 transport=openMulticastSocket, hub=None, sharding=None, lazyPayloads=False, receiveBuffer=None,
+                 sendBuffer=None, pacer=None):
+        """
+        :param dispatcher: a Dispatcher to run threaded callbacks on, if None each callback is run in a new thread
+        :param batchReceive: see Client
+        :param frameFormat: see Client
+        :param compression: see Client
+        :param retransmit: see Client
+        :param metrics: see Client
+        :param transport: see Client
+        :param hub: see Client
+        :param sharding: see Client
+        :param lazyPayloads: see Client
+        :param receiveBuffer: see Client
+        :param sendBuffer: see Client
+        :param pacer: see Client
+        """
+        Client.__init__(self, clientId, port, address, batchReceive, frameFormat, compression, retransmit, metrics,
+                        transport, hub, sharding, lazyPayloads, receiveBuffer, sendBuffer, pacer)
+        self.dispatcher = dispatcher
+        if metrics is not None and dispatcher:
+            metrics.gauge('dispatcherDepth', dispatcher.depth)
+            metrics.gauge('dispatcherDropped', dispatcher.dropped)
+        if not hub:
+            t = Thread(target=self.run, daemon=True)
+            t.start()
 
-    def subscribe(self, pattern, callback, threaded=True, detailed=True):
+    def subscribe(self, pattern, callback, threaded=True, detailed=True, orderBy=Dispatcher.BY_TOPIC, maxQueue=None,
+                  overflow=DeliveryQueue.CONFLATE, snapshot=False):
         """
         subscribe to messages with the following pattern
         :param pattern: The pattern to match
         :param callback: the Callback object or a function to run when a publication is received
         :param threaded: should the callback be handled in a new thread?  (only if callback is a function)
         :param detailed: should the callback function use the long arg form? (only if callback is a function)
+        :param orderBy: the ordering key when a dispatcher is used (only if callback is a function)
+        :param maxQueue: if set, publications wait in a queue of this size for a thread of the subscription, instead
+                of following threaded and orderBy (only if callback is a function)
+        :param overflow: the DeliveryQueue policy for a full queue, by default only the newest waiting message of each
+                topic is kept (only if maxQueue is set)
+        :param snapshot: see Client.subscribe
+        :return: the Callback object of the subscription, a QueuedCallback reports the depth and drops of its queue
         """
         if isinstance(callback, Callback):
-            Client.subscribe(self, pattern, callback)
-        else:
-            if threaded:
+            pass
+        elif maxQueue:
+            callback = QueuedCallback(callback, DeliveryQueue(maxQueue, overflow), detailed)
+        elif threaded:
+            if self.dispatcher:
                 if detailed:
-                    Client.subscribe(self, pattern, ThreadedDetailedCallback(callback))
+                    callback = DispatchedDetailedCallback(callback, self.dispatcher, orderBy)
                 else:
-                    Client.subscribe(self, pattern, ThreadedCallback(callback))
+                    callback = DispatchedCallback(callback, self.dispatcher, orderBy)
+            elif detailed:
+                callback = ThreadedDetailedCallback(callback)
             else:
-                if detailed:
-                    Client.subscribe(self, pattern, DetailedCallback(callback))
-                else:
-                    Client.subscribe(self, pattern, Callback(callback))
+                callback = ThreadedCallback(callback)
+        elif detailed:
+            callback = DetailedCallback(callback)
+        else:
+            callback = Callback(callback)
+        Client.subscribe(self, pattern, callback, snapshot)
+        return callback
 
-    def registerBusInterface(self, signal, callback, threaded=True, detailed=True):
+    def registerBusInterface(self, signal, callback, threaded=True, detailed=True, orderBy=Dispatcher.BY_SENDER,
+                             replyCache=None):
         """
         register an API to handle with a callback
         :param signal: the API name to handle
         :param callback: the Callback object or a function to run when a request is received
         :param threaded: should the callback be handled in a new thread?  (only if callback is a function)
         :param detailed: should the callback function use the long arg form? (only if callback is a function)
+        :param orderBy: the ordering key when a dispatcher is used (only if callback is a function)
+        :param replyCache: see Client.registerBusInterface
         """
         if isinstance(callback, Callback):
-            Client.registerBusInterface(self, signal, callback)
+            Client.registerBusInterface(self, signal, callback, replyCache)
         else:
             if threaded:
-                Client.registerBusInterface(self, signal, ThreadedDetailedCallback(callback))
+                if self.dispatcher:
+                    Client.registerBusInterface(self, signal, DispatchedDetailedCallback(callback, self.dispatcher, orderBy),
+                                                replyCache)
+                else:
+                    Client.registerBusInterface(self, signal, ThreadedDetailedCallback(callback), replyCache)
             else:
                 if detailed:
-                    Client.registerBusInterface(self, signal, DetailedCallback(callback))
+                    Client.registerBusInterface(self, signal, DetailedCallback(callback), replyCache)
                 else:
-                    Client.registerBusInterface(self, signal, Callback(callback))
-
-
+                    Client.registerBusInterface(self, signal, Callback(callback), replyCache)
@@ -0,0 +1,121 @@
+"""
+    Payload compression for multicast messages
+"""
+import re
+import time
+import zlib
+
+__status__ = 'Development'
+
+
+def inflate(body, limit):
+    """
+    Decompress a payload
+    :param body: the compressed payload as a bytes-like object
+    :param limit: the largest accepted size of the decompressed payload
+    :return: the decompressed payload as bytes, or None if it is corrupt or larger than limit
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(body, limit)
+    except zlib.error:
+        return None
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        return None
+    return data
+
+
+class Compression(object):
+    """
+    Compression settings and counters of a client. Payloads of at least threshold bytes are compressed with zlib
+    when that makes them smaller. The threshold can be changed, or compression turned off, for channels matching
+    a pattern.
+    """
+
+    def __init__(self, threshold=1024, level=6):
+        """
+        :param threshold: the smallest payload in bytes to compress
+        :param level: the zlib compression level
+        """
+        self.threshold = threshold
+        self.level = level
+        self.channels = []
+        self.__thresholds = dict()
+        self.compressed = 0
+        self.uncompressed = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.compressTime = 0.0
+        self.decompressed = 0
+        self.decompressTime = 0.0
+
+    def setChannel(self, pattern, threshold):
+        """
+        Set the threshold for channels matching pattern, earlier settings take precedence
+        :param pattern: a regular expression matched against the full channel, e.g. 'pub/sensors/.*'
+        :param threshold: the smallest payload in bytes to compress, None to never compress on these channels
+        """
+        self.channels.append((re.compile(pattern), threshold))
+        self.__thresholds = dict()
+
+    def thresholdFor(self, channel):
+        """
+        :return: the threshold for channel, None if compression is off for channel
+        """
+        try:
+            return self.__thresholds[channel]
+        except KeyError:
+            pass
+        threshold = self.threshold
+        for pattern, channelThreshold in self.channels:
+            if pattern.match(channel):
+                threshold = channelThreshold
+                break
+        if len(self.__thresholds) < 4096:
+            self.__thresholds[channel] = threshold
+        return threshold
+
+    def compress(self, channel, payload):
+        """
+        Compress a payload if the settings for its channel allow and it gets smaller
+        :param channel: the full channel of the message
+        :param payload: the payload as a bytes-like object
+        :return: (payload, True) if compressed, otherwise (payload, False)
+        """
+        threshold = self.thresholdFor(channel)
+        if threshold is None or len(payload) < threshold:
+            return payload, False
+        start = time.thread_time()
+        data = zlib.compress(payload, self.level)
+        self.compressTime += time.thread_time() - start
+        if len(data) >= len(payload):
+            self.uncompressed += 1
+            return payload, False
+        self.compressed += 1
+        self.bytesIn += len(payload)
+        self.bytesOut += len(data)
+        return memoryview(data), True
+
+    def decompress(self, body, limit):
+        """
+        Decompress a received payload, see inflate
+        """
+        start = time.thread_time()
+        data = inflate(body, limit)
+        self.decompressTime += time.thread_time() - start
+        self.decompressed += 1
+        return data
+
+    def ratio(self):
+        """
+        :return: compressed size divided by original size for all compressed payloads, None if none was compressed
+        """
+        return self.bytesOut / self.bytesIn if self.bytesIn else None
+
+    def stats(self):
+        """
+        :return: a dict of the counters
+        """
+        return dict(compressed=self.compressed, uncompressed=self.uncompressed, bytesIn=self.bytesIn,
+                    bytesOut=self.bytesOut, ratio=self.ratio(), compressTime=self.compressTime,
+                    decompressed=self.decompressed, decompressTime=self.decompressTime)
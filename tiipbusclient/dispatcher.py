@@ -0,0 +1,233 @@
+"""
+    A bounded pool of worker threads for running callbacks
+"""
+import logging
+from collections import deque, OrderedDict
+from threading import Thread, Condition
+
+__status__ = 'Development'
+
+
+class WorkQueue(object):
+    """
+        A bounded FIFO queue of calls with a policy for what to do when it is full
+    """
+
+    def __init__(self, maxsize, overflow):
+        """
+        :param maxsize: the largest number of calls waiting in the queue
+        :param overflow: Dispatcher.BLOCK, Dispatcher.DROP_OLDEST or Dispatcher.DROP_NEWEST
+        """
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.items = deque()
+        self.condition = Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        """
+        Add a call to the queue, applying the overflow policy if it is full. The onDrop function of a dropped call,
+        the new one or the oldest waiting one, is called once the queue is unlocked.
+        :param item: a (target, args, onDrop) call, where onDrop is a function without arguments or None
+        :return: True if the call was queued, False if it was dropped
+        """
+        dropped = []
+        with self.condition:
+            full = len(self.items) >= self.maxsize
+            if full and self.overflow == Dispatcher.DROP_NEWEST:
+                self.dropped += 1
+                queued = False
+            else:
+                if full and self.overflow == Dispatcher.DROP_OLDEST:
+                    dropped.append(self.items.popleft())
+                    self.dropped += 1
+                elif full:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.condition.wait()
+                queued = not self.closed
+                if queued:
+                    self.items.append(item)
+                    self.condition.notify_all()
+            if not queued:
+                dropped.append(item)
+        for _, _, onDrop in dropped:
+            if onDrop is not None:
+                try:
+                    onDrop()
+                except Exception as e:
+                    logging.getLogger('multicast-dispatcher').exception("drop hook failed: " + repr(e))
+        return queued
+
+    def get(self):
+        """
+        Remove the oldest call from the queue, blocking until there is one
+        :return: the call, or None when the queue is closed and empty
+        """
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Dispatcher(object):
+    """
+    A fixed pool of worker threads, each with its own bounded queue.
+    Calls are assigned to a worker by key, so calls with the same key run one at a time in the order they were
+    submitted, while calls with different keys run in parallel on different workers.
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+
+    BY_TOPIC = 'topic'
+    BY_SENDER = 'sender'
+
+    def __init__(self, workers=4, maxQueue=1024, overflow=BLOCK):
+        """
+        Construct a dispatcher and start its worker threads
+        :param workers: the number of worker threads
+        :param maxQueue: the largest number of waiting calls per worker
+        :param overflow: what to do with a call for a full queue:
+                Dispatcher.BLOCK waits for room, Dispatcher.DROP_OLDEST discards the oldest waiting call and
+                Dispatcher.DROP_NEWEST discards the new call
+        """
+        if overflow not in (Dispatcher.BLOCK, Dispatcher.DROP_OLDEST, Dispatcher.DROP_NEWEST):
+            raise ValueError("Unknown overflow policy " + str(overflow))
+        self.queues = [WorkQueue(maxQueue, overflow) for _ in range(workers)]
+        self.threads = [Thread(target=self.__work, args=(queue,), daemon=True) for queue in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, target, *args, onDrop=None):
+        """
+        Queue a call to target(*args) after all earlier calls with the same key
+        :param key: the ordering key, usually a topic, signal or senderId
+        :param onDrop: a function without arguments to call if the call is dropped, when it is submitted or later
+                when it is discarded as the oldest waiting call
+        :return: True if the call was queued, False if it was dropped
+        """
+        return self.queues[hash(key) % len(self.queues)].put((target, args, onDrop))
+
+    def depth(self):
+        """
+        :return: the number of calls waiting in all queues
+        """
+        return sum(len(queue) for queue in self.queues)
+
+    def dropped(self):
+        """
+        :return: the number of calls dropped because a queue was full
+        """
+        return sum(queue.dropped for queue in self.queues)
+
+    def close(self, timeout=None):
+        """
+        Stop accepting calls and stop the workers when their queues are empty
+        :param timeout: how long to wait for each worker to finish, None to wait until done
+        """
+        for queue in self.queues:
+            queue.close()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    @staticmethod
+    def __work(queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            target, args, _ = item
+            try:
+                target(*args)
+            except Exception as e:
+                logging.getLogger('multicast-dispatcher').exception("callback failed: " + repr(e))
+
+
+class DeliveryQueue(object):
+    """
+        A bounded queue of the publications for one subscription, with a policy for what to do when it is full.
+        With the CONFLATE policy only the newest waiting message of each topic is kept, in the place of the first.
+    """
+    CONFLATE = 'conflate'
+
+    def __init__(self, maxsize=1024, overflow=CONFLATE):
+        """
+        :param maxsize: the largest number of waiting messages
+        :param overflow: DeliveryQueue.CONFLATE replaces the waiting message of the same topic and discards the oldest
+                waiting message when a new topic finds the queue full, Dispatcher.DROP_OLDEST discards the oldest
+                waiting message and Dispatcher.DROP_NEWEST discards the new message. Blocking is not offered, it would
+                stall the receive loop of the client.
+        """
+        if overflow not in (DeliveryQueue.CONFLATE, Dispatcher.DROP_OLDEST, Dispatcher.DROP_NEWEST):
+            raise ValueError("Unknown overflow policy " + str(overflow))
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.items = OrderedDict()  # By topic when conflating, otherwise by sequence number
+        self.condition = Condition()
+        self.dropped = 0
+        self.conflated = 0
+        self.closed = False
+        self.__seq = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, topic, item):
+        """
+        Add a message to the queue, applying the overflow policy
+        :return: True if the message was queued, False if it was dropped
+        """
+        with self.condition:
+            if self.closed:
+                return False
+            if self.overflow == DeliveryQueue.CONFLATE:
+                if topic in self.items:
+                    self.items[topic] = item
+                    self.conflated += 1
+                    return True
+                key = topic
+            else:
+                key = self.__seq
+                self.__seq += 1
+            if len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if self.overflow == Dispatcher.DROP_NEWEST:
+                    return False
+                self.items.popitem(last=False)
+            self.items[key] = item
+            self.condition.notify()
+            return True
+
+    def get(self):
+        """
+        Remove the oldest message from the queue, blocking until there is one
+        :return: the message, or None when the queue is closed
+        """
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            return self.items.popitem(last=False)[1]
+
+    def close(self):
+        """
+        Discard the waiting messages and stop get
+        """
+        with self.condition:
+            self.closed = True
+            self.items.clear()
+            self.condition.notify_all()
@@ -0,0 +1,112 @@
+"""
+    One socket and receive loop shared by many clients in a process
+"""
+from threading import Thread, Lock
+from tiipbusclient import multicasting
+from tiipbusclient.client import Client, ThreadedClient, openMulticastSocket
+
+__status__ = 'Development'
+
+
+class ClientHub(Client):
+    """
+    Receives for a set of clients in one thread from one socket. Each datagram is received, reassembled and split
+    once, and the frame is passed only to the clients it is for: requests, replies and NACKs by the client id in the
+    channel, publications to the clients that have subscriptions. The clients send on the socket of the hub and
+    skip their own frames as usual, so they also receive each other's messages.
+    """
+
+    def __init__(self, port=26000, address='ff01::1', batchReceive=False, transport=openMulticastSocket,
+                 receiveBuffer=None, sendBuffer=None, metrics=None):
+        """
+        Open the socket and start receiving
+        :param batchReceive: see Client
+        :param transport: see Client
+        :param receiveBuffer: see Client
+        :param sendBuffer: see Client
+        :param metrics: a Metrics to count the received traffic of all clients in
+        """
+        Client.__init__(self, '', port, address, batchReceive, metrics=metrics, transport=transport,
+                        receiveBuffer=receiveBuffer, sendBuffer=sendBuffer)
+        self.clients = dict()  # Replaced, not changed, so the receive loop can read it without locking
+        self.clientsLock = Lock()
+        self.__slashIds = False  # True if some client id has a '/', which hides where the id ends in a channel
+        t = Thread(target=self.run, daemon=True)
+        t.start()
+
+    def client(self, clientId, **kwargs):
+        """
+        Create a client that uses this hub
+        :param kwargs: the keyword arguments of ThreadedClient, except port, address, batchReceive, transport,
+                receiveBuffer and sendBuffer
+        :return: a ThreadedClient
+        """
+        return ThreadedClient(clientId, self.PORT, self.ADDR, hub=self, **kwargs)
+
+    def add(self, client):
+        """
+        Receive for client, called by the Client constructor
+        """
+        with self.clientsLock:
+            if client.clientId in self.clients:
+                raise Exception("client id " + client.clientId + " is already used in this hub")
+            clients = dict(self.clients)
+            clients[client.clientId] = client
+            self.__slashIds = any('/' in clientId for clientId in clients)
+            self.clients = clients
+
+    def remove(self, client):
+        """
+        Stop receiving for client, called by Client.close
+        """
+        with self.clientsLock:
+            clients = dict(self.clients)
+            if clients.get(client.clientId) is client:
+                del clients[client.clientId]
+            self.__slashIds = any('/' in clientId for clientId in clients)
+            self.clients = clients
+
+    def accepts(self, channel):
+        """
+        :return: False if a received frame on channel is of no use to any client of the hub
+        """
+        clients = self.clients
+        if not self.__slashIds and channel[:4] in ('req/', 'rep/', multicasting.NACK_CHANNEL):
+            client = clients.get(channel[4:].split('/', 1)[0])
+            if client is not None:
+                return client.accepts(channel)
+        return any(client.accepts(channel) for client in clients.values())
+
+    def _dispatch(self, clientId, channel, mid, message):
+        clients = self.clients
+        if channel.startswith('pub/') or channel.startswith(multicasting.SHM_CHANNEL):
+            targets = [client for client in clients.values() if len(client.subscriptions)]
+        elif channel == multicasting.BATCH_CHANNEL:
+            for recordChannel, recordMid, body in multicasting.unpackBatch(message):
+                self._dispatch(clientId, recordChannel, recordMid, body)
+            return
+        elif channel == multicasting.PRESENCE_CHANNEL:
+            targets = [client for client in clients.values() if client.directory is not None]
+        elif channel.startswith('req/') or channel.startswith('rep/') or channel.startswith(multicasting.NACK_CHANNEL):
+            target = channel[4:].split('/', 1)[0]
+            if target in clients and not self.__slashIds:
+                targets = [clients[target]]
+            elif self.__slashIds or target == multicasting.ALL_RECEIVERS or multicasting.RECEIVER_SEPARATOR in target:
+                targets = list(clients.values())  # Each client checks if the frame is for it
+            else:
+                return
+        else:
+            return
+        targets = [client for client in targets if client.clientId != clientId]
+        if len(targets) > 1:
+            message = multicasting.Payload.of(message)  # Decoded at most once, not in each client
+        for client in targets:
+            client._dispatch(clientId, channel, mid, message)
+
+    def close(self):
+        """
+        Close all clients of the hub and the socket
+        """
+        for client in list(self.clients.values()):
+            client.close()
+        Client.close(self)
@@ -0,0 +1,83 @@
+"""
+    A last-value cache participant, which lets late-joining subscribers start from the current state of topics
+"""
+import bisect
+import re
+from collections import OrderedDict
+from threading import Lock
+from tiipbusclient import multicasting
+from tiipbusclient.client import ThreadedClient
+from tiipbusclient.replycache import ReplyCache
+
+__status__ = 'Development'
+
+
+class LastValueCache(ThreadedClient):
+    """
+    Keeps the latest publication of each topic matching its patterns and answers snapshot requests on
+    multicasting.SNAPSHOT_SIGNAL, which ThreadedClient.snapshot and ThreadedClient.subscribe(..., snapshot=True) send.
+
+    A snapshot request has the body "<pattern>\\n<topic>", asking for the topics matching pattern that sort after
+    topic. The reply has the body "<last>\\n<records>" where records are packed like batch frames with the topic as
+    channel and "<senderId>/<mid>" as mid, and last is the last topic in the reply if more topics follow, otherwise
+    empty. Large snapshots are thus sent in several replies of at most maxReply bytes.
+    """
+
+    def __init__(self, clientId=multicasting.LAST_VALUE_CACHE, patterns=('.*',), maxTopics=65536,
+                 maxBytes=64 * 1024 * 1024, maxReply=32 * 1024, port=26000, address='ff01::1', **kwargs):
+        """
+        :param patterns: the subscription patterns of the topics to keep
+        :param maxTopics: the largest number of topics kept, the least recently published are dropped
+        :param maxBytes: the largest total size of the kept messages
+        :param maxReply: the size in bytes a snapshot reply is cut at
+        :param kwargs: the keyword arguments of ThreadedClient
+        """
+        ThreadedClient.__init__(self, clientId, port, address, **kwargs)
+        self.maxTopics = maxTopics
+        self.maxBytes = maxBytes
+        self.maxReply = maxReply
+        self.values = OrderedDict()  # topic: (senderId, mid, body as bytes), least recently published first
+        self.size = 0
+        self.valuesLock = Lock()
+        self.evicted = 0
+        self.snapshots = 0
+        for pattern in patterns:
+            self.subscribe(pattern, self.__store, threaded=False)
+        self.registerBusInterface(multicasting.SNAPSHOT_SIGNAL, self.__snapshot, replyCache=ReplyCache())
+
+    def __store(self, senderId, topic, mid, message):
+        body = message.encode('UTF-8') if isinstance(message, str) else bytes(message)
+        with self.valuesLock:
+            old = self.values.pop(topic, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.values[topic] = (senderId, mid, body)
+            self.size += len(body)
+            while len(self.values) > self.maxTopics or self.size > self.maxBytes:
+                _, (_, _, dropped) = self.values.popitem(last=False)
+                self.size -= len(dropped)
+                self.evicted += 1
+
+    def __snapshot(self, client, senderId, signal, mid, message):
+        pattern, _, after = multicasting.decode(message).partition('\n')
+        try:
+            matcher = re.compile(pattern)
+        except re.error:
+            client.reply('\n', senderId, signal, mid)
+            return
+        with self.valuesLock:
+            topics = sorted(topic for topic in self.values if matcher.match(topic))
+            start = bisect.bisect_right(topics, after) if after else 0
+            records = []
+            size = 0
+            last = ''
+            for topic in topics[start:]:
+                valueSender, valueMid, body = self.values[topic]
+                record = multicasting.packRecord(topic, valueSender + '/' + valueMid, body)
+                if records and size + len(record) > self.maxReply:
+                    last = records[-1][0]
+                    break
+                records.append((topic, record))
+                size += len(record)
+        self.snapshots += 1
+        client.reply(bytes(last + '\n', 'UTF-8') + b''.join(record for _, record in records), senderId, signal, mid)
@@ -0,0 +1,175 @@
+"""
+    Counters and latency histograms for the multicast clients
+"""
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Thread, Event
+
+__status__ = 'Development'
+
+
+class Histogram(object):
+    """
+    Counts of observed values in exponential buckets, from 1 microsecond doubling up to about 17 seconds for
+    durations in seconds. Recording is a bisect and a few additions, so histograms can be kept on hot paths.
+    """
+    BOUNDS = tuple(1e-6 * 2 ** i for i in range(25))
+    __slots__ = ('buckets', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.buckets[bisect_left(Histogram.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        :param q: the percentile as a fraction, e.g. 0.99
+        :return: the upper bound of the bucket holding the q percentile, max for the last bucket, None if empty
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return Histogram.BOUNDS[i] if i < len(Histogram.BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: a dict with count, sum, max, p50, p99 and the non empty buckets as (upper bound, count) pairs
+        """
+        bounds = Histogram.BOUNDS + (None,)
+        return dict(count=self.count, sum=self.sum, max=self.max, p50=self.percentile(0.5),
+                    p99=self.percentile(0.99), buckets=[(bounds[i], n) for i, n in enumerate(self.buckets) if n])
+
+
+class Metrics(object):
+    """
+    The counters, gauges and histograms of one or more clients. Pass a Metrics to a client to turn them on.
+    Counters and histograms are updated without locking, so a snapshot taken while the client is busy may be off
+    by the updates in progress.
+
+    Counters: messagesSent, datagramsSent, bytesSent, datagramsReceived, bytesReceived, fragmentsReceived,
+    messagesReceived, selfSkipped, requests, requestTimeouts, requestRetries
+    Histograms: subscriptionMatch, requestTime, and callback/<signal or topic> for the run time of callbacks, with the
+    signals and topics beyond the first maxCallbacks together in callback/other
+    Gauges are registered by the clients, e.g. reassemblyPending, reassemblyExpired or dispatcherDepth
+    """
+
+    OTHER_CALLBACKS = 'callback/other'
+
+    def __init__(self, maxCallbacks=256):
+        """
+        :param maxCallbacks: the largest number of signals and topics given a callback histogram of their own
+        """
+        self.counters = defaultdict(int)
+        self.histograms = dict()
+        self.gauges = dict()
+        self.maxCallbacks = maxCallbacks
+        self.callbacks = set()
+        self.__stop = Event()
+        self.__exporters = []
+
+    def count(self, name, n=1):
+        """
+        Add n to a counter
+        """
+        self.counters[name] += n
+
+    def observe(self, name, value):
+        """
+        Record a value, usually a duration in seconds, in a histogram
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(value)
+
+    def callbackName(self, signal):
+        """
+        :return: the name of the histogram for the callbacks of signal, callback/other once maxCallbacks signals and
+                topics have a histogram
+        """
+        if signal not in self.callbacks:
+            if len(self.callbacks) >= self.maxCallbacks:
+                return Metrics.OTHER_CALLBACKS
+            self.callbacks.add(signal)
+        return 'callback/' + signal
+
+    def gauge(self, name, function):
+        """
+        Register a gauge that is read when a snapshot is taken
+        :param function: a function without arguments returning the current value
+        """
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """
+        :return: a dict of counters, gauges and histograms, each a dict by name
+        """
+        gauges = dict()
+        for name, function in list(self.gauges.items()):
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                gauges[name] = None
+                logging.getLogger('multicast-metrics').warning("gauge " + name + " failed: " + repr(e))
+        return dict(time=time.time(), counters=dict(self.counters), gauges=gauges,
+                    histograms={name: histogram.snapshot() for name, histogram in list(self.histograms.items())})
+
+    def addExporter(self, exporter, interval=10):
+        """
+        Call exporter with a snapshot every interval seconds in a daemon thread, until close is called
+        :param exporter: a function taking the dict returned by snapshot
+        """
+        thread = Thread(target=self.__export, args=(exporter, interval), daemon=True)
+        self.__exporters.append(thread)
+        thread.start()
+
+    def close(self):
+        """
+        Stop the exporters
+        """
+        self.__stop.set()
+        for thread in self.__exporters:
+            thread.join()
+        self.__exporters = []
+
+    def __export(self, exporter, interval):
+        while not self.__stop.wait(interval):
+            try:
+                exporter(self.snapshot())
+            except Exception as e:
+                logging.getLogger('multicast-metrics').error("exporter failed: " + repr(e))
+
+
+def measured(client, signal, target):
+    """
+    :param signal: the signal or topic the target is called for
+    :return: target, wrapped to record its run time in the histogram Metrics.callbackName(signal) of client.metrics
+            if the client has metrics
+    """
+    metrics = getattr(client, 'metrics', None)
+    if metrics is None:
+        return target
+    name = metrics.callbackName(signal)
+
+    def run(*args):
+        start = time.perf_counter()
+        try:
+            return target(*args)
+        finally:
+            metrics.observe(name, time.perf_counter() - start)
+    return run
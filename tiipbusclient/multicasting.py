@@ -1,107 +1,753 @@
 import uuid
-import time
 import select
+import socket
+import struct
 import os
+import sys
 import logging
+from tiipbusclient.compression import inflate
 
 
 class ClientConstants(object):
-    MAXSIZE = 32768
+    MAXSIZE = 32768  # Size of the receive buffer, the largest datagram that can be received
+    DATAGRAMSIZE = 1232  # Largest datagram sent, IPv6 minimum MTU (1280) minus IPv6 and UDP headers
+    # Peers from before fragment numbering only read unfragmented text frames. While they are on the bus, setting
+    # DATAGRAMSIZE to MAXSIZE sends messages up to MAXSIZE as single datagrams they can read, like they did.
+    # Receive buffer openMulticastSocket asks for, a large message arrives as a burst of DATAGRAMSIZE fragments which
+    # overflows the default buffer of about 200 KB. The kernel caps it at net.core.rmem_max on Linux.
+    RECEIVE_BUFFER = 4 * 1024 * 1024
     SF_TIMEOUT = 10
+    MAXFRAGMENTS = 65535
+    REASSEMBLY_MAXBYTES = 64 * 1024 * 1024
+    BATCHSIZE = 64  # Largest number of datagrams received per wakeup in batched receive
+    INTERN_SIZE = 4096  # Largest number of received clientIds and channels kept as shared strings, 0 to disable
+    NACK_DELAY = 0.05  # Seconds without new fragments before missing fragments are requested, 0 to disable
+    NACK_RETRIES = 4
 
 
-def send(msg, channel, client, mid=None):
+_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+# Makes Linux attach the number of datagrams dropped on a socket to each received datagram
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+_DROPS = struct.Struct('I')
+_DROPS_SPACE = socket.CMSG_SPACE(_DROPS.size) if hasattr(socket, 'CMSG_SPACE') else 0
+
+BATCH_CHANNEL = 'bat/1'  # Channel of frames packing several messages, ignored by peers that do not know it
+# Prefixed to the channel of text frames with fragment fields, so peers that do not know them ignore the frames
+# instead of taking each fragment for a whole message
+FRAGMENT_PREFIX = 'frg/'
+_FRAGMENT_PREFIX = bytes(FRAGMENT_PREFIX, 'UTF-8')
+
+TEXT_FRAMES = 'text'
+BINARY_FRAMES = 'binary'
+
+# Binary frame header: magic, version, flags, clientId length, channel length, fragment index, fragment count, mid.
+# The magic byte can not start a text frame, so clients that know binary frames receive both formats on the same
+# group. Peers from before binary frames decode every datagram as UTF-8 and their receive loop dies on the first
+# binary frame, so every peer on the group must be upgraded before any client sends binary frames.
+BINARY_HEADER = struct.Struct('!BBBBHHH16s')
+BINARY_MAGIC = 0
+BINARY_VERSION = 1
+FLAG_FRAGMENT = 0x01
+FLAG_COMPRESSED = 0x02
+FLAG_RETRANSMIT = 0x04  # The sender keeps the fragments of this message and resends them on request
+FLAG_RESENT = 0x08  # A fragment sent again on request, which does not start a message receivers ask fragments for
+
+NACK_CHANNEL = 'nak/'  # Followed by the id of the sender of the incomplete message
+SHM_CHANNEL = 'shm/'  # Followed by the topic of a publication whose payload is in shared memory
+ALL_RECEIVERS = '*'  # Request target addressing every client with the signal registered
+RECEIVER_SEPARATOR = '|'  # Separates the ids in a request target addressing several clients
+LAST_VALUE_CACHE = 'lvc'  # Default client id of a lastvalue.LastValueCache
+SNAPSHOT_SIGNAL = 'snapshot'  # Signal of the snapshot requests answered by a lastvalue.LastValueCache
+PRESENCE_CHANNEL = 'prs/1'  # Channel of the announcements of presence.Presence, ignored by peers that do not know it
+_interned = dict()
+
+
+def send(msg, channel, client, mid=None, group=None):
+    """
+    Send a message as one or more text frames:
+            "<clientId>,<channel>,<mid>,<msg-body>"
+    Messages that do not fit in ClientConstants.DATAGRAMSIZE are split in fragments where the channel is prefixed with
+    FRAGMENT_PREFIX and the mid is followed by the fragment index and the fragment count:
+            "<clientId>,frg/<channel>,<mid>:<index>:<count>,<msg-body-part>"
+    If client.frameFormat is BINARY_FRAMES and the mid is a 32 digit hex string, binary frames are sent instead:
+            BINARY_HEADER, <clientId>, <channel>, <msg-body-part>
+    If client.compression is set, the payload may be compressed before it is split. Compressed text frames always
+    carry the fragment fields followed by a 'z' flag:
+            "<clientId>,frg/<channel>,<mid>:<index>:<count>:z,<msg-body-part>"
+    If client.retransmit is set and keeps the channel, the fragments of a split message are stored in it and marked
+    with FLAG_RETRANSMIT, or the 'r' flag in text frames, so receivers can ask for lost fragments. The kept copies are
+    also marked with FLAG_RESENT, or the 's' flag, to tell them from the first transmission when they are resent.
+    The header is encoded once and, where the socket has sendmsg, sent together with a memoryview of the body
+    without copying it into the datagram.
+    :param msg: the message as str, bytes, bytearray or memoryview
+    :param group: the multicast address to send to, if None client.ADDR or, if client.sharding is set, the group of
+            the channel
+    :return: the mid of the sent message
+    """
     mid = mid or uuid.uuid4().hex
-    header = bytes(client.clientId + "," + channel + "," + mid + ",", 'UTF-8')
-    jsonStringMsg = msg
-    if not isinstance(msg, bytes):
+    if isinstance(msg, (bytes, bytearray, memoryview)):
+        payload = memoryview(msg)
+        if payload.format != 'B' or payload.ndim != 1:
+            payload = payload.cast('B')
+    else:
         try:
-            jsonStringMsg = bytes(msg, 'UTF-8')
+            payload = memoryview(bytes(msg, 'UTF-8'))
         except Exception as e:
             logging.getLogger('multicast-send').error("msg is not a string" + str(type(msg)))
             raise e
-    if len(header) > ClientConstants.MAXSIZE:
-        raise Exception("Header is longer than msg MAXSIZE. Impossible to send")
-    if len(header + jsonStringMsg) > ClientConstants.MAXSIZE:
-        maxChunk = ClientConstants.MAXSIZE - len(header)
-        for i in range(int(len(jsonStringMsg)/maxChunk)+1):
-            client.socket.sendto(header + jsonStringMsg[maxChunk*i:maxChunk*(i+1)], (client.ADDR, client.PORT))
+    compressed = False
+    if getattr(client, 'compression', None):
+        payload, compressed = client.compression.compress(channel, payload)
+    retransmit = getattr(client, 'retransmit', None)
+    if retransmit and not retransmit.enabled(channel):
+        retransmit = None
+    binaryMid = None
+    if getattr(client, 'frameFormat', TEXT_FRAMES) == BINARY_FRAMES and len(mid) == 32:
+        try:
+            binaryMid = bytes.fromhex(mid)
+        except ValueError:
+            pass  # Not a uuid, fall back to a text frame
+    if binaryMid:
+        clientId = bytes(client.clientId, 'UTF-8')
+        channelBytes = bytes(channel, 'UTF-8')
+        if len(clientId) > 255 or len(channelBytes) > 65535:
+            raise Exception("clientId or channel too long for a binary frame")
+        names = clientId + channelBytes
+
+        def headerFor(index, count, resent=False):
+            flags = (FLAG_FRAGMENT | (FLAG_RETRANSMIT if retransmit else 0) if count > 1 else 0) | \
+                (FLAG_COMPRESSED if compressed else 0) | (FLAG_RESENT if resent else 0)
+            return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, len(clientId), len(channelBytes), index,
+                                      count, binaryMid) + names
+        maxHeader = BINARY_HEADER.size + len(names)
     else:
-        client.socket.sendto(header + jsonStringMsg, (client.ADDR, client.PORT))
+        header = bytes(client.clientId + "," + channel + "," + mid, 'UTF-8')
+        prefixedHeader = bytes(client.clientId + "," + FRAGMENT_PREFIX + channel + "," + mid, 'UTF-8')
+
+        def headerFor(index, count, resent=False):
+            flags = ('z' if compressed else '') + ('r' if retransmit and count > 1 else '') + ('s' if resent else '')
+            if flags:
+                return prefixedHeader + bytes(":%d:%d:%s," % (index, count, flags), 'UTF-8')
+            if count == 1:
+                return header + b','
+            return prefixedHeader + bytes(":%d:%d," % (index, count), 'UTF-8')
+        # Reserve room for the longest possible ":<index>:<count>:zrs," suffix
+        maxHeader = len(prefixedHeader) + 7 + 2 * len(str(len(payload)))
+    address = (group or __groupFor(client, channel), client.PORT)
+    sendmsg = getattr(client.socket, 'sendmsg', None)
+    metrics = getattr(client, 'metrics', None)
+    pacer = getattr(client, 'pacer', None)
+    single = headerFor(0, 1)
+    if len(single) + len(payload) <= ClientConstants.DATAGRAMSIZE:
+        if pacer:
+            pacer.pace(channel, len(single) + len(payload))
+        __sendParts(client, sendmsg, address, single, payload)
+        if metrics:
+            metrics.count('messagesSent')
+            metrics.count('datagramsSent')
+            metrics.count('bytesSent', len(single) + len(payload))
+        return mid
+    maxChunk = ClientConstants.DATAGRAMSIZE - maxHeader
+    if maxChunk <= 0:
+        raise Exception("Header is longer than DATAGRAMSIZE. Impossible to send")
+    count = (len(payload) + maxChunk - 1) // maxChunk
+    if count > ClientConstants.MAXFRAGMENTS:
+        raise Exception("Message is split in more than MAXFRAGMENTS fragments. Impossible to send")
+    for i in range(count):
+        fragmentHeader = headerFor(i, count)
+        chunk = payload[maxChunk*i:maxChunk*(i+1)]
+        if retransmit:
+            retransmit.store(mid, i, headerFor(i, count, True) + chunk, address)
+        if pacer:
+            pacer.pace(channel, len(fragmentHeader) + len(chunk))
+        __sendParts(client, sendmsg, address, fragmentHeader, chunk)
+        if metrics:
+            metrics.count('bytesSent', len(fragmentHeader) + len(chunk))
+    if metrics:
+        metrics.count('messagesSent')
+        metrics.count('datagramsSent', count)
     return mid
 
 
-def recv(client, requiredHeader=None):  # recv packets
+def __groupFor(client, channel):
+    sharding = getattr(client, 'sharding', None)
+    if sharding:
+        return sharding.groupFor(channel) or client.ADDR
+    return client.ADDR
+
+
+def __sendParts(client, sendmsg, address, header, body):
+    if sendmsg:
+        sendmsg((header, body), (), 0, address)
+    else:
+        client.socket.sendto(header + body, address)
+
+
+def sendRecords(records, client):
+    """
+    Send several messages packed in as few datagrams as possible. A packed frame is sent on BATCH_CHANNEL
+    with a body of records:
+            "<channel>,<mid>,<body-length>,<msg-body>"
+    A message that is alone in its datagram is sent as an ordinary frame.
+    :param records: a list of (channel, mid, body) where body is bytes
+    """
+    if getattr(client, 'sharding', None):
+        groups = dict()
+        for record in records:
+            groups.setdefault(__groupFor(client, record[0]), []).append(record)
+        for group, groupRecords in groups.items():
+            __packRecords(groupRecords, client, group)
+    else:
+        __packRecords(records, client, None)
+
+
+def __packRecords(records, client, group):
+    overhead = len(bytes(client.clientId + "," + BATCH_CHANNEL + ",", 'UTF-8')) + 33
+    batch = []
+    size = overhead
+    for channel, mid, body in records:
+        packed = packRecord(channel, mid, body)
+        if batch and size + len(packed) > ClientConstants.DATAGRAMSIZE:
+            __sendBatch(client, batch, group)
+            batch = []
+            size = overhead
+        batch.append(((channel, mid, body), packed))
+        size += len(packed)
+    if batch:
+        __sendBatch(client, batch, group)
+
+
+def __sendBatch(client, batch, group):
+    if len(batch) == 1:
+        channel, mid, body = batch[0][0]
+        send(body, channel, client, mid, group)
+    else:
+        send(b''.join(packed for _, packed in batch), BATCH_CHANNEL, client, group=group)
+
+
+def packRecord(channel, mid, body):
+    """
+    :param body: the body as bytes
+    :return: the record as bytes, in the format read by unpackBatch
+    """
+    return bytes(channel + "," + mid + "," + str(len(body)) + ",", 'UTF-8') + body
+
+
+def unpackBatch(body):
+    """
+    Unpack the records of a frame received on BATCH_CHANNEL
+    :param body: the body of the frame as str or a bytes-like object
+    :return: a generator of (channel, mid, body) for each record, where body is a memoryview
+    """
+    data = body.encode('UTF-8') if isinstance(body, str) else bytes(body)
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        first = data.find(b',', pos)
+        second = data.find(b',', first + 1) if first >= 0 else -1
+        third = data.find(b',', second + 1) if second >= 0 else -1
+        if third < 0:
+            return  # Malformed
+        try:
+            end = third + 1 + int(data[second + 1:third])
+        except ValueError:
+            return  # Malformed
+        yield str(view[pos:first], 'UTF-8'), str(view[first + 1:second], 'UTF-8'), view[third + 1:end]
+        pos = end
+
+
+def requestSignal(channel, clientId):
+    """
+    :param channel: the channel of a received request, 'req/<target>/<signal>'
+    :param clientId: the id of the receiving client
+    :return: the signal if the target is clientId, ALL_RECEIVERS or a RECEIVER_SEPARATOR separated list of ids
+            including clientId, otherwise None
+    """
+    if channel.startswith('req/' + clientId + '/'):
+        return channel.split('/', 2)[2]
+    target, _, signal = channel[4:].partition('/')
+    if target == ALL_RECEIVERS or RECEIVER_SEPARATOR in target and clientId in target.split(RECEIVER_SEPARATOR):
+        return signal
+    return None
+
+
+def accepts(channel, clientId, signals, subscriptions, presence=False):
+    """
+    Check the channel of a received frame before its body is reassembled, decompressed or decoded
+    :param clientId: the id of the receiving client
+    :param signals: the signals registered by the receiving client
+    :param subscriptions: the SubscriptionTable of the receiving client
+    :param presence: True if the receiving client keeps a presence.Directory
+    :return: False if the frame is of no use to the receiving client
+    """
+    if channel.startswith('pub/'):
+        return bool(subscriptions.match(channel[4:]))
+    if channel.startswith('req/'):
+        return requestSignal(channel, clientId) in signals
+    if channel.startswith('rep/'):
+        return channel.startswith('rep/' + clientId + '/')
+    if channel.startswith(NACK_CHANNEL):
+        return channel == NACK_CHANNEL + clientId
+    if channel.startswith(SHM_CHANNEL):
+        return bool(subscriptions.match(channel[len(SHM_CHANNEL):]))
+    if channel == PRESENCE_CHANNEL:
+        return presence
+    return channel == BATCH_CHANNEL
+
+
+def sendNacks(client):
+    """
+    Ask the senders of incomplete messages that keep their fragments for the fragments that are missing,
+    with a frame on NACK_CHANNEL + <senderId> carrying the mid and a body of comma separated fragment indices.
+    """
+    if not ClientConstants.NACK_DELAY:
+        return
+    for clientId, mid, missing in client.reassembler.stale(ClientConstants.NACK_DELAY, ClientConstants.NACK_RETRIES,
+                                                           ClientConstants.DATAGRAMSIZE // 8):
+        send(",".join(str(index) for index in missing), NACK_CHANNEL + clientId, client, mid)
+
+
+def handleNack(client, mid, body):
+    """
+    Resend the fragments asked for in a received NACK frame
+    :param client: A multicast client with a retransmit buffer
+    :param mid: the mid of the incomplete message
+    :param body: the body of the NACK frame
+    :return: the number of resent fragments
+    """
+    retransmit = getattr(client, 'retransmit', None)
+    if not retransmit:
+        return 0
+    try:
+        indices = [int(index) for index in decode(body).split(',')]
+    except ValueError:
+        return 0  # Malformed
+    datagrams = retransmit.get(mid, indices)
+    pacer = getattr(client, 'pacer', None)
+    for datagram, address in datagrams:
+        if pacer:
+            pacer.pace(None, len(datagram))
+        client.socket.sendto(datagram, address or (client.ADDR, client.PORT))
+    return len(datagrams)
+
+
+def recv(client):  # recv packets
     """
     Receive a full frame of data:
             "<clientId>,<channel>,<mid>,<msg-body>"
     :param client: A multicast client with the following members:
             socket: a readable socket
             isKilled: a file descriptor which is readable only when socket is killed
-            inbox: a list to store messages when assembling message parts
+            reassembler: a Reassembler to store fragments of messages until they are complete
+    :return: the frame as a string, or None if no complete frame was received before ClientConstants.SF_TIMEOUT
     """
-    frame = None
-    if client.closing:
+    if not __wait(client):
         return
-    if not client.inbox:
-        client.inbox = list()
-    if len(client.inbox) > 0:
-        client.lock()
-        if requiredHeader:
-            for i in range(len(client.inbox)):
-                 if requiredHeader == client.inbox[i].split(',',3)[0:3]:
-                     frame = client.inbox.pop(i)
-                     break
-        else:
-            frame = client.inbox.pop(0)
-        client.unlock()
-    if not frame:
-        if os.name == 'nt':
-            [rlist, _, _] = select.select([client.socket], [], [], ClientConstants.SF_TIMEOUT)
-            if client.closing:
-                return
-        else:
-            [rlist, _, _] = select.select([client.socket, client.isKilled], [], [], ClientConstants.SF_TIMEOUT)
-        if client.socket in rlist:
-            bframe, _ = client.socket.recvfrom(ClientConstants.MAXSIZE)
-            frame = bframe.decode('UTF-8')
-            if frame.split(',', 1)[0] == client.clientId:
-                return
-        else:
-            return  # Timeout
-    
-    if len(frame) == ClientConstants.MAXSIZE:  # Multiframe message
-        return  __handleMultiframe(client, frame)
+    bframe, _ = client.socket.recvfrom(ClientConstants.MAXSIZE)
+    frame = handleDatagram(client, bframe)
+    maintain(client)
+    return frame
+
+
+def recvMessage(client):
+    """
+    Receive one datagram like recv, without decoding the frame
+    :param client: A multicast client with the members used by recv. If client.dropCounting is set the datagram is
+            received with recvmsg and client.kernelDrops is updated from its ancillary data
+    :return: (clientId, channel, mid, body) when a message is complete, see parseDatagram, otherwise None
+    """
+    if not __wait(client):
+        return
+    if getattr(client, 'dropCounting', False):
+        bframe, ancdata, _, _ = client.socket.recvmsg(ClientConstants.MAXSIZE, _DROPS_SPACE)
+        __countDrops(client, ancdata)
+    else:
+        bframe, _ = client.socket.recvfrom(ClientConstants.MAXSIZE)
+    frame = parseDatagram(client, bframe, len(bframe))
+    maintain(client)
     return frame
 
 
-def __handleMultiframe(client, frame):
-    framesegments = frame.split(',', 3)
-    returnval = frame
-    timestamp = time.time()
-    done = False
+def recvBatch(client):
+    """
+    Wait until the socket is readable, then drain it without blocking into buffers from client.bufferPool, up to
+    ClientConstants.BATCHSIZE datagrams, and parse the received datagrams.
+    :param client: A multicast client with the members used by recv and a bufferPool
+    :return: a generator of (clientId, channel, mid, body) for each complete message, see parseDatagram. The buffers
+             are reused when the generator is resumed, so body is only valid until the next frame is requested.
+    """
+    if not __wait(client):
+        return
+    pool = client.bufferPool
+    dropCounting = getattr(client, 'dropCounting', False)
+    buffers = []
+    try:
+        while len(buffers) < ClientConstants.BATCHSIZE:
+            if buffers and not _DONTWAIT and not select.select([client.socket], [], [], 0)[0]:
+                break
+            buf = pool.acquire()
+            try:
+                if dropCounting:
+                    length, ancdata, _, _ = client.socket.recvmsg_into([buf], _DROPS_SPACE, _DONTWAIT if buffers else 0)
+                    __countDrops(client, ancdata)
+                else:
+                    length = client.socket.recv_into(buf, ClientConstants.MAXSIZE, _DONTWAIT if buffers else 0)
+            except (BlockingIOError, InterruptedError):
+                pool.release(buf)
+                break
+            buffers.append((buf, length))
+        for buf, length in buffers:
+            frame = parseDatagram(client, buf, length)
+            if frame:
+                yield frame
+        maintain(client)
+    finally:
+        for buf, _ in buffers:
+            pool.release(buf)
+
+
+def enableDropCounting(sock):
+    """
+    Ask the kernel to report the datagrams it dropped on sock because its receive buffer was full
+    :return: True if the drops are reported, the count arrives as ancillary data of datagrams received with recvmsg
+    """
+    if SO_RXQ_OVFL is None or not hasattr(sock, 'recvmsg'):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+def __countDrops(client, ancdata):
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= _DROPS.size:
+            client.kernelDrops = _DROPS.unpack_from(data)[0]  # Counted since the socket was opened
 
-    while not done and time.time() < (timestamp + ClientConstants.SF_TIMEOUT):
+
+def maintain(client):
+    """
+    Discard expired incomplete messages and send NACKs for the missing fragments of stalled ones
+    """
+    client.reassembler.expire()
+    if len(client.reassembler):
+        sendNacks(client)
+
+
+def __wait(client):
+    """
+    :return: True if the socket is readable within ClientConstants.SF_TIMEOUT, or ClientConstants.NACK_DELAY while
+             messages are incomplete
+    """
+    if client.closing:
+        return False
+    timeout = ClientConstants.SF_TIMEOUT
+    if len(client.reassembler) and ClientConstants.NACK_DELAY:
+        timeout = ClientConstants.NACK_DELAY
+    if os.name == 'nt':
+        [rlist, _, _] = select.select([client.socket], [], [], timeout)
+        if client.closing:
+            return False
+    else:
+        [rlist, _, _] = select.select([client.socket, client.isKilled], [], [], timeout)
+    if client.socket in rlist:
+        return True
+    maintain(client)  # Timeout
+    return False
+
+
+def handleDatagram(client, bframe):
+    """
+    Handle one received datagram
+    :param client: A multicast client with a clientId and a reassembler
+    :param bframe: The datagram as bytes
+    :return: the frame as a string when a message is complete, None for fragments, malformed frames and frames from self
+    """
+    frame = parseDatagram(client, bframe, len(bframe))
+    if frame:
+        clientId, channel, mid, body = frame
+        return clientId + "," + channel + "," + mid + "," + decode(body)
+
+
+def parseDatagram(client, buf, length):
+    """
+    Parse one received text or binary datagram and pass fragments to the reassembler. Only the header is decoded
+    until the channel is known, frames on channels rejected by client.accepts are dropped before their body is
+    reassembled or decoded.
+    :param client: A multicast client with a clientId, a reassembler and optionally an accepts function taking the
+            channel
+    :param buf: a bytes or bytearray holding the datagram
+    :param length: the length of the datagram in buf
+    :return: (clientId, channel, mid, body) when a message is complete, where body is a memoryview into buf or, for
+             reassembled messages, bytes. None for fragments, malformed frames and frames from self
+    """
+    metrics = getattr(client, 'metrics', None)
+    if metrics:
+        metrics.count('datagramsReceived')
+        metrics.count('bytesReceived', length)
+    recorder = getattr(client, 'recorder', None)
+    if recorder and length:
+        recorder.record(buf, length)
+    if length and buf[0] == BINARY_MAGIC:
+        frame = __parseBinary(client, buf, length, metrics)
+        if frame and metrics:
+            metrics.count('messagesReceived')
+        return frame
+    if buf.startswith(bytes(client.clientId + ",", 'UTF-8'), 0, length):
+        if metrics:
+            metrics.count('selfSkipped')
+        return
+    first = buf.find(b',', 0, length)
+    second = buf.find(b',', first + 1, length) if first >= 0 else -1
+    third = buf.find(b',', second + 1, length) if second >= 0 else -1
+    if third < 0:
+        return  # Malformed
+    view = memoryview(buf)
+    if buf.startswith(_FRAGMENT_PREFIX, first + 1, second):
+        channel = __intern(view[first + 1 + len(_FRAGMENT_PREFIX):second])
+    else:
+        channel = __intern(view[first + 1:second])
+    if not __accepted(client, channel, metrics):
+        return
+    clientId = __intern(view[:first])
+    mid = str(view[second + 1:third], 'UTF-8')
+    body = view[third + 1:length]
+    compressed = False
+    if ':' in mid:
+        try:
+            mid, index, count, *flags = mid.split(':')
+            index, count = int(index), int(count)
+        except ValueError:
+            return  # Malformed
+        flags = flags[0] if flags else ''
+        compressed = 'z' in flags
+        if metrics:
+            metrics.count('fragmentsReceived')
+        body = client.reassembler.add(clientId, mid, channel, index, count, body, nackable='r' in flags,
+                                      resent='s' in flags)
+    elif length == ClientConstants.MAXSIZE or (clientId, mid) in client.reassembler:
+        # Fragments from peers that split messages at MAXSIZE without numbering them
+        body = client.reassembler.addLegacy(clientId, mid, channel, body, length == ClientConstants.MAXSIZE)
+    if body is None:
+        return
+    if compressed:
+        body = __decompress(client, body)
+        if body is None:
+            return
+    if metrics:
+        metrics.count('messagesReceived')
+    return clientId, channel, mid, body
+
+
+def peekHeader(buf, length):
+    """
+    Read the header of a text or binary datagram without reassembling or decoding its body
+    :param buf: a bytes-like object holding the datagram
+    :param length: the length of the datagram in buf
+    :return: (clientId, channel, mid) where mid is without fragment numbering, or None if the datagram is malformed
+    """
+    view = memoryview(buf)
+    try:
+        if length and buf[0] == BINARY_MAGIC:
+            if length < BINARY_HEADER.size:
+                return None
+            _, version, _, idLength, channelLength, _, _, binaryMid = BINARY_HEADER.unpack_from(buf, 0)
+            namesEnd = BINARY_HEADER.size + idLength + channelLength
+            if version != BINARY_VERSION or namesEnd > length:
+                return None
+            return (str(view[BINARY_HEADER.size:BINARY_HEADER.size + idLength], 'UTF-8'),
+                    str(view[BINARY_HEADER.size + idLength:namesEnd], 'UTF-8'), binaryMid.hex())
+        first = buf.find(b',', 0, length)
+        second = buf.find(b',', first + 1, length) if first >= 0 else -1
+        third = buf.find(b',', second + 1, length) if second >= 0 else -1
+        if third < 0:
+            return None
+        start = first + 1
+        if buf.startswith(_FRAGMENT_PREFIX, start, second):
+            start += len(_FRAGMENT_PREFIX)
+        return (str(view[:first], 'UTF-8'), str(view[start:second], 'UTF-8'),
+                str(view[second + 1:third], 'UTF-8').split(':', 1)[0])
+    except UnicodeDecodeError:
+        return None
+
+
+def __parseBinary(client, buf, length, metrics):
+    if length < BINARY_HEADER.size:
+        return  # Malformed
+    _, version, flags, idLength, channelLength, index, count, binaryMid = BINARY_HEADER.unpack_from(buf, 0)
+    namesEnd = BINARY_HEADER.size + idLength + channelLength
+    if version != BINARY_VERSION or namesEnd > length:
+        return  # Unknown version or malformed
+    view = memoryview(buf)
+    clientId = __intern(view[BINARY_HEADER.size:BINARY_HEADER.size + idLength])
+    if clientId == client.clientId:
+        if metrics:
+            metrics.count('selfSkipped')
+        return
+    channel = __intern(view[BINARY_HEADER.size + idLength:namesEnd])
+    if not __accepted(client, channel, metrics):
+        return
+    mid = binaryMid.hex()
+    body = view[namesEnd:length]
+    if flags & FLAG_FRAGMENT:
+        if metrics:
+            metrics.count('fragmentsReceived')
+        body = client.reassembler.add(clientId, mid, channel, index, count, body,
+                                      nackable=bool(flags & FLAG_RETRANSMIT), resent=bool(flags & FLAG_RESENT))
+        if body is None:
+            return
+    if flags & FLAG_COMPRESSED:
+        body = __decompress(client, body)
+        if body is None:
+            return
+    return clientId, channel, mid, body
+
+
+def __accepted(client, channel, metrics):
+    accepts = getattr(client, 'accepts', None)
+    if accepts is None or accepts(channel):
+        return True
+    if metrics:
+        metrics.count('filtered')
+    return False
+
+
+def __decompress(client, body):
+    compression = getattr(client, 'compression', None)
+    if compression:
+        data = compression.decompress(body, ClientConstants.REASSEMBLY_MAXBYTES)
+    else:
+        data = inflate(body, ClientConstants.REASSEMBLY_MAXBYTES)
+    if data is None:
+        logging.getLogger('multicast-recv').warning("dropped a corrupt or oversized compressed message")
+    return data
+
+
+def __intern(view):
+    """
+    Decode a clientId or channel, sharing one string object for each distinct value
+    """
+    if not ClientConstants.INTERN_SIZE:
+        return str(view, 'UTF-8')
+    key = bytes(view)
+    try:
+        return _interned[key]
+    except KeyError:
+        value = str(key, 'UTF-8')
+        if len(_interned) >= ClientConstants.INTERN_SIZE:
+            _interned.clear()
+        _interned[key] = value
+        return value
+
+
+def encode(body):
+    """
+    :param body: a message body as str or a bytes-like object
+    :return: the body as bytes, str encoded as UTF-8
+    """
+    if isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode('UTF-8')
+    return bytes(memoryview(body))
+
+
+def decode(body):
+    """
+    :param body: a message body as str, Payload or a bytes-like object
+    :return: the body as str
+    """
+    if isinstance(body, str):
+        return body
+    if isinstance(body, Payload):
+        return str(body)
+    return str(body, 'UTF-8')
+
+
+class Payload(object):
+    """
+    A received message body that is only decoded when it is first used as str. str(payload) gives the text,
+    bytes(payload) or payload.data the raw body.
+    """
+    __slots__ = ('data', '_text', '_parsed')
+
+    def __init__(self, body):
         """
-            nextFrame: is either
-            * a new meesage,
-            * the remaining part(s) of current msg (all parts due to recursion)
-            * None Timeout or Message from self
+        :param body: the body as str or a bytes-like object, which is copied unless it is bytes or a view of bytes
         """
-        nextFrame = recv(client, framesegments[0:3])
-        if not nextFrame:
-            continue
-        nextSegments = nextFrame.split(',', 3)
-        if framesegments[0:3] == nextSegments[0:3]:  # Compare headers
-            returnval += nextSegments[3]  # append nextFrame messgage body
-            done = True
+        if isinstance(body, str):
+            self._text = body
+            body = body.encode('UTF-8')
         else:
-            client.lock()
-            client.inbox.append(nextFrame)   # Not my message store for later
-            client.unlock()
-    if not done:
-        return  # Timeout
-    else:
-        return returnval
+            self._text = None
+            if not isinstance(body, bytes) and not (isinstance(body, memoryview) and isinstance(body.obj, bytes)):
+                body = bytes(body)  # The buffer may be reused for the next datagram
+        self.data = body
+        self._parsed = None
+
+    @classmethod
+    def of(cls, body):
+        """
+        :return: body if it is a Payload, otherwise a Payload of body
+        """
+        return body if isinstance(body, cls) else cls(body)
+
+    def parsed(self, parse, *args):
+        """
+        Parse the payload once for all the callbacks it is passed to, which are all called for the same frame
+        :param parse: a function taking the payload and args, the same function for all callbacks sharing the result
+        :return: the result of parse
+        """
+        parsed = self._parsed
+        if parsed is None or parsed[0] is not parse:
+            parsed = self._parsed = (parse, parse(self, *args))
+        return parsed[1]
+
+    def __str__(self):
+        if self._text is None:
+            self._text = str(self.data, 'UTF-8')
+        return self._text
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return str(self) == other
+        if isinstance(other, Payload):
+            return self.data == other.data
+        return self.data == other
+
+    __hash__ = None
 
+    def __repr__(self):
+        return 'Payload(%r)' % bytes(self.data)
+
+
+class BufferPool(object):
+    """
+        A pool of reusable receive buffers
+    """
+
+    def __init__(self, count, size):
+        """
+        :param count: the largest number of free buffers kept in the pool
+        :param size: the size of each buffer
+        """
+        self.count = count
+        self.size = size
+        self.free = [bytearray(size) for _ in range(count)]
+
+    def acquire(self):
+        try:
+            return self.free.pop()
+        except IndexError:
+            return bytearray(self.size)
 
+    def release(self, buf):
+        if len(self.free) < self.count:
+            self.free.append(buf)
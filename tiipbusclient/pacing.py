@@ -0,0 +1,88 @@
+"""
+    Pacing of sent datagrams, so bursts do not overflow the receive buffers of slower receivers
+"""
+import re
+import time
+from threading import Lock
+from tiipbusclient.multicasting import ClientConstants
+
+__status__ = 'Development'
+
+
+class TokenBucket(object):
+    """
+    Allows rate bytes per second on average, with bursts of up to burst bytes sent back to back
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: the average bytes per second
+        :param burst: the largest number of bytes sent without waiting, by default a tenth of a second of traffic
+                but at least one datagram
+        """
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(self.rate / 10, ClientConstants.DATAGRAMSIZE)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def delay(self, size):
+        """
+        Take size tokens, going into debt when there are not enough, so concurrent senders queue up behind each other
+        :return: the seconds to wait before sending size bytes
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= size
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class Pacer(object):
+    """
+    Paces the datagrams sent by a client with a token bucket for all its traffic and optional token buckets for
+    channels. Sending blocks while a bucket is empty.
+    """
+
+    def __init__(self, rate=None, burst=None, channels=None):
+        """
+        :param rate: the bytes per second of all traffic of the client, None for no limit
+        :param burst: see TokenBucket
+        :param channels: a dict mapping regular expressions matched against channels, e.g. 'pub/video/', to a rate or
+                a (rate, burst) tuple for the traffic on the matching channels. The first matching expression is used.
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.channels = []
+        for pattern, limit in (channels or dict()).items():
+            rate, burst = limit if isinstance(limit, tuple) else (limit, None)
+            self.channels.append((re.compile(pattern), TokenBucket(rate, burst)))
+        self.paced = 0  # Datagrams that had to wait
+        self.waited = 0.0  # Seconds waited in total
+        self.__buckets = dict()
+
+    def __bucketFor(self, channel):
+        try:
+            return self.__buckets[channel]
+        except KeyError:
+            bucket = next((bucket for pattern, bucket in self.channels if pattern.match(channel)), None)
+            if len(self.__buckets) < 4096:
+                self.__buckets[channel] = bucket
+            return bucket
+
+    def pace(self, channel, size):
+        """
+        Wait until size bytes may be sent on channel
+        :param channel: the channel of the datagram, None to only use the bucket for all traffic
+        """
+        wait = self.bucket.delay(size) if self.bucket else 0.0
+        if channel is not None and self.channels:
+            bucket = self.__bucketFor(channel)
+            if bucket:
+                wait = max(wait, bucket.delay(size))
+        if wait > 0:
+            self.paced += 1
+            self.waited += wait
+            time.sleep(wait)
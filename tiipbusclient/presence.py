@@ -0,0 +1,180 @@
+"""
+    Presence announcements and the directory of the clients on the bus
+
+    A client with presence enabled sends a frame on multicasting.PRESENCE_CHANNEL every interval seconds, with the
+    body "<interval>\\n<load>\\n<signal>\\n<signal>...": the seconds until its next announcement, a load hint where
+    lower is less busy, and the signals it has registered. A client leaving the bus announces an interval of 0.
+"""
+import logging
+import random
+import time
+from queue import Empty
+from threading import Thread, Event, Lock
+from tiipbusclient import multicasting
+
+__status__ = 'Development'
+
+
+class Unreachable(Empty):
+    """
+    Raised by Client.request instead of waiting for the timeout when the directory knows the receiver is not on the
+    bus or does not serve the signal. Handlers of the Empty raised on timeouts also handle it.
+    """
+
+
+def presenceBody(interval, load, signals):
+    return '%g\n%g\n' % (interval, load) + '\n'.join(sorted(signals))
+
+
+class Directory(object):
+    """
+    The clients on the bus as learned from their presence announcements. A client is alive until it has missed
+    misses announcements in a row, and expired clients are remembered for FORGET seconds to tell them from unknown
+    ones.
+    """
+    FORGET = 300
+
+    def __init__(self, misses=3, warmup=10.0):
+        """
+        :param misses: the number of announcements in a row a client may miss before it is taken for gone
+        :param warmup: seconds after which every client on the bus has announced itself, until then unreachable
+                reports nothing
+        """
+        self.misses = misses
+        self.warmUntil = time.monotonic() + warmup
+        self.entries = dict()  # clientId: (expires, signals, load)
+        self.lock = Lock()
+        self.nextPrune = 0
+        self.departed = 0
+        self.expired = 0
+
+    def update(self, clientId, body, now=None):
+        """
+        Record a received announcement
+        :param body: the body of the announcement, as str
+        """
+        now = now or time.monotonic()
+        lines = body.split('\n')
+        try:
+            interval, load = float(lines[0]), float(lines[1])
+        except (ValueError, IndexError):
+            logging.getLogger('multicast-presence').warning("malformed announcement from " + clientId)
+            return
+        with self.lock:
+            if interval <= 0:
+                if self.entries.pop(clientId, None) is not None:
+                    self.departed += 1
+                return
+            self.entries[clientId] = (now + interval * self.misses, frozenset(lines[2:]) - {''}, load)
+            if now >= self.nextPrune:
+                self.__prune(now)
+
+    def __prune(self, now):
+        self.nextPrune = now + 1
+        for clientId in [clientId for clientId, entry in self.entries.items() if entry[0] + self.FORGET < now]:
+            del self.entries[clientId]
+            self.expired += 1
+
+    def ready(self, now=None):
+        """
+        :return: True once the warmup is over, when a client missing from the directory is not on the bus
+        """
+        return (now or time.monotonic()) >= self.warmUntil
+
+    def alive(self, clientId, now=None):
+        """
+        :return: (signals, load) of clientId if it is alive, otherwise None
+        """
+        entry = self.entries.get(clientId)
+        if entry is None or entry[0] < (now or time.monotonic()):
+            return None
+        return entry[1], entry[2]
+
+    def clients(self, now=None):
+        """
+        :return: the sorted ids of the clients that are alive
+        """
+        now = now or time.monotonic()
+        with self.lock:
+            return sorted(clientId for clientId, entry in self.entries.items() if entry[0] >= now)
+
+    def servers(self, signal, now=None):
+        """
+        :return: the ids of the alive clients that have signal registered, least loaded first
+        """
+        now = now or time.monotonic()
+        with self.lock:
+            serving = [(entry[2], clientId) for clientId, entry in self.entries.items()
+                       if entry[0] >= now and signal in entry[1]]
+        return [clientId for _, clientId in sorted(serving)]
+
+    def unreachable(self, clientId, signal, now=None):
+        """
+        :return: why a request for signal to clientId would not be answered, or None if it may be answered or the
+                directory is still warming up
+        """
+        now = now or time.monotonic()
+        if not self.ready(now):
+            return None
+        entry = self.entries.get(clientId)
+        if entry is None:
+            return "is not on the bus"
+        if entry[0] < now:
+            return "stopped announcing itself"
+        if signal not in entry[1]:
+            return "does not serve " + signal
+        return None
+
+
+class Presence(object):
+    """
+    Announces a client on PRESENCE_CHANNEL every interval seconds, with 10% jitter to keep clients started together
+    from announcing together, and once more when it leaves.
+    """
+
+    def __init__(self, client, interval=2.0, load=None):
+        """
+        Construct a presence and start its announcing thread
+        :param client: the client to announce, with its signals method
+        :param interval: the seconds between announcements
+        :param load: a function returning the load hint to announce, if None the depth of the dispatcher of a
+                ThreadedClient or 0
+        """
+        self.client = client
+        self.interval = interval
+        if load is None:
+            dispatcher = getattr(client, 'dispatcher', None)
+            load = dispatcher.depth if dispatcher else lambda: 0
+        self.load = load
+        self.announced = 0
+        self.closed = Event()
+        self.thread = Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def announce(self):
+        """
+        Send an announcement now, e.g. after the signals of the client changed
+        """
+        if self.closed.is_set():
+            return
+        multicasting.send(presenceBody(self.interval, self.load(), self.client.signals()),
+                          multicasting.PRESENCE_CHANNEL, self.client)
+        self.announced += 1
+
+    def close(self):
+        """
+        Stop announcing and announce that the client leaves
+        """
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.thread.join(1)
+        multicasting.send(presenceBody(0, 0, ()), multicasting.PRESENCE_CHANNEL, self.client)
+
+    def __run(self):
+        while not self.closed.is_set():
+            try:
+                self.announce()
+            except Exception as e:
+                logging.getLogger('multicast-presence').warning("announcement failed: " + repr(e))
+            self.closed.wait(self.interval * random.uniform(0.9, 1.0))
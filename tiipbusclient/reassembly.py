@@ -0,0 +1,195 @@
+"""
+    Reassembly of fragmented multicast messages
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+__status__ = 'Development'
+
+
+class Partial(object):
+    """
+        The received fragments of a message that is not yet complete
+    """
+    __slots__ = ('channel', 'chunks', 'missing', 'size', 'deadline', 'nackable', 'updated', 'nacks')
+
+    def __init__(self, channel, count, deadline, nackable=False, updated=None):
+        """
+        :param channel: The channel the message is sent on
+        :param count: The number of fragments in the message, None for a legacy message of unknown length
+        :param deadline: The time when the message is discarded if still incomplete
+        :param nackable: True if the sender keeps the fragments for retransmission
+        :param updated: The time the latest fragment was received
+        """
+        self.channel = channel
+        self.chunks = [None] * count if count else []
+        self.missing = count
+        self.size = 0
+        self.deadline = deadline
+        self.nackable = nackable
+        self.updated = updated
+        self.nacks = 0
+
+
+class Reassembler(object):
+    """
+    A table of partially received messages keyed by (clientId, mid).
+    Each fragment is stored in O(1) by its index so fragments may arrive in any order and
+    any number of messages may be in progress at the same time.
+    Entries are discarded when their deadline expires or when the table grows above maxBytes.
+    The keys of completed messages are remembered for timeout seconds, so fragments resent for other receivers do
+    not start the message again.
+    """
+
+    def __init__(self, timeout, maxBytes, maxFragments, maxCompleted=4096):
+        """
+        :param timeout: Seconds from the first received fragment until an incomplete message is discarded
+        :param maxBytes: The maximum number of payload bytes held in incomplete messages
+        :param maxFragments: The largest fragment count accepted for a message
+        :param maxCompleted: The largest number of completed messages remembered
+        """
+        self.timeout = timeout
+        self.maxBytes = maxBytes
+        self.maxFragments = maxFragments
+        self.partials = OrderedDict()  # Insertion order is also deadline order
+        self.maxCompleted = maxCompleted
+        self.completed = OrderedDict()  # key: time until it is remembered, insertion order is also expiry order
+        self.lock = Lock()  # Client.run may be running in several threads
+        self.size = 0
+        self.expired = 0
+        self.dropped = 0
+        self.late = 0  # Fragments of messages that were already completed
+        self.__lastScan = 0
+
+    def __len__(self):
+        return len(self.partials)
+
+    def __contains__(self, key):
+        return key in self.partials
+
+    def add(self, clientId, mid, channel, index, count, chunk, now=None, nackable=False, resent=False):
+        """
+        Store a fragment
+        :param clientId: The id of the sending client
+        :param mid: The message id
+        :param channel: The channel of the message
+        :param index: The index of this fragment, starting at 0
+        :param count: The total number of fragments of the message
+        :param chunk: The payload of this fragment
+        :param nackable: True if the sender keeps the fragments for retransmission
+        :param resent: True if the fragment was resent on request, possibly of another receiver, in which case it does
+                not make a new message nackable
+        :return: The payload of the complete message as bytes if this was the last missing fragment, otherwise None
+        """
+        now = now or time.time()
+        with self.lock:
+            if not 0 <= index < count <= self.maxFragments:
+                self.dropped += 1
+                return None
+            key = (clientId, mid)
+            partial = self.partials.get(key)
+            if partial is None:
+                if count == 1:
+                    return bytes(chunk)
+                if self.completed.get(key, 0) > now:
+                    self.late += 1
+                    return None
+                partial = Partial(channel, count, now + self.timeout, nackable and not resent)
+                self.partials[key] = partial
+            elif len(partial.chunks) != count:
+                return None  # Fragment count does not match the message in progress
+            if partial.chunks[index] is not None:
+                return None  # Duplicate
+            partial.chunks[index] = bytes(chunk)
+            partial.updated = now
+            partial.missing -= 1
+            partial.size += len(chunk)
+            self.size += len(chunk)
+            if partial.missing == 0:
+                return self.__complete(key, partial, now)
+            self.__shrink()
+            return None
+
+    def addLegacy(self, clientId, mid, channel, chunk, more, now=None):
+        """
+        Store a fragment sent by a peer without fragment numbering, where fragments are identified by arrival order
+        and all but the last fragment fill a whole datagram.
+        :param more: True if more fragments follow this one
+        :return: The payload of the complete message as bytes if this was the last fragment, otherwise None
+        """
+        now = now or time.time()
+        with self.lock:
+            key = (clientId, mid)
+            partial = self.partials.get(key)
+            if partial is None:
+                if not more:
+                    return bytes(chunk)
+                partial = Partial(channel, None, now + self.timeout)
+                self.partials[key] = partial
+            partial.chunks.append(bytes(chunk))
+            partial.size += len(chunk)
+            self.size += len(chunk)
+            if not more:
+                return self.__complete(key, partial, now)
+            self.__shrink()
+            return None
+
+    def expire(self, now=None):
+        """
+        Discard all messages whose deadline has passed
+        :return: the number of discarded messages
+        """
+        with self.lock:
+            now = now or time.time()
+            count = 0
+            while self.partials:
+                key, partial = next(iter(self.partials.items()))
+                if partial.deadline > now:
+                    break
+                self.__discard(key)
+                count += 1
+            self.expired += count
+            return count
+
+    def stale(self, delay, maxNacks, maxIndices, now=None):
+        """
+        Find messages from senders that keep fragments for retransmission where no fragment has arrived for delay
+        seconds. Each message is reported at most maxNacks times, with the delay doubling each time.
+        The table is scanned at most once per delay/2 seconds.
+        :param maxIndices: the largest number of missing fragment indices reported per message
+        :return: a list of (clientId, mid, list of missing fragment indices)
+        """
+        now = now or time.time()
+        found = []
+        with self.lock:
+            if now < self.__lastScan + delay / 2:
+                return found
+            self.__lastScan = now
+            for (clientId, mid), partial in self.partials.items():
+                if not partial.nackable or partial.nacks >= maxNacks or now < partial.updated + delay * 2 ** partial.nacks:
+                    continue
+                partial.nacks += 1
+                missing = [i for i, chunk in enumerate(partial.chunks) if chunk is None][:maxIndices]
+                found.append((clientId, mid, missing))
+        return found
+
+    def __complete(self, key, partial, now):
+        self.partials.pop(key)
+        self.size -= partial.size
+        self.completed[key] = now + self.timeout
+        while self.completed:
+            oldest, until = next(iter(self.completed.items()))
+            if until > now and len(self.completed) <= self.maxCompleted:
+                break
+            del self.completed[oldest]
+        return b''.join(partial.chunks)
+
+    def __discard(self, key):
+        partial = self.partials.pop(key)
+        self.size -= partial.size
+
+    def __shrink(self):
+        while self.size > self.maxBytes and self.partials:
+            self.__discard(next(iter(self.partials)))
+            self.dropped += 1
@@ -0,0 +1,268 @@
+"""
+    Recording of bus traffic to segment files, and replaying of recordings onto a bus
+
+    A segment file holds SEGMENT_MAGIC followed by one record per datagram: RECORD (receive time, length) and the
+    datagram as it was on the wire. The index file next to it, segment path + '.idx', holds one INDEX entry per record
+    with the receive time, the offset of the record and the crc32 of its channel and mid, for seeking without reading
+    the segment.
+
+    Record the group with
+        python -m tiipbusclient.recording record <path> [--port 26000] [--address ff01::1] [--duration seconds]
+    and replay a recording with
+        python -m tiipbusclient.recording replay <path> [--speed 1 | --max] [--channel <channel>]
+"""
+import argparse
+import bisect
+import logging
+import mmap
+import select
+import struct
+import time
+import uuid
+import zlib
+from threading import Thread, Lock
+from tiipbusclient import multicasting
+from tiipbusclient.multicasting import ClientConstants
+from tiipbusclient.client import Client, openMulticastSocket
+
+__status__ = 'Development'
+
+SEGMENT_MAGIC = b'TBREC1\n'
+RECORD = struct.Struct('!dI')  # Receive time in seconds since the epoch, length of the datagram
+INDEX = struct.Struct('!dQII')  # Receive time, offset of the record, crc32 of the channel, crc32 of the mid
+
+
+def _crc(text):
+    return zlib.crc32(text.encode('UTF-8'))
+
+
+class Recorder(object):
+    """
+    Appends datagrams with their receive time to a segment file and its index. A recorder either listens to a group
+    with a socket of its own, or is attached to a client and records every datagram the client receives.
+    """
+
+    def __init__(self, path):
+        """
+        Open the segment file path and its index for appending, creating them if needed
+        """
+        self.path = path
+        self.segment = open(path, 'ab')
+        if self.segment.tell() == 0:
+            self.segment.write(SEGMENT_MAGIC)
+        self.index = open(path + '.idx', 'ab')
+        self.lock = Lock()
+        self.recorded = 0
+        self.socket = None
+        self.thread = None
+        self.closing = False
+
+    def record(self, datagram, length=None, timestamp=None):
+        """
+        Append a datagram
+        :param datagram: a bytes-like object holding the datagram
+        :param length: the length of the datagram, if None all of datagram
+        :param timestamp: the receive time, if None now
+        """
+        if length is None:
+            length = len(datagram)
+        if timestamp is None:
+            timestamp = time.time()
+        header = multicasting.peekHeader(datagram, length)
+        channel, mid = (header[1], header[2]) if header else ('', '')
+        with self.lock:
+            if self.closing:
+                return
+            offset = self.segment.tell()
+            self.segment.write(RECORD.pack(timestamp, length))
+            self.segment.write(memoryview(datagram)[:length])
+            self.index.write(INDEX.pack(timestamp, offset, _crc(channel), _crc(mid)))
+            self.recorded += 1
+
+    def attach(self, client):
+        """
+        Record every datagram client receives, including its own, before it is parsed
+        """
+        client.recorder = self
+
+    def listen(self, port=26000, address='ff01::1', transport=openMulticastSocket):
+        """
+        Record all datagrams sent to a group in a thread of its own
+        :param transport: see Client
+        """
+        self.socket = transport(port, address)
+        self.thread = Thread(target=self.__listen, daemon=True)
+        self.thread.start()
+
+    def __listen(self):
+        while not self.closing:
+            try:
+                if not select.select([self.socket], [], [], 0.5)[0]:
+                    continue
+                datagram, _ = self.socket.recvfrom(ClientConstants.MAXSIZE)
+            except (OSError, ValueError):
+                return  # Closed
+            if datagram:
+                self.record(datagram)
+
+    def flush(self):
+        """
+        Write the buffered records, so a Recording opened now sees them
+        """
+        with self.lock:
+            self.segment.flush()
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+        if self.socket:
+            self.socket.close()
+            self.thread.join(1)
+        with self.lock:
+            self.segment.close()
+            self.index.close()
+
+
+class Recording(object):
+    """
+    Reads a segment file written by a Recorder through a memory map
+    """
+
+    def __init__(self, path):
+        """
+        Open the segment file path and read its index. Records written after opening are not seen.
+        """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            self.close()
+            raise Exception(path + " is not a recording")
+        self.view = memoryview(self.map)
+        with open(path + '.idx', 'rb') as index:
+            data = index.read()
+        size = len(self.map)
+        # Leave out records that were not completely written when the recording was opened
+        self.entries = [entry for entry in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size])
+                        if entry[1] + RECORD.size <= size and
+                        entry[1] + RECORD.size + RECORD.unpack_from(self.map, entry[1])[1] <= size]
+        self.times = [entry[0] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def datagram(self, i):
+        """
+        :return: the receive time and a memoryview of record i, valid until the recording is closed
+        """
+        offset = self.entries[i][1]
+        timestamp, length = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        return timestamp, self.view[start:start + length]
+
+    def find(self, start=None, end=None, channel=None, mid=None):
+        """
+        :param start: the earliest receive time, in seconds since the epoch
+        :param end: the latest receive time
+        :param channel: only datagrams on this channel, e.g. 'pub/status'
+        :param mid: only datagrams of this message
+        :return: a generator of (receive time, datagram) for the matching records in recorded order, where datagram is
+                a memoryview valid until the recording is closed. Receive times are expected to increase, the clock
+                of the recorder should not be set back while recording.
+        """
+        channelHash = _crc(channel) if channel is not None else None
+        midHash = _crc(mid) if mid is not None else None
+        first = bisect.bisect_left(self.times, start) if start is not None else 0
+        for i in range(first, len(self.entries)):
+            timestamp, _, entryChannel, entryMid = self.entries[i]
+            if end is not None and timestamp > end:
+                return
+            if channelHash is not None and entryChannel != channelHash or midHash is not None and entryMid != midHash:
+                continue
+            timestamp, datagram = self.datagram(i)
+            if channel is not None or mid is not None:
+                header = multicasting.peekHeader(bytes(datagram), len(datagram))  # Rule out crc32 collisions
+                if not header or channel is not None and header[1] != channel or mid is not None and header[2] != mid:
+                    continue
+            yield timestamp, datagram
+
+    def replay(self, client, speed=1.0, start=None, end=None, channel=None):
+        """
+        Send recorded datagrams, unchanged, to the group of client
+        :param client: the client whose socket, address and port to send with
+        :param speed: 1 for the recorded pace, N for N times faster, None or 0 for as fast as possible
+        :param start: see find
+        :param end: see find
+        :param channel: see find
+        :return: the number of sent datagrams
+        """
+        address = (client.ADDR, client.PORT)
+        sent = 0
+        first = began = None
+        for timestamp, datagram in self.find(start, end, channel):
+            if speed:
+                if first is None:
+                    first, began = timestamp, time.monotonic()
+                delay = began + (timestamp - first) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            client.socket.sendto(datagram, address)
+            sent += 1
+        return sent
+
+    def close(self):
+        view = getattr(self, 'view', None)
+        if view is not None:
+            try:
+                view.release()
+                self.map.close()
+            except BufferError:
+                pass  # Datagrams are still in use, the map is closed when they are released
+        else:
+            self.map.close()
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='record the traffic of a group')
+    record.add_argument('path')
+    record.add_argument('--port', type=int, default=26000)
+    record.add_argument('--address', default='ff01::1')
+    record.add_argument('--duration', type=float, help='seconds to record, until interrupted if not given')
+    replay = commands.add_parser('replay', help='replay a recording onto a group')
+    replay.add_argument('path')
+    replay.add_argument('--port', type=int, default=26000)
+    replay.add_argument('--address', default='ff01::1')
+    replay.add_argument('--speed', type=float, default=1.0, help='1 for the recorded pace, N for N times faster')
+    replay.add_argument('--max', action='store_true', help='replay as fast as possible')
+    replay.add_argument('--channel', help='only replay the datagrams on this channel')
+    args = parser.parse_args()
+    logging.basicConfig()
+    if args.command == 'record':
+        recorder = Recorder(args.path)
+        recorder.listen(args.port, args.address)
+        try:
+            if args.duration:
+                time.sleep(args.duration)
+            else:
+                while True:
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        recorder.close()
+        print("recorded %d datagrams" % recorder.recorded)
+    else:
+        recording = Recording(args.path)
+        client = Client('replay-' + uuid.uuid4().hex[:8], args.port, args.address)
+        try:
+            sent = recording.replay(client, None if args.max else args.speed, channel=args.channel)
+        finally:
+            client.close()
+            recording.close()
+        print("replayed %d datagrams" % sent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+    Caching of replies to requests that are sent again
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+__status__ = 'Development'
+
+
+class ReplyCache(object):
+    """
+    Replies sent by a bus interface keyed by (senderId, signal, mid). A request that is sent again with the same mid,
+    because the requester retried after losing the reply, gets the cached reply without running the handler again,
+    and a request that arrives again while the handler is still running is ignored. A request that has been running
+    for more than running seconds without a reply is taken as lost by its handler and runs again.
+    Entries are dropped after ttl seconds, and the oldest entries when there are more than maxEntries or the replies
+    take more than maxBytes.
+    """
+    PENDING = object()  # Returned by begin while the handler for the request is running
+
+    def __init__(self, maxEntries=1024, maxBytes=4 * 1024 * 1024, ttl=60, running=10):
+        """
+        :param maxEntries: the largest number of requests remembered
+        :param maxBytes: the largest number of reply bytes kept
+        :param ttl: seconds a request is remembered, should be longer than the requesters' timeout times retries
+        :param running: seconds a request without a reply is ignored when it arrives again, should be longer than the
+                handler takes to reply
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.running = running
+        self.entries = OrderedDict()  # key: [expires, reply, started], insertion order is also expiry order
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.duplicates = 0
+        self.restarted = 0  # Requests run again after running seconds without a reply
+
+    def __len__(self):
+        return len(self.entries)
+
+    def begin(self, senderId, signal, mid, now=None):
+        """
+        Look up a received request and mark it as running if it is new
+        :return: the cached reply as bytes, ReplyCache.PENDING if the request is already running, None if it is new
+        """
+        now = now or time.monotonic()
+        key = (senderId, signal, mid)
+        with self.lock:
+            self.__expire(now)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [now + self.ttl, None, now]
+                self.__shrink()
+                return None
+            if entry[1] is None:
+                if now < entry[2] + self.running:
+                    self.duplicates += 1
+                    return ReplyCache.PENDING
+                entry[2] = now
+                self.restarted += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def store(self, senderId, signal, mid, reply):
+        """
+        Keep a sent reply
+        :param reply: the reply as str or a bytes-like object
+        """
+        key = (senderId, signal, mid)
+        reply = reply.encode('UTF-8') if isinstance(reply, str) else bytes(reply)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return  # Not a request seen by begin, or already dropped
+            if entry[1] is not None:
+                self.size -= len(entry[1])
+            entry[1] = reply
+            self.size += len(reply)
+            self.__shrink()
+
+    def discard(self, senderId, signal, mid):
+        """
+        Forget a request, e.g. when its handler failed, so that a retry runs the handler again
+        """
+        with self.lock:
+            entry = self.entries.pop((senderId, signal, mid), None)
+            if entry is not None and entry[1] is not None:
+                self.size -= len(entry[1])
+
+    def abandon(self, senderId, signal, mid):
+        """
+        Forget a request if it has no reply, called when its handler has returned, so that a retry of a request the
+        handler failed, dropped or did not reply to runs the handler again
+        """
+        with self.lock:
+            key = (senderId, signal, mid)
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is None:
+                del self.entries[key]
+
+    def __expire(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[0] > now:
+                break
+            self.__drop(key)
+
+    def __shrink(self):
+        while self.entries and (len(self.entries) > self.maxEntries or self.size > self.maxBytes):
+            self.__drop(next(iter(self.entries)))
+
+    def __drop(self, key):
+        entry = self.entries.pop(key)
+        if entry[1] is not None:
+            self.size -= len(entry[1])
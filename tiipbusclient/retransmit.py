@@ -0,0 +1,79 @@
+"""
+    Retransmission of fragments lost on the way to a receiver
+"""
+import re
+from collections import OrderedDict
+from threading import Lock
+
+__status__ = 'Development'
+
+
+class RetransmitBuffer(object):
+    """
+    A bounded ring of recently sent fragments keyed by (mid, fragment index). Fragments of messages on the enabled
+    channels are kept and marked as retransmittable, and receivers that miss some of them ask for exactly those
+    fragments with a NACK frame. The oldest fragments are dropped when the buffer is full.
+    """
+
+    def __init__(self, channels=('.*',), maxEntries=4096, maxBytes=8 * 1024 * 1024):
+        """
+        :param channels: regular expressions matched against the full channel, e.g. 'pub/images/.*', for the channels
+                to keep fragments for
+        :param maxEntries: the largest number of fragments kept
+        :param maxBytes: the largest number of bytes kept
+        """
+        self.channels = [re.compile(pattern) for pattern in channels]
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.fragments = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.__enabled = dict()
+        self.stored = 0
+        self.resent = 0
+        self.missed = 0
+
+    def enabled(self, channel):
+        """
+        :return: True if fragments on channel are kept for retransmission
+        """
+        try:
+            return self.__enabled[channel]
+        except KeyError:
+            enabled = any(pattern.match(channel) for pattern in self.channels)
+            if len(self.__enabled) < 4096:
+                self.__enabled[channel] = enabled
+            return enabled
+
+    def store(self, mid, index, datagram, address=None):
+        """
+        Keep a sent fragment
+        :param datagram: the complete datagram as bytes
+        :param address: the address the datagram was sent to
+        """
+        with self.lock:
+            key = (mid, index)
+            old = self.fragments.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.fragments[key] = (datagram, address)
+            self.size += len(datagram)
+            self.stored += 1
+            while len(self.fragments) > self.maxEntries or self.size > self.maxBytes:
+                _, (dropped, _) = self.fragments.popitem(last=False)
+                self.size -= len(dropped)
+
+    def get(self, mid, indices):
+        """
+        :return: (datagram, address) for each kept fragment of mid with the given indices
+        """
+        datagrams = []
+        with self.lock:
+            for index in indices:
+                fragment = self.fragments.get((mid, index))
+                if fragment is None:
+                    self.missed += 1
+                else:
+                    datagrams.append(fragment)
+            self.resent += len(datagrams)
+        return datagrams
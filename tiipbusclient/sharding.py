@@ -0,0 +1,119 @@
+"""
+    Spreading of channels over several multicast groups
+"""
+import re
+import socket
+import struct
+import zlib
+
+__status__ = 'Development'
+
+# Linux delivers the traffic of every group joined by any socket on the port unless this is turned off
+IPV6_MULTICAST_ALL = getattr(socket, 'IPV6_MULTICAST_ALL', 29)
+
+_literalSegment = re.compile(r'([A-Za-z0-9_\-]+)(?:/|\$)')
+
+
+def _alternates(pattern):
+    """
+    :return: True if pattern has a '|' outside groups and character classes, so it may match topics with another
+            first segment
+    """
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == '[':
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            if pattern[i:i + 1] == ']':
+                i += 1  # A ']' first in a class is literal
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth <= 0:
+            return True
+        i += 1
+    return False
+
+
+class Sharding(object):
+    """
+    Maps each channel to one of a set of multicast groups by the crc32 of its key: the target client id of requests
+    and NACKs, the requesting client id of replies and the first topic segment of publications. Requests to several
+    or all clients, and other frames, are sent to the base group of the client, which every sharded client joins.
+    A client joins the group of its own id and the groups its subscriptions can match, so the kernel drops the
+    frames it has no use for. All clients on a bus must use the same groups.
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups: the IPv6 multicast addresses to spread channels over, e.g. ['ff01::1:1', 'ff01::1:2']
+        """
+        if not groups:
+            raise Exception("Sharding needs at least one group")
+        self.groups = list(groups)
+
+    def groupOf(self, key):
+        """
+        :return: the group for a client id or first topic segment
+        """
+        return self.groups[zlib.crc32(key.encode('UTF-8')) % len(self.groups)]
+
+    def groupFor(self, channel):
+        """
+        :return: the group to send a frame on channel to, None for the base group
+        """
+        kind = channel[:4]
+        if kind in ('pub/', 'shm/'):
+            return self.groupOf(channel[4:].split('/', 1)[0])
+        if kind in ('req/', 'rep/', 'nak/'):
+            target = channel[4:].split('/', 1)[0]
+            if kind == 'req/' and (target == '*' or '|' in target):
+                return None
+            return self.groupOf(target)
+        return None
+
+    def groupsForPattern(self, pattern):
+        """
+        :param pattern: a subscription pattern, matched against the start of topics
+        :return: the groups of the topics the pattern can match, all groups unless the whole pattern is confined to a
+                literal first segment, followed by '/' or '$' without a quantifier and without a '|' outside groups
+        """
+        match = _literalSegment.match(pattern)
+        if match and pattern[match.end():match.end() + 1] not in ('?', '*', '{') and not _alternates(pattern):
+            return [self.groupOf(match.group(1))]
+        return list(self.groups)
+
+
+class Memberships(object):
+    """
+    Joins and leaves groups on a socket, keeping count of the reasons to stay in each group
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.counts = dict()
+        sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MULTICAST_ALL, 0)
+
+    def join(self, group):
+        count = self.counts.get(group, 0)
+        if not count:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, self.__mreq(group))
+        self.counts[group] = count + 1
+
+    def leave(self, group):
+        count = self.counts.get(group, 0)
+        if count == 1:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_LEAVE_GROUP, self.__mreq(group))
+            del self.counts[group]
+        elif count:
+            self.counts[group] = count - 1
+
+    @staticmethod
+    def __mreq(group):
+        return socket.inet_pton(socket.AF_INET6, group) + struct.pack('@I', 0)
@@ -0,0 +1,223 @@
+"""
+    Shared memory rings for publications between clients on the same host
+"""
+import logging
+import re
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from multiprocessing import shared_memory, resource_tracker
+from tiipbusclient import multicasting
+
+__status__ = 'Development'
+
+HEADER = struct.Struct('QQ')  # The position after the latest reserved byte, and the size of the data area
+_created = set()  # Names of the rings created by this process
+
+
+def isInterfaceLocal(addr):
+    """
+    :return: True if addr is an interface-local IPv6 multicast address (ffx1::), which can not reach other hosts
+    """
+    return len(addr) > 4 and addr[:2].lower() == 'ff' and addr[3] == '1' and addr[4] == ':'
+
+
+class SharedRing(object):
+    """
+    A ring of message payloads in shared memory with a single writing process. Payloads are addressed by their
+    position in the stream of all written bytes. The writer stores the end of the region it is about to overwrite
+    before overwriting it, so a reader can tell whether a payload was overwritten before or while it was read.
+    """
+
+    def __init__(self, name=None, size=None):
+        """
+        Create a ring of size bytes with a new name, or attach to the existing ring name
+        """
+        if name is None:
+            self.shm = shared_memory.SharedMemory('tb_' + uuid.uuid4().hex[:24], create=True, size=size + HEADER.size)
+            HEADER.pack_into(self.shm.buf, 0, 0, size)
+            _created.add(self.shm.name)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            if name not in _created:
+                # Attaching registers the segment to be removed when this process exits, it belongs to the writer
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            self.owner = False
+        self.name = self.shm.name
+        self.head, self.size = HEADER.unpack_from(self.shm.buf, 0)
+        self.data = self.shm.buf[HEADER.size:HEADER.size + self.size]
+        self.lock = Lock()
+        self.written = time.monotonic()  # When the writer last wrote a payload
+
+    def write(self, payload):
+        """
+        :param payload: a bytes-like object
+        :return: the position of the payload, or None if it is larger than the ring
+        """
+        length = len(payload)
+        if length > self.size:
+            return None
+        with self.lock:
+            position = self.head
+            offset = position % self.size
+            if offset + length > self.size:
+                position += self.size - offset  # Payloads are not split at the end, start over at the beginning
+                offset = 0
+            HEADER.pack_into(self.shm.buf, 0, position + length, self.size)
+            self.data[offset:offset + length] = payload
+            self.head = position + length
+            self.written = time.monotonic()
+            return position
+
+    def read(self, position, length):
+        """
+        :return: the payload decoded as str, or None if it has been overwritten
+        """
+        offset = position % self.size
+        if offset + length > self.size or position + length > HEADER.unpack_from(self.shm.buf, 0)[0]:
+            return None  # Malformed
+        try:
+            message = str(self.data[offset:offset + length], 'UTF-8')
+        except UnicodeDecodeError:
+            message = None  # Overwritten while decoding
+        if HEADER.unpack_from(self.shm.buf, 0)[0] > position + self.size:
+            return None
+        return message
+
+    def close(self):
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.name)
+
+
+class SharedMemoryPublisher(object):
+    """
+    Writes publications on the enabled channels of a client to one ring per topic and sends only a notification
+    with the position of the payload on multicasting.SHM_CHANNEL + <topic>.
+    At most maxRings rings are kept. A new topic takes over from the least recently written ring once that has been
+    idle for idle seconds, when readers are done with it, until then its publications are sent normally.
+    """
+
+    def __init__(self, client, channels=('.*',), ringSize=4 * 1024 * 1024, maxRings=16, idle=5.0):
+        """
+        :param client: the client to send notifications with
+        :param channels: regular expressions matched against the topic for the publications to put in shared memory
+        :param ringSize: the size in bytes of the ring of each topic, larger payloads are published normally
+        :param maxRings: the largest number of rings, so at most maxRings * ringSize bytes of shared memory are used
+        :param idle: seconds without a write after which a ring may be removed to make room for another topic
+        """
+        self.client = client
+        self.channels = [re.compile(pattern) for pattern in channels]
+        self.ringSize = ringSize
+        self.maxRings = maxRings
+        self.idle = idle
+        self.rings = OrderedDict()  # Least recently written first
+        self.lock = Lock()
+        self.removed = 0  # Idle rings removed to make room for another topic
+        self.overflowed = 0  # Publications sent normally because all rings were in use
+        self.__enabled = dict()
+
+    def enabled(self, topic):
+        try:
+            return self.__enabled[topic]
+        except KeyError:
+            enabled = any(pattern.match(topic) for pattern in self.channels)
+            if len(self.__enabled) < 4096:
+                self.__enabled[topic] = enabled
+            return enabled
+
+    def publish(self, message, topic):
+        """
+        Publish a message through shared memory if topic is enabled
+        :return: the mid of the sent notification, None if the message should be published normally
+        """
+        if not self.enabled(topic):
+            return None
+        payload = message if isinstance(message, (bytes, bytearray, memoryview)) else bytes(message, 'UTF-8')
+        with self.lock:  # Held while writing, so a ring is not removed during a write
+            ring = self.rings.get(topic)
+            if ring is None:
+                ring = self.__add(topic)
+                if ring is None:
+                    self.overflowed += 1
+                    return None
+            else:
+                self.rings.move_to_end(topic)
+            position = ring.write(payload)
+        if position is None:
+            return None
+        return multicasting.send('%s,%d,%d' % (ring.name, position, len(payload)), multicasting.SHM_CHANNEL + topic,
+                                 self.client)
+
+    def __add(self, topic):
+        """
+        :return: a new ring for topic, or None if there are maxRings rings and none is idle
+        """
+        if len(self.rings) >= self.maxRings:
+            oldest = next(iter(self.rings.values()))
+            if oldest.written + self.idle > time.monotonic():
+                return None
+            self.rings.popitem(last=False)
+            oldest.close()
+            self.removed += 1
+        ring = self.rings[topic] = SharedRing(size=self.ringSize)
+        return ring
+
+    def close(self):
+        with self.lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings = OrderedDict()
+
+
+class SharedMemoryReader(object):
+    """
+    Reads the payloads of received shared memory notifications, keeping the most recently used rings attached
+    """
+
+    def __init__(self, maxRings=64):
+        self.maxRings = maxRings
+        self.rings = OrderedDict()
+        self.lock = Lock()
+        self.overwritten = 0
+        self.missing = 0
+
+    def read(self, body):
+        """
+        :param body: the body of a notification frame as str or a bytes-like object
+        :return: the payload as str, or None if it is not available
+        """
+        try:
+            name, position, length = multicasting.decode(body).split(',')
+            position, length = int(position), int(length)
+        except ValueError:
+            return None  # Malformed
+        with self.lock:
+            ring = self.rings.get(name)
+            if ring is None:
+                try:
+                    ring = SharedRing(name)
+                except (OSError, ValueError):
+                    self.missing += 1
+                    logging.getLogger('multicast-recv').warning("shared memory " + name + " is not available")
+                    return None
+                self.rings[name] = ring
+                if len(self.rings) > self.maxRings:
+                    self.rings.popitem(last=False)[1].close()
+            else:
+                self.rings.move_to_end(name)
+            message = ring.read(position, length)
+        if message is None:
+            self.overwritten += 1
+        return message
+
+    def close(self):
+        with self.lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings = OrderedDict()
@@ -0,0 +1,157 @@
+"""
+    Matching of publication topics against subscription patterns
+"""
+import re
+from collections import OrderedDict
+from threading import Lock
+
+__status__ = 'Development'
+
+_LITERAL = re.compile(r'[^\\.^$*+?{}\[\]|()]*')
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+class SubscriptionIndex(object):
+    """
+    An immutable index of subscriptions. Patterns are matched from the start of the topic, as with re.match, so
+    literal patterns and literal patterns ending in '.*' are prefix subscriptions kept in a trie, literal patterns
+    ending in '$' are exact subscriptions kept in a dict, and only the remaining patterns are run as regular
+    expressions, behind one combined pattern that rejects topics none of them match.
+    Resolved topics are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, entries, cacheSize):
+        """
+        :param entries: a dict of pattern -> (sequence number, callback)
+        :param cacheSize: the number of topics to keep resolved callbacks for
+        """
+        self.entries = entries
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.exact = dict()
+        self.prefixes = dict()
+        self.regexes = []
+        for pattern, (seq, callback) in entries.items():
+            if _LITERAL.fullmatch(pattern):
+                self.__addPrefix(pattern, seq, callback)
+            elif pattern.endswith('.*') and _LITERAL.fullmatch(pattern[:-2]):
+                self.__addPrefix(pattern[:-2], seq, callback)
+            elif pattern.endswith('$') and _LITERAL.fullmatch(pattern[:-1]):
+                self.exact.setdefault(pattern[:-1], []).append((seq, callback))
+                self.exact.setdefault(pattern[:-1] + '\n', []).append((seq, callback))  # $ also matches before a final newline
+            else:
+                self.regexes.append((seq, re.compile(pattern), callback))
+        self.combined = None
+        if len(self.regexes) > 1 and not any(_BACKREFERENCE.search(r.pattern) for _, r, _ in self.regexes):
+            try:
+                self.combined = re.compile('|'.join('(?:' + r.pattern + ')' for _, r, _ in self.regexes))
+            except re.error:
+                pass  # e.g. global flags inside a pattern, fall back to matching each pattern
+
+    def __addPrefix(self, prefix, seq, callback):
+        node = self.prefixes
+        for char in prefix:
+            node = node.setdefault(char, dict())
+        node.setdefault(None, []).append((seq, callback))
+
+    def match(self, topic):
+        """
+        :param topic: the topic of a publication
+        :return: a tuple of the callbacks of all subscriptions matching the topic, in subscription order
+        """
+        try:
+            callbacks = self.cache[topic]
+            self.cache.move_to_end(topic)
+            return callbacks
+        except KeyError:
+            pass
+        callbacks = self.__resolve(topic)
+        self.cache[topic] = callbacks
+        try:
+            if len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        except KeyError:
+            pass  # Evicted by another thread
+        return callbacks
+
+    def __resolve(self, topic):
+        found = list(self.exact.get(topic, ()))
+        node = self.prefixes
+        found.extend(node.get(None, ()))
+        for char in topic:
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        if self.regexes and (self.combined is None or self.combined.match(topic)):
+            found.extend((seq, callback) for seq, pattern, callback in self.regexes if pattern.match(topic))
+        found.sort(key=lambda entry: entry[0])
+        return tuple(callback for _, callback in found)
+
+
+class SubscriptionTable(object):
+    """
+    The subscriptions of a client. The index is copy-on-write: subscribe and unsubscribe build a new
+    SubscriptionIndex and swap it in, so matching never takes a lock and never waits for callbacks or writers.
+    """
+
+    def __init__(self, cacheSize=1024):
+        """
+        :param cacheSize: the number of topics to keep resolved callbacks for
+        """
+        self.lock = Lock()
+        self.cacheSize = cacheSize
+        self.index = SubscriptionIndex(dict(), cacheSize)
+        self.__seq = 0
+
+    def __len__(self):
+        return len(self.index.entries)
+
+    def __contains__(self, pattern):
+        return pattern in self.index.entries
+
+    def add(self, pattern, callback):
+        """
+        Add a subscription, replacing the callback if the pattern is already subscribed
+        :param pattern: The pattern to match
+        :param callback: the Callback object to run when a publication is received
+        :return: the replaced callback, or None
+        """
+        re.compile(pattern)  # Raise for invalid patterns before touching the index
+        with self.lock:
+            entries = dict(self.index.entries)
+            replaced = None
+            if pattern in entries:
+                seq, replaced = entries[pattern]
+                entries[pattern] = seq, callback
+            else:
+                self.__seq += 1
+                entries[pattern] = self.__seq, callback
+            self.index = SubscriptionIndex(entries, self.cacheSize)
+            return replaced
+
+    def remove(self, pattern):
+        """
+        Remove a subscription
+        :param pattern: The pattern to remove
+        :return: the callback of the removed subscription
+        :raises: KeyError if the pattern is not subscribed
+        """
+        with self.lock:
+            entries = dict(self.index.entries)
+            _, callback = entries.pop(pattern)
+            self.index = SubscriptionIndex(entries, self.cacheSize)
+            return callback
+
+    def callbacks(self):
+        """
+        :return: a list of the callbacks of all subscriptions
+        """
+        return [callback for _, callback in self.index.entries.values()]
+
+    def match(self, topic):
+        """
+        :param topic: the topic of a publication
+        :return: a tuple of the callbacks of all subscriptions matching the topic
+        """
+        return self.index.match(topic)
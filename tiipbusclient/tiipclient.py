@@ -1,13 +1,97 @@
 """
     Client for communication over UDP Multicast with Tiip protocol
 """
-from tiipbusclient.client import Client, Callback
+from tiipbusclient import multicasting
+from tiipbusclient.client import Client, Callback, DispatchedCallback, QueuedCallback, openMulticastSocket, finishing
+from tiipbusclient.dispatcher import Dispatcher, DeliveryQueue
+from tiipbusclient.metrics import measured
 from pytiip.tiip import TIIPMessage
 from threading import Thread
 
 __status__ = 'Development'
 
 
+class CachedTiipMessage(TIIPMessage):
+    """
+    A TIIPMessage that keeps its serialized form until one of its fields is set, for messages that are sent many
+    times. Changing a list or dict inside a field is not noticed, call changed() after doing that.
+    """
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        self.__dict__.pop('_CachedTiipMessage__text', None)
+
+    def __str__(self):
+        text = self.__dict__.get('_CachedTiipMessage__text')
+        if text is None:
+            text = self.__dict__['_CachedTiipMessage__text'] = TIIPMessage.__str__(self)
+        return text
+
+    def changed(self):
+        """
+        Forget the serialized form after changing the contents of a field
+        """
+        self.__dict__.pop('_CachedTiipMessage__text', None)
+
+
+class _Frame(object):
+    """
+    The body of a received frame, parsed at most once for all callbacks it is passed to
+    """
+    __slots__ = ('body', 'mid', 'message')
+
+    def __init__(self, body, mid):
+        self.body = body
+        self.mid = mid
+        self.message = None
+
+    def parsed(self):
+        message = self.message
+        if message is None:
+            message = TIIPMessage(multicasting.decode(self.body))
+            message.mid = self.mid
+            self.message = message
+        return message
+
+
+def _payloadFrame(payload, mid):
+    return _Frame(payload.data, mid)  # Not the payload itself, which keeps the frame
+
+
+def _frameFor(body, mid):
+    """
+    :return: the _Frame for body, shared through a multicasting.Payload by the callbacks it is dispatched to, a new
+            _Frame for a body received as str
+    """
+    if isinstance(body, multicasting.Payload):
+        return body.parsed(_payloadFrame, mid)
+    return _Frame(body, mid)
+
+
+class SharedTiipMessage(TIIPMessage):
+    """
+    A received TIIPMessage for one callback. The frame is parsed when a field of any of the messages made from it is
+    first read, once for all of them, and each message then takes its own copy of the parsed fields, so setting a
+    field does not change the message of another callback. The src list is copied as well, other lists and dicts
+    inside fields are shared and must not be changed.
+    """
+
+    # noinspection PyMissingConstructor
+    def __init__(self, frame):
+        self.__frame = frame
+
+    def __getattr__(self, name):
+        # Only called for fields that are not loaded yet
+        frame = self.__dict__.get('_SharedTiipMessage__frame')
+        if frame is None or not name.startswith('_TIIPMessage__') or '_TIIPMessage__pv' in self.__dict__:
+            raise AttributeError(name)
+        for key, value in vars(frame.parsed()).items():
+            if key == '_TIIPMessage__src' and value is not None:
+                value = list(value)  # Extended when the message is forwarded as a request
+            self.__dict__.setdefault(key, value)  # Fields set before the first read are kept
+        return getattr(self, name)
+
+
 class TiipCallback(Callback):
     """
         A callback object, for use with the multicast client, that uses TIIP based messages
@@ -29,9 +113,8 @@ class TiipCallback(Callback):
         :param message: The actual message to send as an argument to the target function as a string
         :return: None (but the clients reply function is invoked with the return value of the target function)
         """
-        req = TIIPMessage(message)
-        req.mid = mid
-        reply = self.target(req)
+        req = SharedTiipMessage(_frameFor(message, mid))
+        reply = measured(client, signal, self.target)(req)
         if reply:
             client.reply(str(reply), senderId, signal, mid)
 
@@ -40,6 +123,8 @@ class ThreadedTiipCallback(Callback):
     """
         A callback object, for use with the multicast client, that spawns a thread to run the target function with a TIIPMessage
     """
+    deferred = True
+
     def __init__(self, target):
         """
         Construct a callback object, for use with the multicast client, that uses the target function
@@ -57,9 +142,80 @@ class ThreadedTiipCallback(Callback):
         :param message: a stringified TIIPMessage to send as an argument to the target function
         :return: None (the reply needs to be handled in the target function)
         """
-        req = TIIPMessage(message)
-        req.mid = mid
-        Thread(target=self.target, args=(req,), daemon=True).start()
+        req = SharedTiipMessage(_frameFor(message, mid))
+        Thread(target=finishing(client, senderId, signal, mid, measured(client, signal, self.target)), args=(req,),
+               daemon=True).start()
+
+
+class DispatchedTiipCallback(DispatchedCallback):
+    """
+        A callback object, for use with the multicast client, that runs the target function with a TIIPMessage on a Dispatcher
+    """
+
+    def call(self, client, senderId, signal, mid, message):
+        """
+        The call function that queues the target function on the dispatcher.
+        :param client: The multicast client that controls this Callback object.
+        :param senderId: The id of the multicast client .
+        :param signal: The signal of the reply message.
+        :param mid: The message id of the request to respond to.
+        :param message: a stringified TIIPMessage to send as an argument to the target function
+        :return: None (the reply needs to be handled in the target function)
+        """
+        req = SharedTiipMessage(_frameFor(message, mid))
+        self.submit(client, senderId, signal, mid, req)
+
+
+class QueuedTiipCallback(QueuedCallback):
+    """
+        A callback object, for use with the multicast client, that queues publications and runs the target function
+        with a TIIPMessage on a thread of its own
+    """
+
+    def __init__(self, target, queue=None):
+        """
+        Construct a callback object, for use with the multicast client, that uses the target function
+        :param target: The function to execute when running the Callback. The function should take a TIIPMessage as argument
+        :param queue: see QueuedCallback
+        """
+        QueuedCallback.__init__(self, target, queue, False)
+
+    def deliver(self, client, senderId, signal, mid, message):
+        """
+        Run the target function for a message taken from the queue, parsing it only if it was not replaced
+        """
+        req = SharedTiipMessage(_frameFor(message, mid))
+        measured(client, signal, self.target)(req)
+
+
+class _TextCallback(Callback):
+    """
+        Passes the messages to a Callback object as str, for a client that receives them as multicasting.Payload
+    """
+
+    def __init__(self, callback):
+        """
+        :param callback: the Callback object to pass the messages to
+        """
+        Callback.__init__(self, callback.call)
+        self.callback = callback
+        self.deferred = getattr(callback, 'deferred', False)
+
+    def call(self, client, senderId, signal, mid, message):
+        self.callback.call(client, senderId, signal, mid, multicasting.decode(message))
+
+    def close(self):
+        self.callback.close()
+
+
+def _textual(callback):
+    """
+    :return: callback if it is one of the TIIP callbacks, which take multicasting.Payload messages, otherwise a
+            _TextCallback for it
+    """
+    if isinstance(callback, (TiipCallback, ThreadedTiipCallback, DispatchedTiipCallback, QueuedTiipCallback)):
+        return callback
+    return _TextCallback(callback)
 
 
 class TiipClient:
@@ -67,18 +223,33 @@ class TiipClient:
     A TIIPMessage aware multicastclient
     """
 
-    def __init__(self, clientId, port=26000, address='ff01::1'):
-        self.c = Client(clientId, port, address)
+    def __init__(self, clientId, port=26000, address='ff01::1', dispatcher=None, transport=openMulticastSocket,
+                 sharding=None):
+        """
+        :param dispatcher: a Dispatcher to run threaded callbacks on, if None each callback is run in a new thread
+        :param transport: see Client
+        :param sharding: see Client
+        """
+        # Messages are received as multicasting.Payload, through which the TIIP callbacks of a frame parse it once,
+        # other Callback objects get them as str through _TextCallback
+        self.c = Client(clientId, port, address, transport=transport, sharding=sharding, lazyPayloads=True)
+        self.dispatcher = dispatcher
         t = Thread(target=self.run, daemon=True)
         t.start()
 
     def publish(self, message):
-        message.type = "pub"
+        """
+        :param message: a TIIPMessage, a CachedTiipMessage is only serialized again after it has changed
+        """
+        if message.type != "pub":
+            message.type = "pub"
         self.c.publish(str(message), message.ch)
 
     def reply(self, request, reply):
-        reply.mid = request.mid
-        reply.sig = request.sig
+        if reply.mid != request.mid:
+            reply.mid = request.mid
+        if reply.sig != request.sig:
+            reply.sig = request.sig
         self.c.reply(str(reply), request.src[-1], reply.sig, reply.mid)
 
     def unsubscribe(self, pattern):
@@ -96,34 +267,88 @@ class TiipClient:
     def close(self):
         self.c.close()
 
+    def enablePresence(self, interval=2.0, load=None, misses=3, announce=True, failFast=True):
+        """
+        Announce this client and keep a directory of the clients on the bus, see Client.enablePresence
+        """
+        self.c.enablePresence(interval, load, misses, announce, failFast)
+
+    def servers(self, signal):
+        """
+        :return: the ids of the clients on the bus that serve signal, least loaded first, see Client.servers
+        """
+        return self.c.servers(signal)
+
     def request(self, message, timeout=None, retry=None):
-        if message.src:
-            if not message.src[-1] == self.c.clientId:
-                message.src.append(self.c.clientId)
-        else:
-            message.src = [self.c.clientId]
+        self.__addSource(message)
         responseString = self.c.request("/".join(message.targ), message.sig, str(message), timeout, retry)
         if responseString:
             _, _, _, reply = responseString.split(',', 3)
             return TIIPMessage(reply)
 
-    def subscribe(self, pattern, callback, threaded=True):
+    def requestAll(self, message, receiverIds, timeout=None, count=None, until=None):
+        """
+        Send one request to several clients and collect their replies as they arrive, see Client.requestAll
+        :param receiverIds: a list of the ids of the clients to receive the request, or multicasting.ALL_RECEIVERS
+        :param until: a function taking a reply TIIPMessage that returns True to stop after that reply
+        :return: an iterator of the reply TIIPMessages
+        """
+        self.__addSource(message)
+        frames = self.c.requestAll(receiverIds, message.sig, str(message), timeout, count)
+        return self.__replies(frames, until)
+
+    def __addSource(self, message):
+        if message.src:
+            if not message.src[-1] == self.c.clientId:
+                message.src = message.src + [self.c.clientId]  # A new list, src may be shared with other messages
+        else:
+            message.src = [self.c.clientId]
+
+    @staticmethod
+    def __replies(frames, until):
+        for frame in frames:
+            _, _, _, body = frame.split(',', 3)
+            reply = TIIPMessage(body)
+            yield reply
+            if until and until(reply):
+                frames.close()
+                return
+
+    def subscribe(self, pattern, callback, threaded=True, orderBy=Dispatcher.BY_TOPIC, maxQueue=None,
+                  overflow=DeliveryQueue.CONFLATE, snapshot=False):
+        """
+        :param maxQueue: see ThreadedClient.subscribe
+        :param overflow: see ThreadedClient.subscribe
+        :param snapshot: see Client.subscribe
+        :return: the Callback object of the subscription
+        """
         if isinstance(callback, Callback):
-            self.c.subscribe(pattern, callback)
+            self.c.subscribe(pattern, _textual(callback), snapshot)
         else:
-            if threaded:
-                self.c.subscribe(pattern, ThreadedTiipCallback(callback))
+            if maxQueue:
+                callback = QueuedTiipCallback(callback, DeliveryQueue(maxQueue, overflow))
+            elif threaded:
+                if self.dispatcher:
+                    callback = DispatchedTiipCallback(callback, self.dispatcher, orderBy)
+                else:
+                    callback = ThreadedTiipCallback(callback)
             else:
-                self.c.subscribe(pattern, TiipCallback(callback))
+                callback = TiipCallback(callback)
+            self.c.subscribe(pattern, callback, snapshot)
+        return callback
 
-    def registerBusInterface(self, signal, callback, threaded=True):
+    def registerBusInterface(self, signal, callback, threaded=True, orderBy=Dispatcher.BY_SENDER, replyCache=None):
         if isinstance(callback, Callback):
-            self.c.registerBusInterface(signal, callback)
+            self.c.registerBusInterface(signal, _textual(callback), replyCache)
         else:
             if threaded:
-                self.c.registerBusInterface(signal, ThreadedTiipCallback(callback))
+                if self.dispatcher:
+                    self.c.registerBusInterface(signal, DispatchedTiipCallback(callback, self.dispatcher, orderBy),
+                                                replyCache)
+                else:
+                    self.c.registerBusInterface(signal, ThreadedTiipCallback(callback), replyCache)
             else:
-                self.c.registerBusInterface(signal, TiipCallback(callback))
+                self.c.registerBusInterface(signal, TiipCallback(callback), replyCache)
 
     def unregisterBusInterface(self, signal):
         self.c.unregisterBusInterface(signal)
@@ -0,0 +1,206 @@
+"""
+    Transports that carry the frames of clients in the same process or on the same host without UDP multicast
+
+    A transport is opened with transport(port, addr), like client.openMulticastSocket, and is used by the client in
+    place of its socket. It provides the part of the socket interface that multicasting uses:
+        sendto(data, address) and optionally sendmsg(buffers, ancdata, flags, address) to send to the whole group
+        recvfrom(size) and recv_into(buffer, size, flags) to receive, where a non zero flags does not block
+        fileno() for select, readable while datagrams are waiting
+        close()
+    Like multicast with loopback, a sent datagram is also delivered to the sender, which skips its own frames.
+"""
+import os
+import select
+import socket
+import tempfile
+import time
+import uuid
+from collections import deque
+from threading import Lock, Condition
+from tiipbusclient.multicasting import ClientConstants
+
+__status__ = 'Development'
+
+
+class InProcessTransport(object):
+    """
+    Delivers datagrams to the other transports of the same port and address in this process by reference, without
+    a system call per receiver and without copying them. Datagrams to a receiver holding maxBytes waiting bytes are
+    dropped, like datagrams to a full socket receive buffer.
+    """
+    groups = dict()  # (port, addr): list of transports
+    groupsLock = Lock()
+
+    def __init__(self, port, addr, maxBytes=None):
+        """
+        Open a transport and join the group of port and addr
+        :param maxBytes: the largest number of bytes waiting to be received, ClientConstants.RECEIVE_BUFFER if None
+        """
+        self.key = (port, addr)
+        self.queue = deque()
+        self.maxBytes = maxBytes or ClientConstants.RECEIVE_BUFFER
+        self.size = 0
+        self.dropped = 0  # Datagrams dropped because the queue was full
+        self.condition = Condition()
+        self.closed = False
+        self.__readable, self.__signal = os.pipe()  # Holds one byte while the queue is not empty, for select
+        with InProcessTransport.groupsLock:
+            InProcessTransport.groups[self.key] = InProcessTransport.groups.get(self.key, []) + [self]
+
+    def fileno(self):
+        return self.__readable
+
+    def sendto(self, data, address):
+        datagram = data if isinstance(data, bytes) else bytes(data)
+        for transport in InProcessTransport.groups.get(self.key, ()):
+            transport.deliver(datagram, address)
+        return len(datagram)
+
+    def sendmsg(self, buffers, ancdata, flags, address):
+        return self.sendto(b''.join(buffers), address)
+
+    def deliver(self, datagram, address):
+        with self.condition:
+            if self.closed:
+                return
+            if self.size + len(datagram) > self.maxBytes:
+                self.dropped += 1  # The receiver is not keeping up
+                return
+            self.queue.append((datagram, address))
+            self.size += len(datagram)
+            if len(self.queue) == 1:
+                os.write(self.__signal, b'x')
+                self.condition.notify()
+
+    def recvfrom(self, size, flags=0):
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    return b'', None  # An empty datagram is dropped as malformed
+                if flags:
+                    raise BlockingIOError()
+                self.condition.wait()
+            datagram, address = self.queue.popleft()
+            self.size -= len(datagram)
+            if not self.queue:
+                os.read(self.__readable, 1)
+        return datagram[:size], address
+
+    def recv_into(self, buffer, size=0, flags=0):
+        datagram, _ = self.recvfrom(size or len(buffer), flags)
+        buffer[:len(datagram)] = datagram
+        return len(datagram)
+
+    def close(self):
+        with InProcessTransport.groupsLock:
+            group = [transport for transport in InProcessTransport.groups.get(self.key, []) if transport is not self]
+            if group:
+                InProcessTransport.groups[self.key] = group
+            else:
+                InProcessTransport.groups.pop(self.key, None)
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.clear()
+            self.size = 0
+            self.condition.notify_all()
+        os.close(self.__signal)
+        os.close(self.__readable)
+
+
+class UnixTransport(object):
+    """
+    Sends datagrams to every Unix domain datagram socket in the directory of the group. Each transport binds a
+    socket there when opened and removes it when closed, and sockets left behind by processes that exited are
+    removed when sending to them fails. A receiver with a full queue holds the sender back for at most sendTimeout
+    seconds before the datagram to it is dropped.
+    """
+
+    def __init__(self, port, addr, directory=None, sendTimeout=0.1):
+        """
+        Open a transport and join the group of port and addr
+        :param directory: the directory holding the sockets of the group, a directory in the temporary directory
+                named after port and addr if None
+        :param sendTimeout: the longest time in seconds to wait for room in the queue of a receiver
+        """
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'tiipbus-%s-%d' % (addr.replace(':', '_'), port))
+        self.directory = directory
+        self.sendTimeout = sendTimeout
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, uuid.uuid4().hex + '.sock')
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        self.lock = Lock()
+        self.__peers = dict()  # path: socket connected to it
+        self.__listed = None
+        self.__listedAt = 0
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def __members(self):
+        try:
+            listed = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return []
+        # The modification time is coarse, so list again while a change in the same tick could be hidden
+        if listed != self.__listed or self.__listedAt - listed < 50000000:
+            self.__listed = listed
+            self.__listedAt = time.time_ns()
+            paths = set(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                        if name.endswith('.sock'))
+            for path in set(self.__peers) - paths:
+                self.__peers.pop(path).close()
+            for path in paths - set(self.__peers):
+                peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                peer.setblocking(False)
+                try:
+                    peer.connect(path)
+                except OSError:
+                    peer.close()
+                    self.__remove(path)
+                    continue
+                self.__peers[path] = peer
+        return list(self.__peers.items())
+
+    def __remove(self, path):
+        try:
+            os.unlink(path)  # The owner has exited
+        except OSError:
+            pass
+
+    def sendto(self, data, address):
+        return self.sendmsg((data,), (), 0, address)
+
+    def sendmsg(self, buffers, ancdata, flags, address):
+        sent = 0
+        with self.lock:
+            for path, peer in self.__members():
+                try:
+                    try:
+                        sent = peer.sendmsg(buffers, ancdata, flags)
+                    except BlockingIOError:
+                        if select.select([], [peer], [], self.sendTimeout)[1]:
+                            sent = peer.sendmsg(buffers, ancdata, flags)
+                except BlockingIOError:
+                    pass  # The receiver is not keeping up, drop the datagram like a full multicast receive buffer
+                except OSError:
+                    self.__peers.pop(path).close()
+                    self.__remove(path)
+        return sent
+
+    def recvfrom(self, size, flags=0):
+        return self.socket.recvfrom(size, flags)
+
+    def recv_into(self, buffer, size=0, flags=0):
+        return self.socket.recv_into(buffer, size, flags)
+
+    def close(self):
+        self.socket.close()
+        with self.lock:
+            for peer in self.__peers.values():
+                peer.close()
+            self.__peers = dict()
+        self.__remove(self.path)